@@ -1,3 +1,9 @@
-from .mac_sql import MACSQL
-
 __all__ = ["MACSQL"]
+
+
+def __getattr__(name):
+    #importing the package stays cheap, mac_sql and its dependencies load on first use
+    if name == "MACSQL":
+        from .mac_sql import MACSQL
+        return MACSQL
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
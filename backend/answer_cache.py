@@ -0,0 +1,77 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+
+#only sentence punctuation hanging off the end of a word, "> 100", "-5" and "1.5" have to stay as they are
+_TRAILING_PUNCT = re.compile(r"[?!.,;:]+(?=\s|$)")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    #"Top 5 customers?" and "top 5   customers" should land on the same entry
+    folded = _TRAILING_PUNCT.sub(" ", question.lower())
+    return _SPACES.sub(" ", folded).strip()
+
+
+class AnswerCache:
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.fingerprint: Optional[str] = None
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_fingerprint(self, fingerprint: str):
+        #schema moved on, every cached sql was written against the old one
+        if fingerprint != self.fingerprint:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.fingerprint = fingerprint
+
+    def get(self, question: str, fingerprint: str) -> Optional[Dict[str, Any]]:
+        key = normalize_question(question)
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, question: str, fingerprint: str, entry: Dict[str, Any]):
+        if self.max_entries <= 0:
+            return
+        key = normalize_question(question)
+        with self._lock:
+            self._check_fingerprint(fingerprint)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+            }
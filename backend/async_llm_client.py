@@ -0,0 +1,263 @@
+import asyncio
+import json
+import logging
+import ssl
+from typing import Optional, Dict, Any, Tuple, Callable, AsyncIterator
+from urllib.parse import urlsplit
+
+from .llm_cache import LLMResponseCache
+from .llm_client import _OllamaBase, OllamaAPIError
+from .llm_recording import LLMRecording
+from .ollama_transport import RetryPolicy
+from .sql_stream import StreamingSQLExtractor
+
+
+logger = logging.getLogger(__name__)
+
+
+#kept apart from llm_client so sync only processes never import asyncio
+class AsyncOllamaClient(_OllamaBase):
+    def __init__(self,
+                 base_url: str = "http://localhost:11434",
+                 model: str = "codellama:13b",
+                 cache: Optional[LLMResponseCache] = None,
+                 timeout: float = 120,
+                 retry: Optional[RetryPolicy] = None,
+                 keep_alive: Optional[str] = "30m",
+                 recording: Optional[LLMRecording] = None):  #same file format and keys as the sync client
+        self.base_url = base_url
+        self.model = model
+        self.cache = cache
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy()
+        self._init_common(keep_alive, recording)
+        
+        parts = urlsplit(base_url)
+        self._host = parts.hostname or "localhost"
+        self._ssl = parts.scheme == "https"
+        self._port = parts.port or (443 if self._ssl else 80)
+        self._base_path = parts.path.rstrip("/")
+    
+    async def generate(self, prompt: str, system: Optional[str] = None, use_cache: Optional[bool] = None, prefix: Optional[str] = None, **kwargs) -> str:
+        cache_key, cached = self._cache_lookup(f"{prefix or ''}{prompt}", system, use_cache, kwargs)
+        if cached is not None:
+            self._record_stats({}, cached=True)
+            return cached
+        
+        record_key, replayed = self._replay(f"{prefix or ''}{prompt}", system, kwargs)
+        if replayed is not None:
+            self._record_stats(replayed)
+            return replayed["response"]
+        
+        payload = self._payload(f"{prefix or ''}{prompt}", system, False, kwargs)
+        
+        try:
+            status, body = await asyncio.wait_for(
+                self._request_with_retry("POST", "/api/generate", payload),
+                timeout=self.timeout
+            )
+            if status >= 400:
+                raise OllamaAPIError(f"HTTP {status}: {body[:200].decode('utf-8', 'replace')}")
+            
+            result = json.loads(body)
+            text = result.get("response", "").strip()
+        
+        except (OSError, asyncio.TimeoutError, ValueError, OllamaAPIError) as e:
+            logger.warning(f"Ollama API error: {e}")
+            raise
+        
+        self._record_stats(result)
+        self._record(record_key, f"{prefix or ''}{prompt}", system, kwargs, text, result)
+        if cache_key is not None:
+            self.cache.put(cache_key, text)
+        return text
+    
+    async def generate_stream(self,
+                              prompt: str,
+                              system: Optional[str] = None,
+                              on_token: Optional[Callable[[str], None]] = None,
+                              extractor: Optional[StreamingSQLExtractor] = None,
+                              use_cache: Optional[bool] = None,
+                              prefix: Optional[str] = None,
+                              **kwargs) -> str:
+        cache_key, cached = self._cache_lookup(f"{prefix or ''}{prompt}", system, use_cache, kwargs)
+        if cached is not None:
+            self._record_stats({}, cached=True)
+            if on_token:
+                on_token(cached)
+            return cached
+        
+        record_key, replayed = self._replay(f"{prefix or ''}{prompt}", system, kwargs)
+        if replayed is not None:
+            self._record_stats(replayed)
+            if on_token:
+                on_token(replayed["response"])
+            return replayed["response"]
+        
+        payload = self._payload(f"{prefix or ''}{prompt}", system, True, kwargs)
+        pieces = []
+        final = {}
+        
+        try:
+            reader, writer, status, headers = await self._open_with_retry("POST", "/api/generate", payload)
+            try:
+                if status >= 400:
+                    body = b"".join([chunk async for chunk in self._read_body(reader, headers)])
+                    raise OllamaAPIError(f"HTTP {status}: {body[:200].decode('utf-8', 'replace')}")
+                
+                pending = b""
+                done = False
+                async for data in self._read_body(reader, headers):
+                    pending += data
+                    *lines, pending = pending.split(b"\n")
+                    for line in lines:
+                        if not line.strip():
+                            continue
+                        chunk = json.loads(line)
+                        if chunk.get("error"):
+                            raise OllamaAPIError(chunk["error"])
+                        
+                        token = chunk.get("response", "")
+                        if token:
+                            pieces.append(token)
+                            if on_token:
+                                on_token(token)
+                            if extractor is not None and extractor.feed(token):
+                                done = True
+                                break
+                        if chunk.get("done"):
+                            final = chunk
+                            done = True
+                            break
+                    if done:
+                        break
+            finally:
+                #closing the socket is what tells ollama to stop decoding
+                await self._close(writer)
+        
+        except (OSError, asyncio.TimeoutError, ValueError, OllamaAPIError) as e:
+            logger.warning(f"Ollama API error: {e}")
+            raise
+        
+        self._record_stats(final)
+        text = extractor.text() if extractor is not None else "".join(pieces)
+        text = text.strip()
+        self._record(record_key, f"{prefix or ''}{prompt}", system, kwargs, text, final)
+        if cache_key is not None:
+            self.cache.put(cache_key, text)
+        return text
+    
+    async def is_available(self) -> bool:
+        try:
+            status, body = await asyncio.wait_for(self._request("GET", "/api/tags"), timeout=5)
+            models = json.loads(body).get("models", [])
+            return any(model["name"] == self.model for model in models)
+        except Exception:
+            return False
+    
+    async def _open_with_retry(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None):
+        attempt = 0
+        while True:
+            try:
+                reader, writer, status, headers = await asyncio.wait_for(
+                    self._open(method, path, payload),
+                    timeout=self.timeout
+                )
+            except OSError as e:
+                if attempt >= self.retry.max_retries:
+                    raise
+                logger.warning(f"Ollama connection error, retrying: {e}")
+            else:
+                if not self.retry.should_retry_status(status) or attempt >= self.retry.max_retries:
+                    return reader, writer, status, headers
+                logger.warning(f"Ollama returned {status}, retrying")
+                await self._close(writer)
+            await asyncio.sleep(self.retry.delay(attempt))
+            attempt += 1
+    
+    async def _request_with_retry(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+        reader, writer, status, headers = await self._open_with_retry(method, path, payload)
+        try:
+            return status, b"".join([chunk async for chunk in self._iter_body(reader, headers)])
+        finally:
+            await self._close(writer)
+    
+    async def _request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Tuple[int, bytes]:
+        reader, writer, status, headers = await self._open(method, path, payload)
+        try:
+            return status, b"".join([chunk async for chunk in self._iter_body(reader, headers)])
+        finally:
+            await self._close(writer)
+    
+    async def _open(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None):
+        #plain http/1.1 over asyncio streams so we dont need another dependency
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        ssl_ctx = ssl.create_default_context() if self._ssl else None
+        reader, writer = await asyncio.open_connection(self._host, self._port, ssl=ssl_ctx)
+        
+        try:
+            head = (
+                f"{method} {self._base_path}{path} HTTP/1.1\r\n"
+                f"Host: {self._host}:{self._port}\r\n"
+                "Content-Type: application/json\r\n"
+                "Accept: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n"
+            )
+            writer.write(head.encode("latin-1") + body)
+            await writer.drain()
+            
+            status_line = await reader.readline()
+            try:
+                status = int(status_line.split()[1])
+            except (IndexError, ValueError):
+                raise OllamaAPIError(f"Bad HTTP status line: {status_line!r}")
+            
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            
+            return reader, writer, status, headers
+        
+        except BaseException:
+            await self._close(writer)
+            raise
+    
+    async def _read_body(self, reader: asyncio.StreamReader, headers: Dict[str, str]) -> AsyncIterator[bytes]:
+        #like the sync client's read timeout, a stream may run long but a stalled one fails after timeout seconds
+        chunks = self._iter_body(reader, headers)
+        while True:
+            try:
+                data = await asyncio.wait_for(chunks.__anext__(), timeout=self.timeout)
+            except StopAsyncIteration:
+                return
+            yield data
+    
+    async def _iter_body(self, reader: asyncio.StreamReader, headers: Dict[str, str]) -> AsyncIterator[bytes]:
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    await reader.readline()
+                    return
+                yield await reader.readexactly(size)
+                await reader.readline()
+        elif "content-length" in headers:
+            yield await reader.readexactly(int(headers["content-length"]))
+        else:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    return
+                yield data
+    
+    async def _close(self, writer: asyncio.StreamWriter):
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
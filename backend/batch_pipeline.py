@@ -0,0 +1,215 @@
+import logging
+import queue
+import threading
+from typing import List, Dict, Any, Optional, Iterator, Iterable
+
+from .answer_cache import normalize_question
+
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("schema", "selector", "decomposer", "refine", "execute")
+
+#llm stages wait on the gpu, sqlite stages are cheap, execute defaults to the pool size
+DEFAULT_WORKERS = {"schema": 1, "selector": 2, "decomposer": 2, "refine": 2}
+
+
+class BatchPipeline:
+    def __init__(self, engine, workers: Optional[Dict[str, int]] = None, queue_size: int = 16):
+        self.engine = engine
+        self.workers = {**DEFAULT_WORKERS, "execute": engine.pool.max_connections, **(workers or {})}
+        self.queue_size = queue_size
+        self.counts = {stage: 0 for stage in STAGES}
+        self._lock = threading.Lock()
+
+    def run(self, questions: Iterable[str]) -> Iterator[Dict[str, Any]]:
+        questions = list(questions)
+        #identical questions run once, every copy gets the answer with its own index
+        jobs, copies = [], {}
+        for index, question in enumerate(questions):
+            key = normalize_question(question)
+            if key in copies:
+                copies[key].append(index)
+            else:
+                copies[key] = [index]
+                jobs.append({"index": index, "key": key, "question": question})
+        if not jobs:
+            return
+
+        #bounded everywhere, a slow llm backs up into the feeder instead of growing the queues
+        stop = threading.Event()
+        queues = {stage: queue.Queue(maxsize=self.queue_size) for stage in STAGES}
+        done = queue.Queue(maxsize=self.queue_size)
+        queues["done"] = done
+        threads = [threading.Thread(target=self._feed, args=(jobs, queues["schema"], stop), daemon=True,
+                                    name="macsql-batch-feed")]
+        for stage in STAGES:
+            for n in range(self.workers[stage]):
+                threads.append(threading.Thread(target=self._work, args=(stage, queues, stop), daemon=True,
+                                                name=f"macsql-batch-{stage}-{n}"))
+        for thread in threads:
+            thread.start()
+
+        try:
+            for _ in range(len(jobs)):
+                job = done.get()
+                for index in copies[job["key"]]:
+                    yield {**job["result"], "index": index, "duplicate": index != job["index"]}
+        finally:
+            #also runs when the caller stops iterating early
+            stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"processed": dict(self.counts), "workers": dict(self.workers), "queue_size": self.queue_size}
+
+    def _put(self, target: queue.Queue, item, stop: threading.Event) -> bool:
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self, jobs: List[Dict[str, Any]], inbox: queue.Queue, stop: threading.Event):
+        for job in jobs:
+            job["trace"] = self.engine.tracer.begin("batch", question=job["question"], index=job["index"])
+            if not self._put(inbox, job, stop):
+                return
+
+    def _work(self, stage: str, queues: Dict[str, queue.Queue], stop: threading.Event):
+        handler = getattr(self, f"_{stage}")
+        inbox = queues[stage]
+        while not stop.is_set():
+            try:
+                job = inbox.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                with self.engine.tracer.attach(job["trace"]):
+                    next_stage = handler(job)
+            except Exception as e:
+                logger.error(f"Batch question {job['index']} failed in {stage}: {e}")
+                job["result"] = {"question": job["question"], "error": str(e), "success": False}
+                next_stage = "done"
+            with self._lock:
+                self.counts[stage] += 1
+            if next_stage == "done":
+                try:
+                    self._finish(job)
+                except Exception as e:
+                    #run() is waiting on exactly one result per job, a lost job would hang it
+                    logger.error(f"Batch question {job['index']} failed while finishing: {e}")
+                    job["result"] = {"question": job["question"], "error": str(e), "success": False}
+                    for field in ("catalog", "cols"):
+                        job.pop(field, None)
+            if not self._put(queues[next_stage], job, stop):
+                return
+
+    def _schema(self, job: Dict[str, Any]) -> str:
+        engine = self.engine
+        with engine.tracer.span("schema") as span:
+            catalog = engine.schema_extractor.get_catalog()
+            job["catalog"] = catalog
+            job["cols"] = engine._columns_for_question(catalog, job["question"])
+            job["fingerprint"] = catalog.fingerprint()
+            span["attrs"]["tables"] = len(catalog.tables)
+
+        cached = engine.answer_cache.get(job["question"], job["fingerprint"])
+        if cached is not None:
+            job["cached"] = cached
+            job["query"] = cached["final_sql"]
+            return "execute"
+        return "selector"
+
+    def _selector(self, job: Dict[str, Any]) -> str:
+        engine = self.engine
+        with engine.tracer.span("selector") as span:
+            job["sel_result"] = engine.selector.process({
+                "question": job["question"],
+                "schema": job["cols"],
+                "column_stats": engine._column_hints(job["catalog"], job["cols"], engine.column_stats_tokens // 2)
+            })
+            engine.tracer.record_llm(span, "selector", job["sel_result"].get("llm_stats"))
+        job["llm_calls"] = [{"agent": "selector", **(job["sel_result"].get("llm_stats") or {})}]
+        return "decomposer"
+
+    def _decomposer(self, job: Dict[str, Any]) -> str:
+        engine = self.engine
+        selected_schema = job["sel_result"]["selected_schema"]
+        with engine.tracer.span("decomposer") as span:
+            job["decomp_result"] = engine.decomposer.process({
+                "question": job["question"],
+                "selected_schema": selected_schema,
+                "value_hints": engine._value_hints(job["catalog"], selected_schema),
+                "column_stats": engine._column_hints(job["catalog"], selected_schema, engine.column_stats_tokens),
+                "examples": engine._few_shot_examples(job["question"])
+            })
+            engine.tracer.record_llm(span, "decomposer", job["decomp_result"].get("llm_stats"))
+        job["llm_calls"].append({"agent": "decomposer", **(job["decomp_result"].get("llm_stats") or {})})
+        job["literal_fixes"], job["local_repairs"], job["tries"], job["execution_result"] = [], [], 0, None
+        job["query"] = engine._ground_literals(job["catalog"], job["decomp_result"]["sql_query"], job["literal_fixes"])
+        return "refine"
+
+    def _refine(self, job: Dict[str, Any]) -> str:
+        #the same steps as MACSQL.query, stopping short of execution
+        return "execute" if self.engine._refinement_loop(job, execute=False) else "done"
+
+    def _execute(self, job: Dict[str, Any]) -> str:
+        engine = self.engine
+        if "cached" in job:
+            job["execution_result"] = engine._execute(job["query"])
+            return "done"
+        #revalidating is a validator cache hit, a budget cancellation is then refined right here
+        #since handing it back upstream could deadlock on full queues
+        engine._refinement_loop(job)
+        return "done"
+
+    def _finish(self, job: Dict[str, Any]):
+        engine = self.engine
+        result = job.get("execution_result")
+        if "result" in job:
+            status = "error"
+        elif "cached" in job:
+            cached = job["cached"]
+            job["result"] = {
+                "question": job["question"],
+                "final_sql": cached["final_sql"],
+                "selector_output": cached["selector_output"],
+                "decomposer_output": cached["decomposer_output"],
+                "tries": 0,
+                "execution_result": result,
+                "success": True,
+                "cache_hit": True
+            }
+            status = "ok"
+        else:
+            if result is not None and result["success"]:
+                engine.answer_cache.put(job["question"], job["fingerprint"], {
+                    "final_sql": job["query"],
+                    "selector_output": job["sel_result"],
+                    "decomposer_output": job["decomp_result"]
+                })
+                engine._harvest_example(job["question"], job["query"])
+            job["result"] = {
+                "question": job["question"],
+                "final_sql": job["query"],
+                "selector_output": job["sel_result"],
+                "decomposer_output": job["decomp_result"],
+                "tries": job["tries"],
+                "execution_result": result,
+                "literal_fixes": job["literal_fixes"],
+                "local_repairs": job["local_repairs"],
+                "llm_calls": job["llm_calls"],
+                "success": True,
+                "cache_hit": False
+            }
+            status = "ok"
+
+        trace = job["trace"]
+        engine.tracer.end(trace, status)
+        job["result"]["trace"] = {"trace_id": trace["trace_id"], "duration": trace["duration"], "spans": trace["spans"]}
+        #drop the heavy per question state before it sits in the done queue
+        for field in ("catalog", "cols"):
+            job.pop(field, None)
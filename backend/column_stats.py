@@ -0,0 +1,319 @@
+import gzip
+import json
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
+
+from .connection_pool import SQLiteConnectionPool
+from .schema_extractor import SchemaCatalog
+
+
+logger = logging.getLogger(__name__)
+
+
+FORMAT_VERSION = 1
+
+#checked in order, the first one most sampled values match wins
+DATE_FORMATS = (
+    ("YYYY-MM-DD HH:MM:SS", re.compile(r"^\d{4}-\d{2}-\d{2}[ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?")),
+    ("YYYY-MM-DD", re.compile(r"^\d{4}-\d{2}-\d{2}$")),
+    ("YYYY/MM/DD", re.compile(r"^\d{4}/\d{2}/\d{2}$")),
+    ("MM/DD/YYYY", re.compile(r"^\d{2}/\d{2}/\d{4}$")),
+    ("YYYYMMDD", re.compile(r"^(19|20)\d{2}(0[1-9]|1[0-2])\d{2}$")),
+)
+DATE_MATCH_SHARE = 0.9
+
+#roughly 4 characters a token for codellama, close enough for a budget
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def _detect_date_format(values: List[Any]) -> Optional[str]:
+    texts = [str(v) for v in values if isinstance(v, (str, int))]
+    if not texts:
+        return None
+    for name, pattern in DATE_FORMATS:
+        matched = [t for t in texts if pattern.match(t)]
+        if len(matched) >= DATE_MATCH_SHARE * len(texts):
+            if name == "MM/DD/YYYY" and any(int(t[:2]) > 12 for t in matched):
+                return "DD/MM/YYYY"
+            return name
+    return None
+
+
+def _distinct_estimate(counts: Counter, sampled: int, rows: int) -> int:
+    if sampled >= rows:
+        return len(counts)
+    if len(counts) >= 0.9 * sampled:
+        #nearly everything unique, ids and free text, assume it stays that way
+        return int(len(counts) * rows / sampled)
+    #GEE estimator, values seen once in the sample stand in for the ones the sample missed
+    singles = sum(1 for c in counts.values() if c == 1)
+    return int(round(math.sqrt(rows / sampled) * singles + (len(counts) - singles)))
+
+
+def _short(value: Any, limit: int = 32) -> str:
+    if isinstance(value, str):
+        value = value if len(value) <= limit else value[:limit - 3] + "..."
+        return "'" + value.replace("'", "''") + "'"
+    if isinstance(value, float):
+        return f"{value:.10g}"
+    return repr(value)
+
+
+class ColumnProfiler:
+    def __init__(self,
+                 database_path: str,
+                 pool: Optional[SQLiteConnectionPool] = None,
+                 stats_path: Optional[str] = None,  #defaults to a file next to the database
+                 sample_rows: int = 20000,  #rows read per table, spread over the rowid range on big tables
+                 sample_chunks: int = 10,
+                 top_k: int = 5,
+                 max_categories: int = 25,  #columns with more distinct values dont get a top-k list
+                 poll_interval: float = 5.0):  #seconds between PRAGMA data_version checks
+        self.database_path = database_path
+        self.pool = pool or SQLiteConnectionPool(database_path)
+        self.stats_path = stats_path or f"{database_path}.stats.json.gz"
+        self.sample_rows = sample_rows
+        self.sample_chunks = sample_chunks
+        self.top_k = top_k
+        self.max_categories = max_categories
+        self.poll_interval = poll_interval
+
+        #table -> {"signature": [...], "rows": n, "sampled": n, "columns": {column: stats}}
+        #replaced wholesale by the worker, readers just grab the current dict
+        self.tables: Dict[str, Dict[str, Any]] = {}
+        self.fingerprint: Optional[str] = None
+        self.data_version: Optional[int] = None
+        self.refreshes = 0
+        self.profiled_tables = 0
+        self.errors = 0
+
+        self._pending: Optional[SchemaCatalog] = None
+        self._requested: Optional[str] = None
+        self._catalog: Optional[SchemaCatalog] = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def request(self, catalog: SchemaCatalog):
+        #called on the query path, only hands the catalog over and starts the worker if needed
+        fingerprint = catalog.fingerprint()
+        if fingerprint == self._requested:
+            return
+        with self._lock:
+            self._pending = catalog
+            self._requested = fingerprint
+            if self._thread is None and not self._stop.is_set():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="macsql-column-stats")
+                self._thread.start()
+        self._wake.set()
+
+    def hints_for_columns(self, columns: List[str], max_tokens: int = 200) -> str:
+        #whatever has been profiled so far, columns without stats are skipped rather than waited for
+        tables = self.tables
+        found = []
+        for column in columns:
+            table_name, _, col = column.partition(".")
+            stats = tables.get(table_name, {}).get("columns", {}).get(col)
+            if stats:
+                found.append((column, stats, tables[table_name]))
+        #date formats first, then small value sets, those are what the models get wrong without them
+        found.sort(key=lambda item: 0 if item[1].get("date_format") else 1 if item[1].get("top") else 2)
+
+        lines, used = [], 0
+        for column, stats, table in found:
+            line = self._describe(column, stats, table)
+            if not line:
+                continue
+            cost = estimate_tokens(line) + 1
+            if used + cost > max_tokens:
+                continue
+            lines.append(line)
+            used += cost
+        return "\n".join(lines)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"tables": len(self.tables), "data_version": self.data_version, "refreshes": self.refreshes,
+                "profiled_tables": self.profiled_tables, "errors": self.errors,
+                "running": self._thread is not None and self._thread.is_alive()}
+
+    def close(self):
+        self._stop.set()
+        self._wake.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def _describe(self, column: str, stats: Dict[str, Any], table: Dict[str, Any]) -> str:
+        parts = []
+        if stats.get("date_format"):
+            parts.append(f"dates as '{stats['date_format']}'")
+        #a value list for text categories, numbers and dates read better as a range
+        categorical = (stats.get("top") and stats["distinct"] <= self.max_categories and not stats.get("date_format")
+                       and all(isinstance(value, str) for value, _ in stats["top"]))
+        if categorical:
+            shown = ", ".join(_short(value) for value, _ in stats["top"])
+            more = f" (+{stats['distinct'] - len(stats['top'])} more)" if stats["distinct"] > len(stats["top"]) else ""
+            parts.append(f"{stats['distinct']} value{'' if stats['distinct'] == 1 else 's'}: {shown}{more}")
+        else:
+            #the min and max of a name column say nothing
+            if stats.get("min") is not None and (stats.get("date_format") or not isinstance(stats["min"], str)):
+                parts.append(f"{_short(stats['min'])} to {_short(stats['max'])}")
+            if stats.get("distinct"):
+                exact = table["sampled"] >= table["rows"]
+                parts.append(f"{'' if exact else '~'}{stats['distinct']} distinct")
+        if stats.get("null_frac", 0) >= 0.01:
+            parts.append(f"{round(100 * stats['null_frac'])}% null")
+        return f"{column}: {', '.join(parts)}" if parts else ""
+
+    def _run(self):
+        #own connection, data_version only moves for commits made by other connections
+        conn = None
+        try:
+            conn = self.pool.open_dedicated()
+            if not self.tables:
+                self._load()
+            while not self._stop.is_set():
+                self._wake.clear()
+                with self._lock:
+                    catalog, self._pending = self._pending, None
+                version = conn.execute("PRAGMA data_version").fetchone()[0]
+                if catalog is not None or version != self.data_version:
+                    try:
+                        self._refresh(conn, catalog, version)
+                    except Exception as e:
+                        #not retried every poll, the next data change or a query's request tries again
+                        logger.warning(f"Column stats refresh failed: {e}")
+                        self.errors += 1
+                        self.data_version = version
+                        self._requested = None
+                self._wake.wait(self.poll_interval)
+        except Exception as e:
+            logger.warning(f"Column profiler stopped: {e}")
+            self.errors += 1
+        finally:
+            if conn is not None:
+                conn.close()
+            #a dead worker must not look alive to request(), the next one starts a fresh thread
+            with self._lock:
+                self._thread = None
+                self._requested = None
+
+    def _refresh(self, conn: sqlite3.Connection, catalog: Optional[SchemaCatalog], version: int):
+        if catalog is None:
+            catalog = self._catalog
+            if catalog is None:
+                return
+        self._catalog = catalog
+        #only tables whose CREATE statement or max rowid moved get sampled again
+        tables = {name: entry for name, entry in self.tables.items() if name in catalog.tables}
+        profiled = 0
+        for table_name, table_schema in catalog.tables.items():
+            if self._stop.is_set():
+                return
+            signature = self._table_signature(conn, table_name, catalog.table_sql.get(table_name, ""))
+            cached = tables.get(table_name)
+            if cached is not None and cached["signature"] == signature:
+                continue
+            try:
+                tables[table_name] = {"signature": signature,
+                                      **self._profile_table(conn, table_name, table_schema, signature[1])}
+            except sqlite3.Error as e:
+                logger.warning(f"Could not profile {table_name}: {e}")
+                continue
+            profiled += 1
+            #publish as it goes so early tables show up in hints before the whole schema is done
+            self.tables = dict(tables)
+
+        self.tables = tables
+        self.fingerprint = catalog.fingerprint()
+        self.data_version = version
+        self.refreshes += 1
+        self.profiled_tables += profiled
+        if profiled:
+            logger.info(f"Column stats: profiled {profiled} of {len(tables)} tables")
+            self._save()
+
+    def _table_signature(self, conn: sqlite3.Connection, table_name: str, table_sql: str) -> List[Any]:
+        #same cheap change check as the value index, max(rowid) is a single btree seek
+        try:
+            max_rowid = conn.execute(f'SELECT MAX(rowid) FROM "{table_name}"').fetchone()[0]
+        except sqlite3.OperationalError:
+            max_rowid = None  #WITHOUT ROWID table, only schema changes will trigger a re-profile
+        return [table_sql, max_rowid]
+
+    def _sample(self, conn: sqlite3.Connection, table_name: str, columns: List[str], max_rowid: Optional[int]) -> Tuple[List[tuple], int]:
+        select = ", ".join(f'"{col}"' for col in columns)
+        if max_rowid is None or max_rowid <= self.sample_rows:
+            rows = conn.execute(f'SELECT {select} FROM "{table_name}" LIMIT ?', (self.sample_rows,)).fetchall()
+            total = len(rows) if len(rows) < self.sample_rows else max_rowid or len(rows)
+            return rows, total
+
+        #a few contiguous runs spread over the rowid range, each one is an index seek instead of a full scan,
+        #the last run ends at max(rowid) so the newest rows are always in the sample
+        chunk = max(1, self.sample_rows // self.sample_chunks)
+        stride = (max_rowid - chunk) // max(1, self.sample_chunks - 1)
+        rows = []
+        for n in range(self.sample_chunks):
+            rows.extend(conn.execute(f'SELECT {select} FROM "{table_name}" WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                                     (n * stride, chunk)).fetchall())
+        return rows, max_rowid
+
+    def _profile_table(self, conn: sqlite3.Connection, table_name: str, table_schema: Dict[str, Any],
+                       max_rowid: Optional[int]) -> Dict[str, Any]:
+        columns = [col["name"] for col in table_schema["columns"]]
+        if not columns:
+            return {"rows": 0, "sampled": 0, "columns": {}}
+        rows, total = self._sample(conn, table_name, columns, max_rowid)
+        sampled = len(rows)
+
+        profile = {}
+        for pos, col in enumerate(columns):
+            values = [row[pos] for row in rows if row[pos] is not None]
+            stats: Dict[str, Any] = {"null_frac": 1 - len(values) / sampled if sampled else 0.0}
+            values = [v for v in values if not isinstance(v, bytes)]
+            if values:
+                counts = Counter(values)
+                #estimated over the non null part of the table
+                stats["distinct"] = _distinct_estimate(counts, len(values), int(total * (1 - stats["null_frac"])))
+                try:
+                    stats["min"], stats["max"] = min(values), max(values)
+                except TypeError:
+                    #mixed storage classes in one column, sqlite allows it
+                    stats["min"] = stats["max"] = None
+                if len(counts) <= self.max_categories:
+                    stats["top"] = [[value, count] for value, count in counts.most_common(self.top_k)]
+                stats["date_format"] = _detect_date_format(values[:500])
+            profile[col] = stats
+        return {"rows": total, "sampled": sampled, "columns": profile}
+
+    def _load(self):
+        if not os.path.exists(self.stats_path):
+            return
+        try:
+            with gzip.open(self.stats_path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == FORMAT_VERSION:
+                self.tables = data["tables"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable column stats {self.stats_path}: {e}")
+
+    def _save(self):
+        #write then rename so a crash never leaves half a file behind
+        tmp_path = f"{self.stats_path}.tmp"
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump({"version": FORMAT_VERSION, "tables": self.tables}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.stats_path)
+        except OSError as e:
+            logger.warning(f"Could not save column stats to {self.stats_path}: {e}")
@@ -0,0 +1,155 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional
+
+
+class SQLiteConnectionPool:
+    def __init__(self,
+                 database_path: str,
+                 max_connections: int = 4,
+                 read_only: bool = True,
+                 immutable: bool = False,  #only for files nothing else writes to, sqlite skips all locking
+                 mmap_size: int = 256 * 1024 * 1024,
+                 cache_size: int = -64000,  #negative is KiB per connection
+                 temp_store: str = "MEMORY",
+                 timeout: float = 30.0):
+
+        if max_connections < 1:
+            raise ValueError("max_connections must be at least 1")
+
+        self.database_path = database_path
+        self.max_connections = max_connections
+        self.read_only = read_only
+        self.immutable = immutable
+        self.pragmas = {
+            "mmap_size": mmap_size,
+            "cache_size": cache_size,
+            "temp_store": temp_store,
+        }
+        self.timeout = timeout
+
+        self._idle: List[sqlite3.Connection] = []
+        self._created = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+
+    def _uri(self) -> str:
+        uri = Path(self.database_path).resolve().as_uri()
+        params = []
+        if self.read_only:
+            params.append("mode=ro")
+        if self.immutable:
+            params.append("immutable=1")
+        return uri + ("?" + "&".join(params) if params else "")
+
+    def _open(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self._uri(),
+            uri=True,
+            timeout=self.timeout,
+            check_same_thread=False  #the pool hands each connection to one thread at a time
+        )
+        for name, value in self.pragmas.items():
+            if value is not None:
+                conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def open_dedicated(self) -> sqlite3.Connection:
+        #same uri and pragmas as the pool but never handed out or counted, the caller closes it.
+        #for watchers that keep one connection, PRAGMA data_version is per connection
+        with self._cond:
+            if self._closed:
+                raise sqlite3.ProgrammingError("connection pool is closed")
+        return self._open()
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise sqlite3.ProgrammingError("connection pool is closed")
+                if self._idle:
+                    self.hits += 1
+                    return self._idle.pop()
+                if self._created < self.max_connections:
+                    self._created += 1
+                    self.misses += 1
+                    break
+                self.waits += 1
+                self._cond.wait()
+
+        try:
+            return self._open()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn: sqlite3.Connection):
+        #leave nothing behind for the next borrower
+        conn.row_factory = None
+        if conn.in_transaction:
+            conn.rollback()
+
+        with self._cond:
+            if self._closed:
+                self._created -= 1
+                conn.close()
+                return
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def discard(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        finally:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self.acquire()
+        try:
+            yield conn
+        except sqlite3.OperationalError:
+            #bad sql from the llm, the connection itself is fine
+            self.release(conn)
+            raise
+        except sqlite3.DatabaseError:
+            #corrupt file or closed handle, dont hand it out again
+            self.discard(conn)
+            raise
+        except BaseException:
+            self.release(conn)
+            raise
+        else:
+            self.release(conn)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "hit_rate": self.hits / total if total else 0.0,
+                "open_connections": self._created,
+                "idle_connections": len(self._idle),
+                "max_connections": self.max_connections,
+            }
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
@@ -0,0 +1,228 @@
+import hashlib
+import logging
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Optional, Tuple
+
+import numpy as np
+
+from .answer_cache import normalize_question
+from .llm_client import OllamaClient
+from .schema_index import tokenize_question
+
+
+logger = logging.getLogger(__name__)
+
+
+_QUESTION = re.compile(r'^\s*Question:\s*"?(.*?)"?\s*$')
+_SQL = re.compile(r'^\s*SQL:\s*(.*)$')
+#lines that end an SQL block in the example files
+_SECTION = re.compile(r'^\s*(EXAMPLE\s+\d+|KEY PATTERNS|[A-Z][A-Z ]+EXAMPLES|These training)', re.IGNORECASE)
+
+#a failing embedding model is retried after retry_interval, doubling each time up to this
+MAX_RETRY_INTERVAL = 600.0
+
+
+def parse_examples(text: str) -> List[Dict[str, str]]:
+    #the example files wrap long sql across lines, keep reading until a blank line or the next header
+    examples = []
+    question = None
+    sql_lines: List[str] = []
+
+    def flush():
+        if question and sql_lines:
+            examples.append({"question": question, "sql": " ".join(sql_lines)})
+
+    for line in text.splitlines():
+        q_match = _QUESTION.match(line)
+        sql_match = _SQL.match(line)
+        if q_match:
+            flush()
+            question, sql_lines = q_match.group(1).strip(), []
+        elif sql_match and question:
+            sql_lines = [sql_match.group(1).strip()]
+        elif sql_lines and line.strip() and not _SECTION.match(line):
+            sql_lines.append(line.strip())
+        elif sql_lines:
+            flush()
+            question, sql_lines = None, []
+    flush()
+    return examples
+
+
+class EmbeddingCache:
+    def __init__(self, path: Optional[str] = None):
+        #None keeps vectors in memory only
+        self._memory: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self._disk = None
+        if path:
+            self._disk = sqlite3.connect(path, check_same_thread=False)
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+            )
+            self._disk.commit()
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is None and self._disk is not None:
+                row = self._disk.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    vector = np.frombuffer(row[0], dtype=np.float32)
+                    self._memory[key] = vector
+            return vector
+
+    def put(self, key: str, vector: np.ndarray):
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._memory[key] = vector
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, dim, vector) VALUES (?, ?, ?)",
+                    (key, len(vector), vector.tobytes())
+                )
+                self._disk.commit()
+
+
+class FewShotStore:
+    def __init__(self,
+                 llm_client: OllamaClient,
+                 embed_model: str = "nomic-embed-text",
+                 cache_path: Optional[str] = None,
+                 max_examples: int = 2000,  #harvested examples past this push out the oldest harvested ones
+                 retry_interval: float = 30.0):  #seconds of word overlap after a failed embedding call
+        self.llm = llm_client
+        self.embed_model = embed_model
+        self.cache = EmbeddingCache(cache_path)
+        self.max_examples = max_examples
+
+        self.examples: List[Dict[str, str]] = []
+        self._keys: Dict[str, int] = {}
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_examples: List[Dict[str, str]] = []
+        self._version = 0  #bumped on every change to examples, a matrix built from an older list is not stored
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+
+        self.retry_interval = retry_interval
+        self._failures = 0
+        self._retry_at = 0.0
+
+    @property
+    def embeddings_available(self) -> bool:
+        return time.monotonic() >= self._retry_at
+
+    def load_file(self, path: str) -> int:
+        with open(path, encoding="utf-8") as f:
+            examples = parse_examples(f.read())
+        added = sum(self.add(e["question"], e["sql"], source=path) for e in examples)
+        logger.info(f"Loaded {added} few-shot examples from {path}")
+        return added
+
+    def add(self, question: str, sql: str, source: str = "harvested") -> bool:
+        key = normalize_question(question)
+        with self._lock:
+            if key in self._keys:
+                return False
+            if len(self.examples) >= self.max_examples:
+                harvested = [i for i, e in enumerate(self.examples) if e["source"] == "harvested"]
+                if not harvested:
+                    return False
+                self._remove(harvested[0])
+            self._keys[key] = len(self.examples)
+            self.examples.append({"question": question, "sql": sql.strip(), "source": source})
+            self._matrix = None
+            self._version += 1
+            return True
+
+    def _remove(self, pos: int):
+        del self.examples[pos]
+        self._keys = {normalize_question(e["question"]): i for i, e in enumerate(self.examples)}
+        self._matrix = None
+        self._version += 1
+
+    def _embed(self, text: str) -> np.ndarray:
+        key = EmbeddingCache.make_key(self.embed_model, text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = np.asarray(self.llm.embed(text, model=self.embed_model), dtype=np.float32)
+            self.cache.put(key, vector)
+        return vector
+
+    def _build_matrix(self, examples: List[Dict[str, str]]) -> np.ndarray:
+        #rows are unit length so a single matmul gives cosine similarity
+        vectors = [self._embed(e["question"]) for e in examples]
+        matrix = np.vstack(vectors).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def _embedded_examples(self) -> Tuple[List[Dict[str, str]], np.ndarray]:
+        #the matrix with the examples its rows belong to, embedding calls happen outside self._lock
+        with self._lock:
+            if self._matrix is not None:
+                return self._matrix_examples, self._matrix
+        #one build at a time, everyone else waits for it rather than repeating the same embedding calls
+        with self._build_lock:
+            with self._lock:
+                if self._matrix is not None:
+                    return self._matrix_examples, self._matrix
+                examples, version = list(self.examples), self._version
+            matrix = self._build_matrix(examples)
+            with self._lock:
+                if version == self._version:
+                    self._matrix, self._matrix_examples = matrix, examples
+            return examples, matrix
+
+    def _embedding_failed(self, e: Exception):
+        #no embedding model pulled or ollama hiccuped, back off instead of paying for a failing call every question
+        with self._lock:
+            self._failures += 1
+            delay = min(self.retry_interval * 2 ** (self._failures - 1), MAX_RETRY_INTERVAL)
+            self._retry_at = time.monotonic() + delay
+        logger.warning(f"Few-shot embeddings unavailable, using word overlap for {delay:.0f}s: {e}")
+
+    def search(self, question: str, k: int = 4) -> List[Dict[str, str]]:
+        with self._lock:
+            examples = list(self.examples)
+        if not examples:
+            return []
+
+        if self.embeddings_available:
+            try:
+                examples, matrix = self._embedded_examples()
+                query = self._embed(question)
+                query = query / (np.linalg.norm(query) or 1.0)
+                scores = matrix @ query
+                top = np.argsort(-scores)[:k]
+                if self._failures:
+                    with self._lock:
+                        self._failures = 0
+                return [examples[i] for i in top]
+            except Exception as e:
+                self._embedding_failed(e)
+
+        return self._lexical_search(question, examples, k)
+
+    def _lexical_search(self, question: str, examples: List[Dict[str, str]], k: int) -> List[Dict[str, str]]:
+        words = set(tokenize_question(question))
+        scored = []
+        for e in examples:
+            other = set(tokenize_question(e["question"]))
+            overlap = len(words & other) / (len(words | other) or 1)
+            scored.append((overlap, e))
+        scored.sort(key=lambda pair: pair[0], reverse=True)
+        return [e for _, e in scored[:k]]
+
+    def format_examples(self, examples: List[Dict[str, str]]) -> str:
+        parts = []
+        for i, e in enumerate(examples, start=1):
+            parts.append(f"EXAMPLE {i}:\nQuestion: \"{e['question']}\"\nSQL: {e['sql']}\n")
+        return "\n".join(parts)
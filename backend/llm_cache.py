@@ -0,0 +1,177 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+
+class LLMResponseCache:
+    def __init__(self,
+                 disk_path: Optional[str] = None,  #None keeps it memory only
+                 max_memory_entries: int = 1024,
+                 max_disk_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: Optional[float] = 7 * 24 * 3600):
+
+        self.disk_path = disk_path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk: Optional[sqlite3.Connection] = None
+        self._disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+        if disk_path:
+            self._open_disk()
+
+    def _open_disk(self):
+        self._disk = sqlite3.connect(self.disk_path, check_same_thread=False)
+        self._disk.execute("PRAGMA journal_mode=WAL")
+        self._disk.execute("PRAGMA synchronous=NORMAL")
+        self._disk.execute(
+            """CREATE TABLE IF NOT EXISTS llm_responses (
+                key TEXT PRIMARY KEY,
+                response TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL,
+                size INTEGER NOT NULL
+            )"""
+        )
+        self._disk.execute("CREATE INDEX IF NOT EXISTS llm_responses_access ON llm_responses(last_access)")
+        self._disk.commit()
+        row = self._disk.execute("SELECT COALESCE(SUM(size), 0) FROM llm_responses").fetchone()
+        self._disk_bytes = row[0]
+
+    @staticmethod
+    def make_key(model: str, system: Optional[str], prompt: str, options: Dict[str, Any]) -> str:
+        blob = json.dumps(
+            {"model": model, "system": system, "prompt": prompt, "options": options},
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created > self.ttl_seconds
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                response, created = entry
+                if not self._expired(created, now):
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                    return response
+                del self._memory[key]
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    "SELECT response, created, size FROM llm_responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    response, created, size = row
+                    if not self._expired(created, now):
+                        self._disk.execute("UPDATE llm_responses SET last_access = ? WHERE key = ?", (now, key))
+                        self._disk.commit()
+                        self._remember(key, response, created)
+                        self.disk_hits += 1
+                        return response
+                    self._disk.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                    self._disk.commit()
+                    self._disk_bytes -= size
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, response: str):
+        now = time.time()
+        with self._lock:
+            self._remember(key, response, now)
+
+            if self._disk is not None:
+                size = len(key) + len(response.encode("utf-8"))
+                old = self._disk.execute("SELECT size FROM llm_responses WHERE key = ?", (key,)).fetchone()
+                if old is not None:
+                    self._disk_bytes -= old[0]
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO llm_responses (key, response, created, last_access, size) VALUES (?, ?, ?, ?, ?)",
+                    (key, response, now, now, size)
+                )
+                self._disk_bytes += size
+                self._evict_disk(now)
+                self._disk.commit()
+
+    def _remember(self, key: str, response: str, created: float):
+        self._memory[key] = (response, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _evict_disk(self, now: float):
+        if self.ttl_seconds is not None:
+            cursor = self._disk.execute(
+                "DELETE FROM llm_responses WHERE created < ? RETURNING size", (now - self.ttl_seconds,)
+            )
+            for (size,) in cursor.fetchall():
+                self._disk_bytes -= size
+                self.evictions += 1
+
+        #drop least recently used rows until we are back under budget
+        while self._disk_bytes > self.max_disk_bytes:
+            rows = self._disk.execute(
+                "SELECT key, size FROM llm_responses ORDER BY last_access LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._disk_bytes = 0
+                break
+            for key, size in rows:
+                self._disk.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                self._disk_bytes -= size
+                self.evictions += 1
+                if self._disk_bytes <= self.max_disk_bytes:
+                    break
+
+    def record_bypass(self):
+        with self._lock:
+            self.bypassed += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM llm_responses")
+                self._disk.commit()
+                self._disk_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "evictions": self.evictions,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._disk_bytes,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._disk is not None:
+                self._disk.close()
+                self._disk = None
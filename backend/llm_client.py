@@ -1,43 +1,253 @@
-import requests
 import json
-from typing import Optional, Dict, Any
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Optional, Dict, Any, Tuple, Callable, List
 
+from .llm_cache import LLMResponseCache
+from .llm_recording import LLMRecording
+from .ollama_transport import OllamaTransport, request_error
+from .sql_stream import StreamingSQLExtractor
 
-class OllamaClient:
-    def __init__(self, base_url: str = "http://localhost:11434", model: str = "codellama:13b"):
-        self.base_url = base_url
-        self.model = model
+
+logger = logging.getLogger(__name__)
+
+
+class OllamaAPIError(Exception):
+    pass
+
+
+class GenerationCancelled(Exception):
+    pass
+
+
+#timing fields ollama reports on the final response, durations are nanoseconds
+STAT_FIELDS = ("total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration")
+
+#top level /api/generate fields, every other kwarg is a model option that ollama only reads from "options"
+REQUEST_FIELDS = ("format", "raw", "template", "context", "images", "suffix")
+
+#per call stats live in a contextvar so concurrent threads and asyncio tasks dont see each others
+_last_stats: ContextVar = ContextVar("ollama_last_stats", default=None)
+
+
+def is_deterministic(kwargs: Dict[str, Any]) -> bool:
+    temperature = kwargs.get("temperature", kwargs.get("options", {}).get("temperature"))
+    return temperature is not None and float(temperature) == 0.0
+
+
+class _OllamaBase:
+    def _init_common(self, keep_alive: Optional[str], recording: Optional[LLMRecording]):
+        self.keep_alive = keep_alive
+        self.recording = recording
+        self._stats_lock = threading.Lock()
+        self._totals = {"calls": 0, "cached_calls": 0}
+        self._totals.update({field: 0 for field in STAT_FIELDS})
+    
+    def _record_stats(self, result: Dict[str, Any], cached: bool = False) -> Dict[str, Any]:
+        stats = {field: result.get(field) for field in STAT_FIELDS}
+        stats["cached"] = cached
+        _last_stats.set(stats)
         
-    def generate(self, prompt: str, system: Optional[str] = None, **kwargs) -> str:
+        with self._stats_lock:
+            self._totals["calls"] += 1
+            self._totals["cached_calls"] += int(cached)
+            for field in STAT_FIELDS:
+                self._totals[field] += result.get(field) or 0
+        return stats
+    
+    def last_stats(self) -> Optional[Dict[str, Any]]:
+        return _last_stats.get()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return dict(self._totals)
+    
+    def _cache_lookup(self, prompt: str, system: Optional[str], use_cache: Optional[bool], kwargs: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+        #by default only deterministic calls get cached, refiner runs hot on purpose
+        if self.cache is None:
+            return None, None
+        if use_cache is None:
+            use_cache = is_deterministic(kwargs)
+        if not use_cache:
+            self.cache.record_bypass()
+            return None, None
+        
+        cache_key = LLMResponseCache.make_key(self.model, system, prompt, kwargs)
+        return cache_key, self.cache.get(cache_key)
+    
+    def _payload(self,
+                 prompt: str,
+                 system: Optional[str],
+                 stream: bool,
+                 kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        #agents put their invariant prefix first, ollama reuses the evaluated kv cache for
+        #whatever leading part of the prompt matches its previous call on the loaded model
         payload = {
             "model": self.model,
             "prompt": prompt,
-            "stream": False
+            "stream": stream
         }
         
         if system:
             payload["system"] = system
-            
-        payload.update(kwargs)
+        
+        #keep the model and its kv cache resident between agent calls
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        
+        options = dict(kwargs.get("options") or {})
+        for key, value in kwargs.items():
+            if key in REQUEST_FIELDS:
+                payload[key] = value
+            elif key != "options":
+                options[key] = value
+        if options:
+            payload["options"] = options
+        return payload
+    
+    def _replay(self, prompt: str, system: Optional[str], kwargs: Dict[str, Any]) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        if self.recording is None:
+            return None, None
+        key = LLMRecording.make_key(self.model, system, prompt, kwargs)
+        if not self.recording.replaying:
+            return key, None
+        response = self.recording.lookup(key)
+        if response is None:
+            raise OllamaAPIError(f"No recorded response for this prompt in {self.recording.path}")
+        return key, response
+    
+    def _record(self, key: Optional[str], prompt: str, system: Optional[str], kwargs: Dict[str, Any], text: str, result: Dict[str, Any]):
+        if key is not None and not self.recording.replaying:
+            request = {"model": self.model, "system": system, "prompt": prompt, **kwargs}
+            self.recording.record(key, request, {"response": text, **{field: result.get(field) for field in STAT_FIELDS}})
+
+
+class OllamaClient(_OllamaBase):
+    def __init__(self,
+                 base_url: str = "http://localhost:11434",
+                 model: str = "codellama:13b",
+                 cache: Optional[LLMResponseCache] = None,
+                 transport: Optional[OllamaTransport] = None,
+                 keep_alive: Optional[str] = "30m",
+                 recording: Optional[LLMRecording] = None):  #capture responses to a file, or answer from one offline
+        self.base_url = base_url
+        self.model = model
+        self.cache = cache
+        self.transport = transport or OllamaTransport(base_url)
+        self._init_common(keep_alive, recording)
+        
+    def generate(self, prompt: str, system: Optional[str] = None, use_cache: Optional[bool] = None, prefix: Optional[str] = None, **kwargs) -> str:
+        cache_key, cached = self._cache_lookup(f"{prefix or ''}{prompt}", system, use_cache, kwargs)
+        if cached is not None:
+            self._record_stats({}, cached=True)
+            return cached
+        
+        record_key, replayed = self._replay(f"{prefix or ''}{prompt}", system, kwargs)
+        if replayed is not None:
+            self._record_stats(replayed)
+            return replayed["response"]
+        
+        payload = self._payload(f"{prefix or ''}{prompt}", system, False, kwargs)
         
         try:
-            response = requests.post(
-                f"{self.base_url}/api/generate",
-                json=payload,
-                timeout=120
-            )
+            response = self.transport.post("/api/generate", payload)
             response.raise_for_status()
             
             result = response.json()
-            return result.get("response", "").strip()
+            text = result.get("response", "").strip()
             
-        except requests.RequestException as e:
-            print(f"Ollama API error: {e}")
+        except request_error() as e:
+            logger.warning(f"Ollama API error: {e}")
             raise
+        
+        self._record_stats(result)
+        self._record(record_key, f"{prefix or ''}{prompt}", system, kwargs, text, result)
+        if cache_key is not None:
+            self.cache.put(cache_key, text)
+        return text
+    
+    def generate_stream(self,
+                        prompt: str,
+                        system: Optional[str] = None,
+                        on_token: Optional[Callable[[str], None]] = None,
+                        extractor: Optional[StreamingSQLExtractor] = None,
+                        use_cache: Optional[bool] = None,
+                        prefix: Optional[str] = None,
+                        cancel: Optional[threading.Event] = None,  #set from another thread to hang up mid generation
+                        **kwargs) -> str:
+        cache_key, cached = self._cache_lookup(f"{prefix or ''}{prompt}", system, use_cache, kwargs)
+        if cached is not None:
+            self._record_stats({}, cached=True)
+            if on_token:
+                on_token(cached)
+            return cached
+        
+        record_key, replayed = self._replay(f"{prefix or ''}{prompt}", system, kwargs)
+        if replayed is not None:
+            self._record_stats(replayed)
+            if on_token:
+                on_token(replayed["response"])
+            return replayed["response"]
+        
+        if cancel is not None and cancel.is_set():
+            raise GenerationCancelled("Generation cancelled before it started")
+        payload = self._payload(f"{prefix or ''}{prompt}", system, True, kwargs)
+        pieces = []
+        final = {}  #stays empty if we hang up before ollama sends its stats
+        
+        try:
+            response = self.transport.post("/api/generate", payload, stream=True)
+            try:
+                response.raise_for_status()
+                
+                for line in response.iter_lines():
+                    #closing the response below is what makes ollama stop decoding
+                    if cancel is not None and cancel.is_set():
+                        raise GenerationCancelled("Generation cancelled")
+                    if not line:
+                        continue
+                    chunk = json.loads(line)
+                    if chunk.get("error"):
+                        raise OllamaAPIError(chunk["error"])
+                    
+                    token = chunk.get("response", "")
+                    if token:
+                        pieces.append(token)
+                        if on_token:
+                            on_token(token)
+                        #statement is done, hang up so ollama stops decoding the explanation
+                        if extractor is not None and extractor.feed(token):
+                            break
+                    if chunk.get("done"):
+                        final = chunk
+                        break
+            finally:
+                response.close()
+            
+        except (request_error(), OllamaAPIError) as e:
+            logger.warning(f"Ollama API error: {e}")
+            raise
+        
+        self._record_stats(final)
+        text = extractor.text() if extractor is not None else "".join(pieces)
+        text = text.strip()
+        self._record(record_key, f"{prefix or ''}{prompt}", system, kwargs, text, final)
+        if cache_key is not None:
+            self.cache.put(cache_key, text)
+        return text
+    
+    def embed(self, text: str, model: Optional[str] = None) -> List[float]:
+        response = self.transport.post("/api/embeddings", {"model": model or self.model, "prompt": text})
+        response.raise_for_status()
+        embedding = response.json().get("embedding")
+        if not embedding:
+            raise OllamaAPIError(f"No embedding returned by {model or self.model}")
+        return embedding
             
     def is_available(self) -> bool:
         try:
-            response = requests.get(f"{self.base_url}/api/tags", timeout=5)
+            response = self.transport.get("/api/tags", read_timeout=5)
             models = response.json().get("models", [])
             return any(model["name"] == self.model for model in models)
         except:
@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+from typing import Dict, Any, Optional
+
+from .llm_cache import LLMResponseCache
+
+
+#payload fields that are not generation options
+_PAYLOAD_FIELDS = ("model", "prompt", "system", "stream", "keep_alive", "context")
+
+
+def payload_key(payload: Dict[str, Any]) -> str:
+    #same key the client computes, so a server can replay what the client recorded
+    #the client keys on its flat kwargs, the request nests sampling parameters under "options"
+    options = {k: v for k, v in payload.items() if k not in _PAYLOAD_FIELDS and k != "options"}
+    options.update(payload.get("options") or {})
+    return LLMResponseCache.make_key(payload["model"], payload.get("system") or None, payload["prompt"], options)
+
+
+class LLMRecording:
+    def __init__(self, path: str, mode: str = "record"):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown recording mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.responses: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.replayed = 0
+        self.missing = 0
+
+        #recording appends, so an existing file is loaded either way
+        if os.path.exists(path):
+            self.load(path)
+        elif mode == "replay":
+            raise FileNotFoundError(f"No recording at {path}")
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def load(self, path: str):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.responses[entry["key"]] = entry["response"]
+
+    @staticmethod
+    def make_key(model: str, system: Optional[str], prompt: str, options: Dict[str, Any]) -> str:
+        return LLMResponseCache.make_key(model, system or None, prompt, options)
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            response = self.responses.get(key)
+            if response is None:
+                self.missing += 1
+            else:
+                self.replayed += 1
+            return response
+
+    def record(self, key: str, request: Dict[str, Any], response: Dict[str, Any]):
+        #one json object per line, readable by both the client and benchmark/mock_ollama.py
+        entry = {"key": key, "request": request, "response": response}
+        with self._lock:
+            self.responses[key] = response
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+            self.recorded += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "entries": len(self.responses),
+                "recorded": self.recorded,
+                "replayed": self.replayed,
+                "missing": self.missing,
+            }
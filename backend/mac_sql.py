@@ -1,11 +1,34 @@
-import sqlite3
-import json
-from typing import Dict, Any, Optional, List
+import contextvars
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, Optional, List, Callable, Iterable, Iterator
 
 from .sql_agents import SelectorAgent, DecomposerAgent, RefinerAgent
-from .llm_client import OllamaClient
+from .llm_client import OllamaClient, GenerationCancelled
+from .llm_cache import LLMResponseCache
+from .llm_recording import LLMRecording
+from .ollama_transport import OllamaTransport
 from .schema_extractor import SchemaExtractor
 from .query_validator import QueryValidator
+from .query_budget import QueryBudget
+from .plan_guard import PlanCostGuard
+from .connection_pool import SQLiteConnectionPool
+from .answer_cache import AnswerCache
+from .result_cache import ResultCache
+from .result_set import result_fingerprint
+from .schema_index import SchemaIndex
+from .value_index import ValueIndex
+from .column_stats import ColumnProfiler
+from .sql_repair import SQLRepairer
+from .tracing import Tracer, profile_block
+from .batch_pipeline import BatchPipeline
+
+
+logger = logging.getLogger(__name__)
+
+#decomposer temperature per speculative candidate, the first one stays deterministic and cacheable
+SPECULATIVE_TEMPERATURES = (0.0, 0.4, 0.7, 1.0)
 
 
 class MACSQL:
@@ -13,83 +36,680 @@ class MACSQL:
                  database_path: str,
                  #model_name: str = "deepseek-r1:8b",  #smaller general model, did okay
                  model_name: str = "codellama:13b",  #Larger code-specialized model, did better
-                 max_refinement_attempts: int = 3):  #can play with this, turn up temp on refiner if you want to crank this 
+                 max_refinement_attempts: int = 3,  #can play with this, turn up temp on refiner if you want to crank this 
+                 pool_size: int = 4,
+                 read_only: bool = True,
+                 immutable: bool = False,  #only if nothing else ever writes to the db file
+                 pool_pragmas: Optional[Dict[str, Any]] = None,  #mmap_size, cache_size, temp_store
+                 llm_cache: bool = False,
+                 llm_cache_path: Optional[str] = None,  #defaults to a sqlite file next to the database
+                 answer_cache_size: int = 256,  #0 turns off the question -> sql cache
+                 stream: bool = False,  #stream tokens and stop decoding once the sql statement is complete
+                 on_token: Optional[Callable[[str], None]] = None,
+                 schema_prune_top_k: int = 8,  #tables handed to the selector on big schemas, 0 sends everything
+                 value_index: bool = False,  #ground string literals against real column values
+                 keep_alive: Optional[str] = "30m",  #how long ollama keeps the model loaded between calls
+                 few_shot_files: Optional[List[str]] = None,  #e.g. ["fewshots.txt"], [] to only use harvested examples
+                 few_shot_k: int = 4,
+                 embed_model: str = "nomic-embed-text",
+                 harvest_examples: bool = True,  #successful answers become examples for later questions
+                 dict_rows: bool = False,  #execution results as a list of dicts instead of a ColumnarResult
+                 query_budget: Optional[QueryBudget] = None,  #time/vm step/row limits for validation and execution
+                 cost_guard: bool = True,  #send queries with a hopeless plan back to the refiner before running them
+                 max_query_cost: float = 1e9,  #estimated row visits, a few seconds of sqlite per 1e8
+                 ollama_url: str = "http://localhost:11434",
+                 llm_recording: Optional[LLMRecording] = None,  #record or replay llm calls, see benchmark/
+                 tracer: Optional[Tracer] = None,  #pass one in to share metrics between instances
+                 llm_transport: Optional[OllamaTransport] = None,  #shared http session when running many instances
+                 speculative_candidates: int = 1,  #>1 runs that many decomposer candidates at once instead of refining serially
+                 speculative_policy: str = "first",  #"first" valid candidate wins, or "vote" on matching result sets
+                 schema_artifact: bool = False,  #keep the introspected schema in a .schema file next to the database
+                 column_stats: bool = False,  #profile columns in the background and tell the agents about formats and ranges
+                 column_stats_tokens: int = 200,  #rough prompt budget for those hints, the selector gets half
+                 result_cache_bytes: int = 32 * 1024 * 1024):  #memory for repeated query results, 0 turns it off
         
         self.database_path = database_path
         self.max_refinement_attempts = max_refinement_attempts
+        self.schema_prune_top_k = schema_prune_top_k
+        self.few_shot_k = few_shot_k
+        self.harvest_examples = harvest_examples
+        self.dict_rows = dict_rows
+        self.tracer = tracer or Tracer()
+        if speculative_policy not in ("first", "vote"):
+            raise ValueError(f"Unknown speculative policy: {speculative_policy}")
+        self.speculative_candidates = speculative_candidates
+        self.speculative_policy = speculative_policy
+        
+        self.llm_cache = None
+        if llm_cache:
+            self.llm_cache = LLMResponseCache(disk_path=llm_cache_path or f"{database_path}.llmcache")
         
-        self.llm_client = OllamaClient(model=model_name)
+        self._owns_transport = llm_transport is None
+        self.llm_client = OllamaClient(base_url=ollama_url, model=model_name, cache=self.llm_cache,
+                                       transport=llm_transport, keep_alive=keep_alive,
+                                       recording=llm_recording)
+        #the async client (and asyncio with it) is only built once something calls aquery
+        self._async_client_args = {"base_url": ollama_url, "model": model_name, "cache": self.llm_cache,
+                                   "keep_alive": keep_alive, "recording": llm_recording}
+        self._async_llm_client = None
         
-        self.selector = SelectorAgent(self.llm_client)
-        self.decomposer = DecomposerAgent(self.llm_client)
-        self.refiner = RefinerAgent(self.llm_client)
+        self.selector = SelectorAgent(self.llm_client, stream=stream, on_token=on_token)
+        self.decomposer = DecomposerAgent(self.llm_client, stream=stream, on_token=on_token)
+        self.refiner = RefinerAgent(self.llm_client, stream=stream, on_token=on_token)
         
         if not database_path:
             raise ValueError("database_path is required")
         
-        self.schema_extractor = SchemaExtractor(database_path)
-        self.validator = QueryValidator(database_path)
+        #one pool shared by introspection, validation and execution
+        self.pool = SQLiteConnectionPool(
+            database_path,
+            max_connections=pool_size,
+            read_only=read_only,
+            immutable=immutable,
+            **(pool_pragmas or {})
+        )
+        self.schema_extractor = SchemaExtractor(database_path, pool=self.pool,
+                                                artifact_path=f"{database_path}.schema" if schema_artifact else None)
+        self.validator = QueryValidator(database_path, pool=self.pool, budget=query_budget,
+                                        cost_guard=PlanCostGuard(max_cost=max_query_cost) if cost_guard else None,
+                                        result_cache=ResultCache(database_path, pool=self.pool, max_bytes=result_cache_bytes)
+                                        if result_cache_bytes else None)
+        self.repairer = SQLRepairer(self.validator)
+        self.answer_cache = AnswerCache(max_entries=answer_cache_size)
+        self.value_index = ValueIndex(database_path, pool=self.pool) if value_index else None
+        self.column_profiler = ColumnProfiler(database_path, pool=self.pool) if column_stats else None
+        self.column_stats_tokens = column_stats_tokens
         
-        print(f"MAC-SQL initialized with model: {model_name}")
+        #without a store the decomposer keeps its built in examples, built on first use
+        self.few_shot_files = few_shot_files
+        self.embed_model = embed_model
+        self._few_shot_store = None
+        self._few_shot_lock = threading.Lock()
+        
+        #aquery pushes blocking sqlite work here, sized to match the pool
+        self._sqlite_executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="macsql-sqlite")
+        self._candidate_executor = None
+        if speculative_candidates > 1:
+            self._candidate_executor = ThreadPoolExecutor(max_workers=speculative_candidates, thread_name_prefix="macsql-candidate")
+        
+        logger.info(f"MAC-SQL initialized with model: {model_name}")
     
-    def query(self, question: str) -> Dict[str, Any]:
-        print(f"Processing question: {question}")
+    def query(self, question: str, profile: bool = False) -> Dict[str, Any]:
+        #profile=True adds cProfile and tracemalloc output to the result, slow, for digging into a single question
+        with self.tracer.trace("query", question=question) as trace:
+            if profile:
+                with profile_block() as report:
+                    result = self._query(question)
+                result["profile"] = report
+            else:
+                result = self._query(question)
+            trace["status"] = "ok" if result["success"] else "error"
+        result["trace"] = {"trace_id": trace["trace_id"], "duration": trace["duration"], "spans": trace["spans"]}
+        return result
+    
+    def _query(self, question: str) -> Dict[str, Any]:
+        logger.info(f"Processing question: {question}")
         
         try:
             if not self.schema_extractor:
                 raise ValueError("No database configured")
             
-            schema = self.schema_extractor.get_schema_text()
-            cols = self.schema_extractor.get_column_list()
+            with self.tracer.span("schema") as span:
+                catalog = self.schema_extractor.get_catalog()
+                cols = self._columns_for_question(catalog, question)
+                fingerprint = catalog.fingerprint()
+                span["attrs"]["tables"] = len(catalog.tables)
+            
+            #seen this question before on this schema, skip the agents entirely
+            cached = self.answer_cache.get(question, fingerprint)
+            if cached is not None:
+                logger.info("Answer cache hit")
+                return {
+                    "question": question,
+                    "final_sql": cached["final_sql"],
+                    "selector_output": cached["selector_output"],
+                    "decomposer_output": cached["decomposer_output"],
+                    "tries": 0,
+                    "execution_result": self._execute(cached["final_sql"]),
+                    "success": True,
+                    "cache_hit": True
+                }
             
             #Selector Agent
-            print("Running Selector...")
-            sel_input = {"question": question, "schema": cols}
-            sel_result = self.selector.process(sel_input)
+            logger.info("Running Selector...")
+            with self.tracer.span("selector") as span:
+                sel_input = {"question": question, "schema": cols,
+                             "column_stats": self._column_hints(catalog, cols, self.column_stats_tokens // 2)}
+                sel_result = self.selector.process(sel_input)
+                self.tracer.record_llm(span, "selector", sel_result.get("llm_stats"))
+            llm_calls = [{"agent": "selector", **(sel_result.get("llm_stats") or {})}]
+            
+            literal_fixes = []
+            local_repairs = []
+            result = None
+            speculation = None
+            
+            if self._candidate_executor is not None:
+                logger.info(f"Running {self.speculative_candidates} Decomposer candidates...")
+                with self.tracer.span("speculate", candidates=self.speculative_candidates) as span:
+                    speculation = self._speculate(question, catalog, sel_result)
+                    span["attrs"]["winner"] = speculation["winner"]
+                decomp_result, query, result = self._use_candidate(speculation, llm_calls, literal_fixes, local_repairs)
+            else:
+                #Decomposer Agent
+                logger.info("Running Decomposer...")
+                with self.tracer.span("decomposer") as span:
+                    decomp_input = {
+                        "question": question,
+                        "selected_schema": sel_result["selected_schema"],
+                        "value_hints": self._value_hints(catalog, sel_result["selected_schema"]),
+                        "column_stats": self._column_hints(catalog, sel_result["selected_schema"], self.column_stats_tokens),
+                        "examples": self._few_shot_examples(question)
+                    }
+                    decomp_result = self.decomposer.process(decomp_input)
+                    self.tracer.record_llm(span, "decomposer", decomp_result.get("llm_stats"))
+                llm_calls.append({"agent": "decomposer", **(decomp_result.get("llm_stats") or {})})
+                query = self._ground_literals(catalog, decomp_result["sql_query"], literal_fixes)
+            
+            #refiner agent, skipped when a speculative candidate already ran cleanly
+            state = {"question": question, "catalog": catalog, "cols": cols, "query": query, "tries": 0,
+                     "execution_result": result, "literal_fixes": literal_fixes, "local_repairs": local_repairs,
+                     "llm_calls": llm_calls}
+            if result is None:
+                self._refinement_loop(state)
+            query, result, tries = state["query"], state["execution_result"], state["tries"]
+            
+            #send it home
+            if result is not None and result["success"]:
+                self.answer_cache.put(question, fingerprint, {
+                    "final_sql": query,
+                    "selector_output": sel_result,
+                    "decomposer_output": decomp_result
+                })
+                self._harvest_example(question, query)
+            
+            return {
+                "question": question,
+                "final_sql": query,
+                "selector_output": sel_result,
+                "decomposer_output": decomp_result,
+                "tries": tries,
+                "execution_result": result,
+                "literal_fixes": literal_fixes,
+                "local_repairs": local_repairs,
+                "llm_calls": llm_calls,  #per call prompt_eval_count/duration etc as reported by ollama
+                "speculation": self._speculation_summary(speculation),
+                "success": True,
+                "cache_hit": False
+            }
             
-            #Decomposer Agent
-            print("Running Decomposer...")
-            decomp_input = {
+        except Exception as e:
+            logger.error(f"MAC-SQL processing failed: {e}")
+            return {
                 "question": question,
-                "selected_schema": sel_result["selected_schema"]
+                "error": str(e),
+                "success": False
             }
-            decomp_result = self.decomposer.process(decomp_input)
-            
-            #refiner agent 
-            query = decomp_result["sql_query"]
-            tries = 0
-            
-            while tries < self.max_refinement_attempts:
-                print(f"Validation attempt {tries + 1}")
-                
-                #check query
-                if self.validator:
-                    check = self.validator.validate_query(query)
-                    if check["is_valid"]:
-                        print("Query valid")
-                        break
-                    else:
-                        print(f"Query failed: {check['error']}")
-                        err = check["error"]
-                else:
-                    err = "Check syntax"
-                
-                #refiner looping 
-                print(f"Running Refiner (attempt {tries + 1})...")
-                ref_input = {
-                    "sql_query": query,
-                    "error_message": err,
-                    "schema": cols,  
-                    "question": question
+    
+    def _columns_for_question(self, catalog, question: str) -> str:
+        top_k = self.schema_prune_top_k
+        if not top_k or len(catalog.tables) <= top_k:
+            return catalog.column_list()
+        
+        #built once per schema version, the catalog gets replaced when the schema changes
+        index = catalog.derived.get("schema_index")
+        if index is None:
+            index = catalog.derived["schema_index"] = SchemaIndex(catalog)
+            if self.schema_extractor.artifact_path:
+                #save it with the schema so the next engine on this file skips building it
+                self.schema_extractor.export_artifact(catalog=catalog)
+        
+        tables = index.select_tables(question, top_k=top_k, max_tables=2 * top_k)
+        return catalog.column_list_for(tables)
+    
+    def _get_value_index(self, catalog) -> Optional[ValueIndex]:
+        if self.value_index is None:
+            return None
+        #a schema change rebuilds right away, data is checked every refresh_interval seconds: appended tables
+        #(max rowid moved) get rescanned, and everything does once data_version says rows changed in place
+        built = self.value_index.refresh(catalog)
+        if built is not None and built["rebuilt"]:
+            logger.info(f"Value index: {built}")
+        return self.value_index
+    
+    def _value_hints(self, catalog, selected_schema: str) -> str:
+        index = self._get_value_index(catalog)
+        if index is None:
+            return ""
+        columns = [line.strip() for line in selected_schema.split('\n') if '.' in line.strip()]
+        return index.hints_for_columns(columns)
+    
+    def _column_hints(self, catalog, columns_text: str, max_tokens: int) -> str:
+        if self.column_profiler is None:
+            return ""
+        #never waits, the profiler runs in the background and hints fill in as tables get profiled
+        self.column_profiler.request(catalog)
+        columns = [line.strip() for line in columns_text.split('\n') if '.' in line.strip()]
+        return self.column_profiler.hints_for_columns(columns, max_tokens=max_tokens)
+    
+    def _ground_literals(self, catalog, query: str, literal_fixes: List[Dict[str, Any]]) -> str:
+        index = self._get_value_index(catalog)
+        if index is None:
+            return query
+        query, notes = index.ground_literals(query, catalog)
+        literal_fixes.extend(notes)
+        return query
+    
+    def _execute(self, query: str) -> Dict[str, Any]:
+        with self.tracer.span("execute") as span:
+            result = self.validator.execute_query(query, as_dicts=self.dict_rows)
+            span["attrs"].update(success=result["success"], rows=result.get("row_count", 0),
+                                 cached=result.get("result_cache_hit", False))
+        return result
+    
+    def _refinement_step(self, state: Dict[str, Any], execute: bool = True) -> Optional[str]:
+        #one pass short of the refiner: validate, try the mechanical schema fixes, then run it
+        #None once state["query"] is good (and its result is in state["execution_result"]), otherwise the error to refine on
+        attempt = state["tries"] + 1
+        with self.tracer.span("validate", attempt=attempt) as span:
+            check = self.validator.validate_query(state["query"])
+            span["attrs"]["valid"] = check["is_valid"]
+        if not check["is_valid"]:
+            logger.info(f"Query failed: {check['error']}")
+            
+            #the refiner only gets what local repairs cant handle
+            with self.tracer.span("repair", attempt=attempt) as span:
+                repaired = self.repairer.repair(state["query"], check["error"], state["catalog"], state["question"])
+                span["attrs"]["fixes"] = [fix["rule"] for fix in repaired["fixes"]] if repaired else []
+            if repaired is not None:
+                logger.info(f"Repaired locally: {[fix['rule'] for fix in repaired['fixes']]}")
+                state["query"], check = repaired["sql"], repaired["check"]
+                state["local_repairs"].extend(repaired["fixes"])
+            if not check["is_valid"]:
+                return check["error"]
+        
+        logger.info("Query valid")
+        if not execute:
+            return None
+        #runaway queries get cancelled by the budget and go back to the refiner
+        result = self._execute(state["query"])
+        if result.get("budget_exceeded"):
+            logger.info(f"Query cancelled: {result['error']}")
+            return result["error"]
+        state["execution_result"] = result
+        return None
+    
+    def _refinement_loop(self, state: Dict[str, Any], execute: bool = True) -> bool:
+        #False when the attempts ran out, state["query"] is then whatever the refiner said last
+        while state["tries"] < self.max_refinement_attempts:
+            logger.info(f"Validation attempt {state['tries'] + 1}")
+            error = self._refinement_step(state, execute)
+            if error is None:
+                return True
+            self._run_refiner(state, error)
+        return False
+    
+    def _run_refiner(self, state: Dict[str, Any], error: str):
+        logger.info(f"Running Refiner (attempt {state['tries'] + 1})...")
+        with self.tracer.span("refiner", attempt=state["tries"] + 1) as span:
+            ref_result = self.refiner.process({
+                "sql_query": state["query"],
+                "error_message": error,
+                "schema": state["cols"],
+                "question": state["question"]
+            })
+            self.tracer.record_llm(span, "refiner", ref_result.get("llm_stats"))
+        state["llm_calls"].append({"agent": "refiner", **(ref_result.get("llm_stats") or {})})
+        state["query"] = self._ground_literals(state["catalog"], ref_result["refined_query"], state["literal_fixes"])
+        state["tries"] += 1
+    
+    @property
+    def async_llm_client(self):
+        #only touched from the event loop thread, no lock needed
+        if self._async_llm_client is None:
+            from .async_llm_client import AsyncOllamaClient
+            
+            self._async_llm_client = AsyncOllamaClient(**self._async_client_args)
+            for agent in (self.selector, self.decomposer, self.refiner):
+                agent.async_llm = self._async_llm_client
+        return self._async_llm_client
+    
+    @property
+    def few_shot_store(self):
+        #numpy and the example files only get loaded once a question needs examples
+        if self._few_shot_store is None and self.few_shot_files is not None:
+            with self._few_shot_lock:
+                if self._few_shot_store is None:
+                    from .fewshot_store import FewShotStore
+                    
+                    store = FewShotStore(self.llm_client, embed_model=self.embed_model,
+                                         cache_path=f"{self.database_path}.embeddings")
+                    for path in self.few_shot_files:
+                        store.load_file(path)
+                    self._few_shot_store = store
+        return self._few_shot_store
+    
+    def _few_shot_examples(self, question: str) -> str:
+        if self.few_shot_store is None or not self.few_shot_k:
+            return ""
+        examples = self.few_shot_store.search(question, k=self.few_shot_k)
+        return self.few_shot_store.format_examples(examples)
+    
+    def _harvest_example(self, question: str, query: str):
+        if self.few_shot_store is not None and self.harvest_examples:
+            self.few_shot_store.add(question, query)
+    
+    def _candidate_input(self, index: int, question: str, sel_result: Dict[str, Any], value_hints: str, column_stats: str, examples: str) -> Dict[str, Any]:
+        #vary the sampling temperature, and every other candidate drops the retrieved examples for the built in ones
+        return {
+            "question": question,
+            "selected_schema": sel_result["selected_schema"],
+            "value_hints": value_hints,
+            "column_stats": column_stats,
+            "examples": examples if index % 2 == 0 else "",
+            "temperature": SPECULATIVE_TEMPERATURES[index % len(SPECULATIVE_TEMPERATURES)]
+        }
+    
+    def _run_candidate(self, index: int, question: str, catalog, decomp_input: Dict[str, Any], cancel: threading.Event) -> Dict[str, Any]:
+        candidate = {"index": index, "temperature": decomp_input["temperature"], "sql": None, "error": None,
+                     "result": None, "literal_fixes": [], "local_repairs": [], "cancelled": False}
+        with self.tracer.span("candidate", index=index, temperature=decomp_input["temperature"]) as span:
+            #a loser hangs up on ollama mid stream, its worker is free for the next query right away
+            try:
+                decomp_result = self.decomposer.process(decomp_input, cancel=cancel)
+            except GenerationCancelled:
+                candidate["cancelled"] = True
+                span["attrs"]["success"] = False
+                return candidate
+            self.tracer.record_llm(span, "decomposer", decomp_result.get("llm_stats"))
+            candidate["decomposer_output"] = decomp_result
+            query = candidate["sql"] = self._ground_literals(catalog, decomp_result["sql_query"], candidate["literal_fixes"])
+            
+            #a loser that already finished generating stops before touching sqlite again
+            if cancel.is_set():
+                candidate["cancelled"] = True
+                return candidate
+            check = self.validator.validate_query(query)
+            if not check["is_valid"]:
+                repaired = self.repairer.repair(query, check["error"], catalog, question)
+                if repaired is not None:
+                    query, check = repaired["sql"], repaired["check"]
+                    candidate["sql"] = query
+                    candidate["local_repairs"].extend(repaired["fixes"])
+            if not check["is_valid"]:
+                candidate["error"] = check["error"]
+            elif cancel.is_set():
+                candidate["cancelled"] = True
+            else:
+                candidate["result"] = self._execute(query)
+                candidate["error"] = candidate["result"].get("error")
+            span["attrs"]["success"] = candidate["error"] is None and candidate["result"] is not None
+        return candidate
+    
+    def _speculate(self, question: str, catalog, sel_result: Dict[str, Any]) -> Dict[str, Any]:
+        value_hints = self._value_hints(catalog, sel_result["selected_schema"])
+        column_stats = self._column_hints(catalog, sel_result["selected_schema"], self.column_stats_tokens)
+        examples = self._few_shot_examples(question)
+        total = self.speculative_candidates
+        cancel = threading.Event()
+        futures = {}
+        for index in range(total):
+            decomp_input = self._candidate_input(index, question, sel_result, value_hints, column_stats, examples)
+            future = self._candidate_executor.submit(contextvars.copy_context().run, self._run_candidate,
+                                                     index, question, catalog, decomp_input, cancel)
+            futures[future] = index
+        
+        finished = []
+        winner = None
+        for future in as_completed(futures):
+            try:
+                finished.append(future.result())
+            except Exception as e:
+                finished.append({"index": futures[future], "sql": None, "error": str(e), "result": None, "cancelled": False})
+            winner = self._pick_candidate(finished, total)
+            if winner is not None:
+                break
+        
+        #whatever is still queued never starts, running ones hang up their stream or stop between stages
+        cancel.set()
+        for future in futures:
+            future.cancel()
+        return {"winner": winner["index"] if winner else None, "candidates": finished, "total": total}
+    
+    async def _arun_candidate(self, index: int, question: str, catalog, decomp_input: Dict[str, Any]) -> Dict[str, Any]:
+        candidate = {"index": index, "temperature": decomp_input["temperature"], "sql": None, "error": None,
+                     "result": None, "literal_fixes": [], "local_repairs": [], "cancelled": False}
+        with self.tracer.span("candidate", index=index, temperature=decomp_input["temperature"]) as span:
+            decomp_result = await self.decomposer.aprocess(decomp_input)
+            self.tracer.record_llm(span, "decomposer", decomp_result.get("llm_stats"))
+            candidate["decomposer_output"] = decomp_result
+            query = candidate["sql"] = await self._run_sqlite(self._ground_literals, catalog, decomp_result["sql_query"], candidate["literal_fixes"])
+            
+            check = await self._run_sqlite(self.validator.validate_query, query)
+            if not check["is_valid"]:
+                repaired = await self._run_sqlite(self.repairer.repair, query, check["error"], catalog, question)
+                if repaired is not None:
+                    query, check = repaired["sql"], repaired["check"]
+                    candidate["sql"] = query
+                    candidate["local_repairs"].extend(repaired["fixes"])
+            if not check["is_valid"]:
+                candidate["error"] = check["error"]
+            else:
+                candidate["result"] = await self._run_sqlite(self._execute, query)
+                candidate["error"] = candidate["result"].get("error")
+            span["attrs"]["success"] = candidate["error"] is None
+        return candidate
+    
+    async def _aspeculate(self, question: str, catalog, sel_result: Dict[str, Any], value_hints: str, column_stats: str, examples: str) -> Dict[str, Any]:
+        import asyncio
+        
+        total = self.speculative_candidates
+        tasks = {}
+        for index in range(total):
+            decomp_input = self._candidate_input(index, question, sel_result, value_hints, column_stats, examples)
+            tasks[asyncio.ensure_future(self._arun_candidate(index, question, catalog, decomp_input))] = index
+        
+        finished = []
+        winner = None
+        pending = set(tasks)
+        while pending and winner is None:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in sorted(done, key=tasks.get):
+                try:
+                    finished.append(task.result())
+                except Exception as e:
+                    finished.append({"index": tasks[task], "sql": None, "error": str(e), "result": None, "cancelled": False})
+            winner = self._pick_candidate(finished, total)
+        
+        #unlike threads a cancelled task drops its ollama request too
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.wait(pending)
+        return {"winner": winner["index"] if winner else None, "candidates": finished, "total": total}
+    
+    def _pick_candidate(self, finished: List[Dict[str, Any]], total: int) -> Optional[Dict[str, Any]]:
+        ok = [c for c in finished if c["result"] is not None and c["result"]["success"] and not c["result"].get("budget_exceeded")]
+        if not ok:
+            return None
+        if self.speculative_policy == "first":
+            return ok[0]
+        
+        #vote: candidates that return the same rows agree, a majority of all candidates settles it early
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for candidate in ok:
+            candidate["fingerprint"] = result_fingerprint(candidate["result"]["results"])
+            groups.setdefault(candidate["fingerprint"], []).append(candidate)
+        best = max(groups.values(), key=lambda group: (len(group), -min(c["index"] for c in group)))
+        if len(best) > total // 2 or len(finished) == total:
+            return min(best, key=lambda c: c["index"])
+        return None
+    
+    def _use_candidate(self, speculation: Dict[str, Any], llm_calls: List[Dict[str, Any]],
+                       literal_fixes: List[Dict[str, Any]], local_repairs: List[Dict[str, Any]]):
+        #returns (decomposer output, sql, execution result), result is None when the refiner still has work to do
+        candidates = speculation["candidates"]
+        for candidate in candidates:
+            if candidate.get("decomposer_output"):
+                llm_calls.append({"agent": "decomposer", "candidate": candidate["index"],
+                                  **(candidate["decomposer_output"].get("llm_stats") or {})})
+        
+        if speculation["winner"] is not None:
+            chosen = next(c for c in candidates if c["index"] == speculation["winner"])
+        else:
+            #nothing ran cleanly, refine the lowest temperature candidate that produced any sql
+            generated = sorted((c for c in candidates if c["sql"]), key=lambda c: c["index"])
+            if not generated:
+                raise RuntimeError(f"All speculative candidates failed: {candidates[0]['error']}")
+            chosen = generated[0]
+        
+        literal_fixes.extend(chosen["literal_fixes"])
+        local_repairs.extend(chosen["local_repairs"])
+        result = chosen["result"] if speculation["winner"] is not None else None
+        return chosen["decomposer_output"], chosen["sql"], result
+    
+    def _speculation_summary(self, speculation: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if speculation is None:
+            return None
+        return {
+            "winner": speculation["winner"],
+            "policy": self.speculative_policy,
+            "finished": len(speculation["candidates"]),
+            "abandoned": speculation["total"] - len(speculation["candidates"]),
+            "candidates": [{
+                "index": c["index"],
+                "temperature": c.get("temperature"),
+                "sql": c["sql"],
+                "success": c["result"] is not None and c["result"]["success"],
+                "error": c["error"],
+                "fingerprint": c.get("fingerprint"),
+                "cancelled": c.get("cancelled", False)
+            } for c in sorted(speculation["candidates"], key=lambda c: c["index"])]
+        }
+    
+    async def _run_sqlite(self, fn, *args):
+        import asyncio
+        
+        loop = asyncio.get_running_loop()
+        #carry the current trace into the worker thread so spans opened there still attach to it
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(self._sqlite_executor, ctx.run, fn, *args)
+    
+    async def _arefinement_loop(self, state: Dict[str, Any]) -> bool:
+        #same steps as _refinement_loop, sqlite work goes through the executor and the refiner through the async client
+        while state["tries"] < self.max_refinement_attempts:
+            logger.info(f"Validation attempt {state['tries'] + 1}")
+            error = await self._run_sqlite(self._refinement_step, state)
+            if error is None:
+                return True
+            await self._arun_refiner(state, error)
+        return False
+    
+    async def _arun_refiner(self, state: Dict[str, Any], error: str):
+        logger.info(f"Running Refiner (attempt {state['tries'] + 1})...")
+        with self.tracer.span("refiner", attempt=state["tries"] + 1) as span:
+            ref_result = await self.refiner.aprocess({
+                "sql_query": state["query"],
+                "error_message": error,
+                "schema": state["cols"],
+                "question": state["question"]
+            })
+            self.tracer.record_llm(span, "refiner", ref_result.get("llm_stats"))
+        state["llm_calls"].append({"agent": "refiner", **(ref_result.get("llm_stats") or {})})
+        state["query"] = await self._run_sqlite(self._ground_literals, state["catalog"], ref_result["refined_query"], state["literal_fixes"])
+        state["tries"] += 1
+    
+    async def aquery(self, question: str) -> Dict[str, Any]:
+        #no profile option here, cProfile would pick up every other question running on the loop
+        self.async_llm_client  #hands the agents their async client on first use
+        with self.tracer.trace("aquery", question=question) as trace:
+            result = await self._aquery(question)
+            trace["status"] = "ok" if result["success"] else "error"
+        result["trace"] = {"trace_id": trace["trace_id"], "duration": trace["duration"], "spans": trace["spans"]}
+        return result
+    
+    async def _aquery(self, question: str) -> Dict[str, Any]:
+        import asyncio
+        
+        logger.info(f"Processing question: {question}")
+        
+        try:
+            with self.tracer.span("schema") as span:
+                catalog = await self._run_sqlite(self.schema_extractor.get_catalog)
+                #the first call on a schema builds the schema index, possibly writing the artifact
+                cols = await self._run_sqlite(self._columns_for_question, catalog, question)
+                fingerprint = catalog.fingerprint()
+                span["attrs"]["tables"] = len(catalog.tables)
+            
+            cached = self.answer_cache.get(question, fingerprint)
+            if cached is not None:
+                logger.info("Answer cache hit")
+                return {
+                    "question": question,
+                    "final_sql": cached["final_sql"],
+                    "selector_output": cached["selector_output"],
+                    "decomposer_output": cached["decomposer_output"],
+                    "tries": 0,
+                    "execution_result": await self._run_sqlite(self._execute, cached["final_sql"]),
+                    "success": True,
+                    "cache_hit": True
                 }
-                ref_result = self.refiner.process(ref_input)
-                query = ref_result["refined_query"]
-                tries += 1
             
-            #send it home
+            logger.info("Running Selector...")
+            with self.tracer.span("selector") as span:
+                sel_result = await self.selector.aprocess({
+                    "question": question,
+                    "schema": cols,
+                    "column_stats": self._column_hints(catalog, cols, self.column_stats_tokens // 2)
+                })
+                self.tracer.record_llm(span, "selector", sel_result.get("llm_stats"))
+            llm_calls = [{"agent": "selector", **(sel_result.get("llm_stats") or {})}]
+            
+            literal_fixes = []
+            local_repairs = []
             result = None
-            if self.validator and check.get("is_valid", False):
-                result = self.validator.execute_query(query)
+            speculation = None
+            
+            value_hints = await self._run_sqlite(self._value_hints, catalog, sel_result["selected_schema"])
+            column_stats = self._column_hints(catalog, sel_result["selected_schema"], self.column_stats_tokens)
+            #embedding lookups are blocking http calls, keep them off the event loop
+            examples = await asyncio.get_running_loop().run_in_executor(None, self._few_shot_examples, question)
+            
+            if self.speculative_candidates > 1:
+                logger.info(f"Running {self.speculative_candidates} Decomposer candidates...")
+                with self.tracer.span("speculate", candidates=self.speculative_candidates) as span:
+                    speculation = await self._aspeculate(question, catalog, sel_result, value_hints, column_stats, examples)
+                    span["attrs"]["winner"] = speculation["winner"]
+                decomp_result, query, result = self._use_candidate(speculation, llm_calls, literal_fixes, local_repairs)
+            else:
+                logger.info("Running Decomposer...")
+                with self.tracer.span("decomposer") as span:
+                    decomp_result = await self.decomposer.aprocess({
+                        "question": question,
+                        "selected_schema": sel_result["selected_schema"],
+                        "value_hints": value_hints,
+                        "column_stats": column_stats,
+                        "examples": examples
+                    })
+                    self.tracer.record_llm(span, "decomposer", decomp_result.get("llm_stats"))
+                llm_calls.append({"agent": "decomposer", **(decomp_result.get("llm_stats") or {})})
+                #grounding may (re)build the value index, sqlite scans and a gzip write
+                query = await self._run_sqlite(self._ground_literals, catalog, decomp_result["sql_query"], literal_fixes)
+            
+            state = {"question": question, "catalog": catalog, "cols": cols, "query": query, "tries": 0,
+                     "execution_result": result, "literal_fixes": literal_fixes, "local_repairs": local_repairs,
+                     "llm_calls": llm_calls}
+            if result is None:
+                await self._arefinement_loop(state)
+            query, result, tries = state["query"], state["execution_result"], state["tries"]
+            
+            if result is not None and result["success"]:
+                self.answer_cache.put(question, fingerprint, {
+                    "final_sql": query,
+                    "selector_output": sel_result,
+                    "decomposer_output": decomp_result
+                })
+                self._harvest_example(question, query)
             
             return {
                 "question": question,
@@ -98,17 +718,41 @@ class MACSQL:
                 "decomposer_output": decomp_result,
                 "tries": tries,
                 "execution_result": result,
-                "success": True
+                "literal_fixes": literal_fixes,
+                "local_repairs": local_repairs,
+                "llm_calls": llm_calls,  #per call prompt_eval_count/duration etc as reported by ollama
+                "speculation": self._speculation_summary(speculation),
+                "success": True,
+                "cache_hit": False
             }
-            
+        
         except Exception as e:
-            print(f"MAC-SQL processing failed: {e}")
+            logger.error(f"MAC-SQL processing failed: {e}")
             return {
                 "question": question,
                 "error": str(e),
                 "success": False
             }
     
+    async def aquery_many(self, questions: List[str], concurrency: int = 16) -> List[Dict[str, Any]]:
+        import asyncio
+        
+        #results come back in the same order as the questions
+        sem = asyncio.Semaphore(concurrency)
+        
+        async def run_one(question: str) -> Dict[str, Any]:
+            async with sem:
+                return await self.aquery(question)
+        
+        return await asyncio.gather(*(run_one(q) for q in questions))
+    
+    def query_batch(self,
+                    questions: Iterable[str],
+                    workers: Optional[Dict[str, int]] = None,  #per stage, e.g. {"decomposer": 4, "execute": 2}
+                    queue_size: int = 16) -> Iterator[Dict[str, Any]]:
+        #results come back as they finish, not in input order, each one carries its "index"
+        return BatchPipeline(self, workers=workers, queue_size=queue_size).run(questions)
+    
     def test_connection(self) -> Dict[str, Any]:
         results = {}
         
@@ -116,20 +760,25 @@ class MACSQL:
         try:
             if self.llm_client.is_available():
                 results["llm_status"] = "connected"
-                print(f"LLM model {self.llm_client.model} is available")
+                logger.info(f"LLM model {self.llm_client.model} is available")
             else:
                 results["llm_status"] = "model_not_found"
-                print(f"Model {self.llm_client.model} not found")
+                logger.warning(f"Model {self.llm_client.model} not found")
         except Exception as e:
             results["llm_status"] = f"error: {e}"
         
         #ensure db is in order
         if self.database_path:
             try:
-                with sqlite3.connect(self.database_path) as conn:
+                with self.pool.connection() as conn:
                     conn.execute("SELECT 1")
                 results["database_status"] = "connected"
-                print(f"Database {self.database_path} is accessible")
+                results["pool"] = self.pool.stats()
+                results["local_repairs"] = self.repairer.stats()
+                results["validation_cache"] = self.validator.stats()
+                if self.validator.result_cache is not None:
+                    results["result_cache"] = self.validator.result_cache.stats()
+                logger.info(f"Database {self.database_path} is accessible")
             except Exception as e:
                 results["database_status"] = f"error: {e}"
         else:
@@ -137,6 +786,33 @@ class MACSQL:
         
         return results
     
+    def close(self):
+        #drops the per database state, the instance is unusable afterwards
+        self._sqlite_executor.shutdown(wait=True)
+        if self._candidate_executor is not None:
+            self._candidate_executor.shutdown(wait=True)
+        if self.column_profiler is not None:
+            self.column_profiler.close()
+        if self.value_index is not None:
+            self.value_index.close()
+        if self.validator.result_cache is not None:
+            self.validator.result_cache.close()
+        self.pool.close()
+        if self.llm_cache is not None:
+            self.llm_cache.close()
+        if self._owns_transport:
+            self.llm_client.transport.close()
+        #the async client opens a connection per request, letting go of it is all the shutdown it needs
+        self._async_llm_client = None
+        for agent in (self.selector, self.decomposer, self.refiner):
+            agent.async_llm = None
+    
+    def metrics(self, fmt: str = "json"):
+        #stage and llm timings across every query so far, fmt="prometheus" for a /metrics endpoint
+        if fmt == "prometheus":
+            return self.tracer.metrics.to_prometheus()
+        return self.tracer.metrics.to_json()
+    
 
 
 
@@ -160,12 +836,12 @@ class MACSQL:
             print(f"\nResults ({row_count} rows):")
                     
             if results:
-                headers = list(results[0].keys())
+                headers = result["execution_result"]["column_names"]
                 print("  " + " | ".join(headers))
                 print("  " + "-" * (len(" | ".join(headers))))
                             
                 for row in results[:10]:
-                    values = [str(row[h]) for h in headers]
+                    values = [str(v) for v in (row.values() if isinstance(row, dict) else row)]
                     print("  " + " | ".join(values))
                         
                     if len(results) > 10:
@@ -0,0 +1,135 @@
+import logging
+import random
+import threading
+import time
+from typing import Dict, Any, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import requests
+
+
+logger = logging.getLogger(__name__)
+
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+def request_error() -> type:
+    #base class of everything requests raises, for except clauses in modules that dont import it
+    #themselves, by the time one of these is raised requests has long been loaded
+    import requests
+    return requests.RequestException
+
+
+class RetryPolicy:
+    def __init__(self, max_retries: int = 3, backoff_base: float = 0.5, backoff_max: float = 8.0):
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def delay(self, attempt: int) -> float:
+        #full jitter so a burst of failed callers doesnt hammer ollama in lockstep
+        cap = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, cap)
+
+    def should_retry_status(self, status: int) -> bool:
+        return status in RETRY_STATUSES
+
+
+class OllamaTransport:
+    def __init__(self,
+                 base_url: str = "http://localhost:11434",
+                 pool_size: int = 10,
+                 connect_timeout: float = 5.0,
+                 read_timeout: float = 120.0,
+                 retry: Optional[RetryPolicy] = None):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retry = retry or RetryPolicy()
+
+        self.pool_size = pool_size
+        self._session = None
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    @property
+    def session(self) -> "requests.Session":
+        #requests is most of our import time, built on the first call so workers answering
+        #from the llm cache or a recording never load it. configured once and never mutated
+        #afterwards, the urllib3 pool underneath is thread safe so one instance serves every thread
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, pool_block=True, max_retries=0)
+                    session.mount("http://", adapter)
+                    session.mount("https://", adapter)
+                    self._session = session
+        return self._session
+
+    def _count(self, field: str):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def request(self,
+                method: str,
+                path: str,
+                payload: Optional[Dict[str, Any]] = None,
+                read_timeout: Optional[float] = None,
+                stream: bool = False) -> "requests.Response":
+        timeout = (self.connect_timeout, read_timeout if read_timeout is not None else self.read_timeout)
+        url = f"{self.base_url}{path}"
+        attempt = 0
+
+        while True:
+            self._count("requests")
+            try:
+                response = self.session.request(method, url, json=payload, timeout=timeout, stream=stream)
+            except self._connection_error() as e:
+                #covers connect timeouts too, a read timeout is not retried since the
+                #model is just slow and asking again would only double the wait
+                if attempt >= self.retry.max_retries:
+                    self._count("failures")
+                    raise
+                logger.warning(f"Ollama connection error, retrying: {e}")
+            else:
+                if not self.retry.should_retry_status(response.status_code) or attempt >= self.retry.max_retries:
+                    if response.status_code >= 400:
+                        self._count("failures")
+                    return response
+                logger.warning(f"Ollama returned {response.status_code}, retrying")
+                response.close()
+
+            self._count("retries")
+            time.sleep(self.retry.delay(attempt))
+            attempt += 1
+
+    def post(self, path: str, payload: Dict[str, Any], **kwargs) -> "requests.Response":
+        return self.request("POST", path, payload, **kwargs)
+
+    def get(self, path: str, **kwargs) -> "requests.Response":
+        return self.request("GET", path, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+            }
+
+    @staticmethod
+    def _connection_error() -> type:
+        import requests
+        return requests.ConnectionError
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
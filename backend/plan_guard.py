@@ -0,0 +1,178 @@
+import math
+import re
+import sqlite3
+import threading
+import time
+from typing import List, Dict, Any, Optional, Tuple
+
+
+#older sqlite says "SCAN TABLE x", newer just "SCAN x"
+_LOOP = re.compile(r"^(SCAN|SEARCH)\s+(?:TABLE\s+)?(\S+)(?:\s+AS\s+(\S+))?(.*)$")
+_INDEX = re.compile(r"USING (?:COVERING )?INDEX (\w+)")
+_TABLE_REF = re.compile(r"(?:\bFROM|\bJOIN|,)\s*(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_NOT_ALIASES = {"where", "join", "on", "inner", "left", "right", "outer", "cross", "group", "order", "limit", "natural", "using", "union", "having"}
+
+DEFAULT_ROWS = 1000  #ctes, subqueries and anything else we cant look up
+INDEX_LOOKUP_ROWS = 10  #rows per index probe when sqlite_stat1 has nothing better
+
+
+def parse_plan(plan: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    #EXPLAIN QUERY PLAN rows come flat with parent ids, rebuild the tree
+    nodes = {row["id"]: {**row, "children": []} for row in plan}
+    roots = []
+    for row in plan:
+        node = nodes[row["id"]]
+        parent = nodes.get(row["parent"])
+        if parent is None:
+            roots.append(node)
+        else:
+            parent["children"].append(node)
+    return roots
+
+
+class TableStats:
+    def __init__(self, ttl_seconds: float = 300.0):
+        #row counts drift with the data not the schema, so they just expire
+        self.ttl_seconds = ttl_seconds
+        self._tables: Dict[str, int] = {}
+        self._indexes: Dict[str, List[int]] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _refresh(self, conn: sqlite3.Connection):
+        self._tables, self._indexes = {}, {}
+        try:
+            rows = conn.execute("SELECT tbl, idx, stat FROM sqlite_stat1").fetchall()
+        except sqlite3.OperationalError:
+            rows = []  #never ANALYZEd
+        for tbl, idx, stat in rows:
+            numbers = [int(n) for n in str(stat).split() if n.isdigit()]
+            if not numbers:
+                continue
+            self._tables.setdefault(tbl.lower(), numbers[0])
+            if idx:
+                self._indexes[idx.lower()] = numbers
+        self._loaded_at = time.monotonic()
+
+    def table_rows(self, conn: sqlite3.Connection, table_name: str) -> int:
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl_seconds:
+                self._refresh(conn)
+            key = table_name.lower()
+            if key not in self._tables:
+                self._tables[key] = self._sample_count(conn, table_name)
+            return self._tables[key]
+
+    def index_rows(self, index_name: str) -> Optional[int]:
+        #average rows per value of the first indexed column
+        numbers = self._indexes.get(index_name.lower())
+        return numbers[1] if numbers and len(numbers) > 1 else None
+
+    def _sample_count(self, conn: sqlite3.Connection, table_name: str) -> int:
+        #max(rowid) is one btree seek, close enough unless the table had big deletes
+        try:
+            count = conn.execute(f'SELECT MAX(rowid) FROM "{table_name}"').fetchone()[0]
+        except sqlite3.OperationalError:
+            count = conn.execute(f'SELECT COUNT(*) FROM (SELECT 1 FROM "{table_name}" LIMIT 1000000)').fetchone()[0]
+        return count or 0
+
+
+class PlanCostGuard:
+    def __init__(self,
+                 warn_cost: float = 1e7,  #estimated row visits before we log a warning
+                 max_cost: float = 1e9,  #past this the query goes back to the refiner instead of running
+                 large_table_rows: int = 100000,
+                 stats_ttl_seconds: float = 300.0):
+        self.warn_cost = warn_cost
+        self.max_cost = max_cost
+        self.large_table_rows = large_table_rows
+        self.stats = TableStats(stats_ttl_seconds)
+
+    def evaluate(self, plan: List[Dict[str, Any]], query: str, conn: sqlite3.Connection) -> Dict[str, Any]:
+        aliases = self._aliases(query, conn)
+        issues: List[Dict[str, Any]] = []
+        cost = self._cost(parse_plan(plan), 1.0, aliases, conn, issues)
+
+        verdict = "accept"
+        if cost > self.max_cost:
+            verdict = "refine"
+        elif cost > self.warn_cost or any(issue["severity"] == "warn" for issue in issues):
+            verdict = "warn"
+        return {"verdict": verdict, "cost": cost, "issues": issues}
+
+    def error(self, evaluation: Dict[str, Any]) -> str:
+        #same opening words as a budget cancellation so the refiner treats them alike
+        serious = [issue for issue in evaluation["issues"] if issue["severity"] != "info"] or evaluation["issues"]
+        reasons = "; ".join(issue["message"] for issue in serious) or "large scans"
+        return f"Query too expensive: estimated {evaluation['cost']:.0f} row visits ({reasons})"
+
+    def _aliases(self, query: str, conn: sqlite3.Connection) -> Dict[str, str]:
+        names = {row[0].lower(): row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        aliases = dict(names)
+        for table_ref, alias in _TABLE_REF.findall(query):
+            table_name = names.get(table_ref.lower())
+            if table_name and alias and alias.lower() not in _NOT_ALIASES:
+                aliases[alias.lower()] = table_name
+        return aliases
+
+    def _loop_rows(self, node: Dict[str, Any], aliases: Dict[str, str], conn: sqlite3.Connection) -> Tuple[float, Optional[str], float]:
+        #(rows per iteration, table name, one off setup cost) for a SCAN or SEARCH step
+        match = _LOOP.match(node["detail"])
+        kind, name, alias, rest = match.groups()
+        table_name = aliases.get((alias or name).lower()) or aliases.get(name.lower())
+        table_rows = self.stats.table_rows(conn, table_name) if table_name else DEFAULT_ROWS
+
+        if kind == "SCAN":
+            return float(table_rows), table_name, 0.0
+        if "PRIMARY KEY" in rest and "=" in rest and "<" not in rest and ">" not in rest:
+            return 1.0, table_name, 0.0
+        if "AUTOMATIC" in rest:
+            #sqlite builds a throwaway index first, that means a full pass over the table
+            return float(min(table_rows, INDEX_LOOKUP_ROWS)), table_name, float(table_rows)
+        index = _INDEX.search(rest)
+        per_key = self.stats.index_rows(index.group(1)) if index else None
+        if "<" in rest or ">" in rest:
+            per_key = max(per_key or 0, table_rows / 4)  #range scans, assume a quarter of the table
+        return float(min(table_rows, per_key or INDEX_LOOKUP_ROWS)), table_name, 0.0
+
+    def _cost(self, nodes: List[Dict[str, Any]], outer_rows: float, aliases: Dict[str, str],
+              conn: sqlite3.Connection, issues: List[Dict[str, Any]]) -> float:
+        #siblings that scan or search tables are nested loops, each one runs once per row of the ones before it
+        cost = 0.0
+        loop_rows = outer_rows
+        loop_depth = 0
+        for node in nodes:
+            detail = node["detail"]
+            if _LOOP.match(detail):
+                rows, table_name, setup = self._loop_rows(node, aliases, conn)
+                cost += setup + loop_rows * rows
+                if setup:
+                    issues.append({"kind": "automatic_index", "table": table_name, "severity": "warn",
+                                   "message": f"no index on the join key of {table_name}, sqlite has to build one per query"})
+                #DEFAULT_ROWS is a guess, only flag scans of tables we actually counted
+                if detail.startswith("SCAN") and table_name and rows >= self.large_table_rows:
+                    if loop_depth > 0:
+                        issues.append({"kind": "join_scan", "table": table_name, "severity": "error",
+                                       "message": f"full scan of {table_name} ({rows:.0f} rows) inside a join loop, join condition missing or not indexed"})
+                    else:
+                        issues.append({"kind": "full_scan", "table": table_name, "severity": "info",
+                                       "message": f"full scan of {table_name} ({rows:.0f} rows)"})
+                loop_rows *= max(rows, 1.0)
+                loop_depth += 1
+                cost += self._cost(node["children"], loop_rows, aliases, conn, issues)
+            elif detail.startswith("USE TEMP B-TREE"):
+                cost += loop_rows * math.log2(loop_rows + 1)
+                if loop_rows >= self.large_table_rows:
+                    issues.append({"kind": "temp_btree", "table": None, "severity": "info",
+                                   "message": f"{detail.lower()} over ~{loop_rows:.0f} rows"})
+            elif detail.startswith("CORRELATED"):
+                #runs again for every outer row
+                sub_cost = self._cost(node["children"], loop_rows, aliases, conn, issues)
+                cost += sub_cost
+                if loop_rows > 1:
+                    issues.append({"kind": "correlated_subquery", "table": None, "severity": "warn" if sub_cost > self.warn_cost else "info",
+                                   "message": f"correlated subquery runs ~{loop_rows:.0f} times"})
+            else:
+                #materialized subqueries, co-routines, compound parts: evaluated once
+                cost += self._cost(node["children"], 1.0, aliases, conn, issues)
+        return cost
@@ -0,0 +1,62 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, Iterator
+
+
+class QueryBudget:
+    def __init__(self,
+                 max_seconds: Optional[float] = 10.0,  #wall clock per statement, None for no limit
+                 max_vm_steps: Optional[int] = 500_000_000,  #sqlite bytecode steps, catches runaway joins on fast machines too
+                 max_rows: Optional[int] = 10000,  #rows materialized by execute_query
+                 temp_store: Optional[str] = None,  #"FILE" keeps big sorts off the heap, None leaves the pool setting
+                 check_every: int = 10000):  #progress handler granularity in vm steps
+        self.max_seconds = max_seconds
+        self.max_vm_steps = max_vm_steps
+        self.max_rows = max_rows
+        self.temp_store = temp_store
+        self.check_every = check_every
+
+    @contextmanager
+    def guard(self, conn: sqlite3.Connection) -> Iterator["BudgetState"]:
+        state = BudgetState(self)
+        previous_temp = None
+        if self.temp_store:
+            previous_temp = conn.execute("PRAGMA temp_store").fetchone()[0]
+            conn.execute(f"PRAGMA temp_store = {self.temp_store}")
+        if self.max_seconds is not None or self.max_vm_steps is not None:
+            conn.set_progress_handler(state.tick, self.check_every)
+        try:
+            yield state
+        finally:
+            #the connection goes back to a shared pool, leave nothing behind
+            conn.set_progress_handler(None, 0)
+            if previous_temp is not None:
+                conn.execute(f"PRAGMA temp_store = {previous_temp}")
+
+
+class BudgetState:
+    def __init__(self, budget: QueryBudget):
+        self.budget = budget
+        self.started = time.monotonic()
+        self.steps = 0
+        self.exceeded: Optional[Dict[str, Any]] = None
+
+    def tick(self) -> int:
+        #non zero tells sqlite to interrupt the running statement
+        self.steps += self.budget.check_every
+        if self.budget.max_vm_steps is not None and self.steps > self.budget.max_vm_steps:
+            self.exceeded = {"kind": "vm_steps", "limit": self.budget.max_vm_steps, "used": self.steps}
+            return 1
+        elapsed = time.monotonic() - self.started
+        if self.budget.max_seconds is not None and elapsed > self.budget.max_seconds:
+            self.exceeded = {"kind": "time", "limit": self.budget.max_seconds, "used": round(elapsed, 3)}
+            return 1
+        return 0
+
+    def error(self) -> str:
+        #worded for the refiner, runaway queries are nearly always a missing join condition
+        kind = self.exceeded["kind"]
+        what = f"ran longer than {self.exceeded['limit']}s" if kind == "time" else f"used more than {self.exceeded['limit']} VM steps"
+        return (f"Query too expensive: {what} and was cancelled. "
+                "Check for a JOIN without an ON condition (cartesian product) or a missing WHERE filter")
@@ -1,88 +1,280 @@
+import logging
 import sqlite3
-import sqlparse
-from typing import Dict, Any, List
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple, Iterator
+
+from .connection_pool import SQLiteConnectionPool
+from .result_set import ColumnarResult, write_csv, write_jsonl
+from .query_budget import QueryBudget
+from .plan_guard import PlanCostGuard
+from .result_cache import ResultCache
+
+
+logger = logging.getLogger(__name__)
+
+
+#make sure the LLM doesnt nuke the DB for fun, matched against keyword tokens
+#only so columns like created_at or updated_by dont trip it
+DANGEROUS_KEYWORDS = ("DROP", "DELETE", "UPDATE", "INSERT", "ALTER", "CREATE", "TRUNCATE")
+
+#errors that say nothing about the query itself, never cached
+_TRANSIENT_ERRORS = ("locked", "busy", "interrupted")
 
 
 class QueryValidator:
-    def __init__(self, database_path: str):
+    def __init__(self,
+                 database_path: str,
+                 pool: Optional[SQLiteConnectionPool] = None,
+                 cache_size: int = 512,
+                 budget: Optional[QueryBudget] = None,
+                 cost_guard: Optional[PlanCostGuard] = None,  #None skips the plan cost check
+                 result_cache: Optional[ResultCache] = None):  #None runs every execute_query against sqlite
         self.database_path = database_path
+        self.pool = pool or SQLiteConnectionPool(database_path)
+        self.cache_size = cache_size
+        self.budget = budget or QueryBudget()
+        self.cost_guard = cost_guard
+        self.result_cache = result_cache
+        
+        #(sql, schema_version) -> check result with the parsed statement and query plan
+        self._cache: "OrderedDict[Tuple[str, int], Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
     
     def validate_query(self, query: str) -> Dict[str, Any]:
         try:
-            #make there is a query
-            parsed = sqlparse.parse(query)
-            if not parsed:
-                return {
-                    "is_valid": False,
-                    "error": "Empty or invalid SQL query"
-                }
-            q_upper = query.upper().strip()
-            
-            #make sure the LLM doesnt nuke the DB for fun
-            dangerous_keywords = ["DROP", "DELETE", "UPDATE", "INSERT", "ALTER", "CREATE", "TRUNCATE"]
-            
-            for keyword in dangerous_keywords:
-                if keyword in q_upper:
+            with self.pool.connection() as conn:
+                return self._check(conn, query)
+        except Exception as e:
+            return {
+                "is_valid": False,
+                "error": f"Query validation failed: {str(e)}"
+            }
+    
+    def _check(self, conn: sqlite3.Connection, query: str) -> Dict[str, Any]:
+        #same text on the same schema always gets the same answer
+        schema_version = conn.execute("PRAGMA schema_version").fetchone()[0]
+        key = (query, schema_version)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+        
+        if cached is not None:
+            return self._check_cost(conn, query, {**cached, "cached": True})
+        
+        with self._lock:
+            self.misses += 1
+        check = self._run_checks(conn, query)
+        error = (check["error"] or "").lower()
+        transient = "budget_exceeded" in check or any(word in error for word in _TRANSIENT_ERRORS)
+        if self.cache_size > 0 and not transient:
+            with self._lock:
+                self._cache[key] = check
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return self._check_cost(conn, query, {**check, "cached": False})
+    
+    def _check_cost(self, conn: sqlite3.Connection, query: str, check: Dict[str, Any]) -> Dict[str, Any]:
+        #done after the cache since the row counts behind it move with the data
+        if self.cost_guard is None or not check["is_valid"]:
+            return check
+        cost = self.cost_guard.evaluate(check["plan"], query, conn)
+        check["cost"] = cost
+        if cost["verdict"] == "refine":
+            check["is_valid"] = False
+            check["error"] = self.cost_guard.error(cost)
+        elif cost["verdict"] == "warn":
+            logger.warning(f"Query may be slow: estimated {cost['cost']:.0f} row visits")
+        return check
+    
+    def _run_checks(self, conn: sqlite3.Connection, query: str) -> Dict[str, Any]:
+        #imported here so processes that never validate dont pay for sqlparse, cached results skip this too
+        import sqlparse
+        from sqlparse.tokens import Keyword
+        
+        #make there is a query
+        try:
+            statements = [stmt for stmt in sqlparse.parse(query) if str(stmt).strip()]
+        except Exception as e:
+            return {
+                "is_valid": False,
+                "error": f"Query validation failed: {str(e)}"
+            }
+        if not statements:
+            return {
+                "is_valid": False,
+                "error": "Empty or invalid SQL query"
+            }
+        
+        #one walk over the tokens of every statement, "SELECT 1; DROP ..." included
+        for stmt in statements:
+            for token in stmt.flatten():
+                if token.ttype in Keyword and token.normalized in DANGEROUS_KEYWORDS:
                     return {
                         "is_valid": False,
-                        "error": f"LLM tried to use {keyword} "
+                        "error": f"LLM tried to use {token.normalized} "
                     }
-           #try executing the query 
-            try:
-                with sqlite3.connect(self.database_path) as conn:
-                    conn.execute(f"EXPLAIN QUERY PLAN {query}")
-                                    #this is amazing sqlite 
-                return {
-                    "is_valid": True,
-                    "error": None,
-                    "parsed_query": str(parsed[0])
-                }
-                
-            except sqlite3.Error as e:
+        
+        #try executing the query 
+        state = None
+        try:
+            with self.budget.guard(conn) as state:
+                rows = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+                            #this is amazing sqlite 
+        except sqlite3.Error as e:
+            if state is not None and state.exceeded:
                 return {
                     "is_valid": False,
-                    "error": f"SQL error: {str(e)}"
+                    "error": state.error(),
+                    "budget_exceeded": state.exceeded
                 }
-                
-        except Exception as e:
             return {
                 "is_valid": False,
-                "error": f"Query validation failed: {str(e)}"
+                "error": f"SQL error: {str(e)}"
+            }
+        
+        return {
+            "is_valid": True,
+            "error": None,
+            "parsed_query": str(statements[0]),
+            "statement": statements[0],
+            "statement_type": statements[0].get_type(),
+            "plan": [{"id": row[0], "parent": row[1], "detail": row[3]} for row in rows]
+        }
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._cache),
             }
     
-    def execute_query(self, query: str, limit: int = 100) -> Dict[str, Any]:
-        check = self.validate_query(query)
-        if not check["is_valid"]:
-            return {"success": False, "error": check["error"], "results": []}
+    def execute_query(self, query: str, limit: int = 100, as_dicts: bool = False, batch_size: int = 500) -> Dict[str, Any]:
+        #same canonical select on unchanged data, answered without touching the pool
+        cache_key = version = None
+        if self.result_cache is not None:
+            cache_key = self.result_cache.key(query, limit)
+            if cache_key is not None:
+                entry, version = self.result_cache.lookup(cache_key)
+                if entry is not None:
+                    results = ColumnarResult(entry["column_names"], list(entry["rows"]))
+                    return {
+                        "success": True,
+                        "results": results.to_dicts() if as_dicts else results,
+                        "column_names": entry["column_names"],
+                        "row_count": len(results),
+                        "truncated": entry["truncated"],
+                        "query_executed": self._add_limit_if_needed(query, limit),
+                        "query_plan": entry["query_plan"],
+                        "result_cache_hit": True
+                    }
         
+        state = None
         try:
-            with sqlite3.connect(self.database_path) as conn:
-                conn.row_factory = sqlite3.Row
+            with self.pool.connection() as conn:
+                #usually already validated by the caller, so this is a cache hit on the same connection
+                check = self._check(conn, query)
+                if not check["is_valid"]:
+                    return {"success": False, "error": check["error"], "results": [],
+                            "budget_exceeded": check.get("budget_exceeded")}
+                
                 final_q = self._add_limit_if_needed(query, limit)
                 
-                cursor = conn.execute(final_q)
-                rows = cursor.fetchall()
+                #limit only caps what we appended ourselves, a LIMIT the sql already has is respected up to the budget
+                caps = [cap for cap in (limit if final_q != query else None, self.budget.max_rows) if cap]
+                max_rows = min(caps) if caps else None
+                truncated = False
                 
-                results = [dict(row) for row in rows]
+                with self.budget.guard(conn) as state:
+                    cursor = conn.execute(final_q)
+                    column_names = [description[0] for description in cursor.description] if cursor.description else []
+                    results = ColumnarResult(column_names)
+                    while True:
+                        size = batch_size if max_rows is None else min(batch_size, max_rows - len(results))
+                        rows = cursor.fetchmany(size) if size > 0 else []
+                        if not rows:
+                            truncated = size <= 0 and cursor.fetchone() is not None
+                            break
+                        results.extend(rows)
+                    cursor.close()
                 
-                column_names = [description[0] for description in cursor.description] if cursor.description else []
+                if cache_key is not None:
+                    self.result_cache.put(cache_key, {"column_names": column_names, "rows": list(results.rows),
+                                                      "truncated": truncated, "query_plan": check["plan"]}, version)
                 
                 return {
                     "success": True,
-                    "results": results,
+                    "results": results.to_dicts() if as_dicts else results,
                     "column_names": column_names,
                     "row_count": len(results),
-                    "query_executed": final_q
+                    "truncated": truncated,
+                    "query_executed": final_q,
+                    "query_plan": check["plan"],
+                    "result_cache_hit": False
                 }
                 
         except sqlite3.Error as e:
-            print(f"Query execution failed: {e}")
+            if state is not None and state.exceeded:
+                logger.warning(f"Query cancelled: {state.exceeded}")
+                return {
+                    "success": False,
+                    "error": state.error(),
+                    "budget_exceeded": state.exceeded,
+                    "results": []
+                }
+            logger.warning(f"Query execution failed: {e}")
             return {
                 "success": False,
                 "error": f"Execution error: {str(e)}",
                 "results": []
             }
     
+    def iter_batches(self, query: str, batch_size: int = 1000, limit: Optional[int] = None) -> Iterator[ColumnarResult]:
+        #holds one pooled connection until the generator is exhausted or closed
+        with self.pool.connection() as conn:
+            check = self._check(conn, query)
+            if not check["is_valid"]:
+                raise sqlite3.OperationalError(check["error"])
+            
+            final_q = self._add_limit_if_needed(query, limit) if limit else query
+            #time and step budgets apply, the row cap doesnt since nothing is held in memory
+            with self.budget.guard(conn) as state:
+                try:
+                    cursor = conn.execute(final_q)
+                    column_names = [description[0] for description in cursor.description] if cursor.description else []
+                    
+                    sent = False
+                    while True:
+                        rows = cursor.fetchmany(batch_size)
+                        if not rows:
+                            break
+                        sent = True
+                        yield ColumnarResult(column_names, rows)
+                    if not sent:
+                        yield ColumnarResult(column_names)  #so exports still get a header
+                except sqlite3.Error:
+                    if state.exceeded:
+                        raise sqlite3.OperationalError(state.error())
+                    raise
+    
+    def export_query(self, query: str, path: str, fmt: str = "csv", batch_size: int = 1000, limit: Optional[int] = None) -> Dict[str, Any]:
+        writers = {"csv": write_csv, "jsonl": write_jsonl}
+        if fmt not in writers:
+            raise ValueError(f"Unknown export format: {fmt}")
+        try:
+            count = writers[fmt](self.iter_batches(query, batch_size=batch_size, limit=limit), path)
+        except sqlite3.Error as e:
+            logger.warning(f"Query export failed: {e}")
+            return {"success": False, "error": f"Execution error: {str(e)}", "row_count": 0}
+        return {"success": True, "path": path, "format": fmt, "row_count": count}
+    
     def _add_limit_if_needed(self, sql_query: str, limit: int) -> str:
         sql_upper = sql_query.upper().strip()
        #so we dont nuke the terminal with a bad result 
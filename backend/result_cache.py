@@ -0,0 +1,248 @@
+import logging
+import os
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from .connection_pool import SQLiteConnectionPool
+
+
+logger = logging.getLogger(__name__)
+
+#raw sql text -> cache key, so repeated dashboard queries dont get parsed every time
+KEY_MEMO_SIZE = 1024
+_MISSING = object()
+
+
+def _leaves(token) -> List[Any]:
+    return [leaf for leaf in token.flatten() if not leaf.is_whitespace]
+
+
+def _table_aliases(stmt) -> Tuple[Dict[str, str], set, set]:
+    #aliases defined after FROM/JOIN anywhere in the statement, subqueries included, numbered by first appearance
+    aliases: Dict[str, str] = {}
+    definitions, dropped_as = set(), set()
+
+    def visit(group):
+        tokens = [t for t in group.tokens if not t.is_whitespace]
+        for pos, token in enumerate(tokens):
+            keyword = token.is_keyword and (token.normalized == "FROM" or token.normalized.endswith("JOIN"))
+            if keyword and pos + 1 < len(tokens):
+                target = tokens[pos + 1]
+                refs = [t for t in target.get_identifiers()] if hasattr(target, "get_identifiers") else [target]
+                for ref in refs:
+                    alias = ref.get_alias() if hasattr(ref, "get_alias") else None
+                    leaves = _leaves(ref) if ref.is_group else []
+                    if not alias or not leaves or leaves[-1].value.strip('"`[]') != alias:
+                        continue
+                    aliases.setdefault(alias.lower(), f"_t{len(aliases) + 1}")
+                    definitions.add(id(leaves[-1]))
+                    if len(leaves) > 1 and leaves[-2].normalized == "AS":
+                        dropped_as.add(id(leaves[-2]))
+            if token.is_group:
+                visit(token)
+
+    visit(stmt)
+    return aliases, definitions, dropped_as
+
+
+def _output_names(stmt) -> Tuple[str, ...]:
+    #sqlite names an expression by its text exactly as written, and depending on version and pragmas an
+    #unqualified column too, so those keep their spelling. only qualified t.col refs get the declared name
+    from sqlparse import tokens as T
+    from sqlparse.sql import Identifier, IdentifierList
+
+    tokens = [t for t in stmt.tokens if not t.is_whitespace and t.ttype not in T.Comment]
+    select = next((i for i, t in enumerate(tokens) if t.ttype in T.DML), None)
+    if select is None:
+        return ()
+    items = []
+    for token in tokens[select + 1:]:
+        if token.is_keyword and token.normalized in ("DISTINCT", "ALL"):
+            continue
+        items = list(token.get_identifiers()) if isinstance(token, IdentifierList) else [token]
+        break
+
+    names = []
+    for item in items:
+        leaves = _leaves(item)
+        alias = item.get_alias() if isinstance(item, Identifier) else None
+        plain = all(leaf.ttype in T.Name or leaf.ttype in T.String.Symbol or leaf.value == "." for leaf in leaves)
+        if alias and not plain:
+            names.append("as:" + alias)
+        elif plain and len(leaves) == 1:
+            names.append("col:" + leaves[0].value)
+        elif plain and leaves and len(leaves) <= 3:
+            names.append("col:" + leaves[-1].value.strip('"`[]').lower())
+        else:
+            names.append("expr:" + str(item))
+    return tuple(names)
+
+
+def canonical_sql(query: str) -> Optional[Tuple[str, Tuple[str, ...]]]:
+    #keywords upper cased, bare identifiers lower cased (sqlite ignores their case), whitespace and comments dropped
+    #and table aliases renamed in order of appearance, string literals and quoted names are left exactly as they are.
+    #None for anything that isnt a single SELECT
+    import sqlparse
+    from sqlparse import tokens as T
+
+    statements = [stmt for stmt in sqlparse.parse(query) if str(stmt).strip()]
+    if len(statements) != 1 or statements[0].get_type() != "SELECT":
+        return None
+    stmt = statements[0]
+    aliases, definitions, dropped_as = _table_aliases(stmt)
+
+    leaves = [leaf for leaf in stmt.flatten() if not leaf.is_whitespace and leaf.ttype not in T.Comment]
+    while leaves and leaves[-1].value == ";":
+        leaves.pop()
+    parts = []
+    for pos, leaf in enumerate(leaves):
+        if id(leaf) in dropped_as:
+            continue
+        value = leaf.value
+        qualifier = pos + 1 < len(leaves) and leaves[pos + 1].value == "."
+        name = value.strip('"`[]').lower()
+        if name in aliases and (id(leaf) in definitions or (qualifier and (leaf.ttype in T.Name or leaf.ttype in T.String.Symbol))):
+            parts.append(aliases[name])
+        elif leaf.is_keyword:
+            parts.append(leaf.normalized.upper())
+        elif leaf.ttype in T.Name:
+            parts.append(value.lower())
+        else:
+            parts.append(value)
+    return " ".join(parts), _output_names(stmt)
+
+
+def _estimate_bytes(rows: List[Tuple]) -> int:
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+    return size
+
+
+class ResultCache:
+    def __init__(self,
+                 database_path: str,
+                 pool: Optional[SQLiteConnectionPool] = None,
+                 max_bytes: int = 32 * 1024 * 1024,
+                 max_entry_bytes: Optional[int] = None):  #bigger results are not kept, defaults to an eighth of max_bytes
+        self.database_path = database_path
+        self.pool = pool or SQLiteConnectionPool(database_path)
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 8
+
+        self._entries: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._keys: "OrderedDict[str, Optional[tuple]]" = OrderedDict()
+        self._bytes = 0
+        self._token: Optional[tuple] = None
+        self._watch: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.uncacheable = 0
+
+    def key(self, query: str, limit: int) -> Optional[tuple]:
+        with self._lock:
+            canonical = self._keys.get(query, _MISSING)
+            if canonical is not _MISSING:
+                self._keys.move_to_end(query)
+        if canonical is _MISSING:
+            canonical = None
+            try:
+                canonical = canonical_sql(query)
+            except Exception as e:
+                logger.debug(f"Could not canonicalize query for the result cache: {e}")
+            with self._lock:
+                self._keys[query] = canonical
+                while len(self._keys) > KEY_MEMO_SIZE:
+                    self._keys.popitem(last=False)
+        if canonical is None:
+            with self._lock:
+                self.uncacheable += 1
+            return None
+        return canonical + (limit,)
+
+    def lookup(self, key: tuple) -> Tuple[Optional[Dict[str, Any]], Optional[tuple]]:
+        #the version comes back with the entry so a miss can be stored against the data it actually read
+        with self._lock:
+            version = self._check_version()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, version
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry, version
+
+    def put(self, key: tuple, entry: Dict[str, Any], version: Optional[tuple]):
+        size = _estimate_bytes(entry["rows"])
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            #the data moved while the query ran, that result may already be stale
+            if version is None or version != self._check_version():
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old["size"]
+            self._entries[key] = {**entry, "size": size}
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted["size"]
+                self.evictions += 1
+
+    def _check_version(self) -> Optional[tuple]:
+        #data_version only moves for commits from other connections, and it is per connection,
+        #so one dedicated connection watches it. the file stats catch a database swapped out underneath
+        try:
+            if self._watch is None:
+                self._watch = self.pool.open_dedicated()
+            data_version = self._watch.execute("PRAGMA data_version").fetchone()[0]
+            st = os.stat(self.database_path)
+            token = (data_version, st.st_ino, st.st_size, st.st_mtime_ns, self._wal_stat())
+        except (sqlite3.Error, OSError) as e:
+            logger.warning(f"Result cache disabled for this lookup: {e}")
+            token = None
+        if token != self._token:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+            self._token = token
+        return token
+
+    def _wal_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(f"{self.database_path}-wal")
+        except OSError:
+            return None
+        return (st.st_size, st.st_mtime_ns)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "uncacheable": self.uncacheable,
+            }
+
+    def close(self):
+        with self._lock:
+            if self._watch is not None:
+                self._watch.close()
+                self._watch = None
+            self._entries.clear()
+            self._bytes = 0
@@ -0,0 +1,83 @@
+import csv
+import hashlib
+import json
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+
+
+class ColumnarResult:
+    #column names once, rows as plain tuples straight from the cursor
+    def __init__(self, column_names: List[str], rows: Optional[List[Tuple]] = None):
+        self.column_names = column_names
+        self.rows: List[Tuple] = rows if rows is not None else []
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[Tuple]:
+        return iter(self.rows)
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+    def extend(self, rows: List[Tuple]):
+        self.rows.extend(rows)
+
+    def column(self, name: str) -> List[Any]:
+        pos = self.column_names.index(name)
+        return [row[pos] for row in self.rows]
+
+    def columns(self) -> Dict[str, List[Any]]:
+        return {name: list(values) for name, values in zip(self.column_names, zip(*self.rows))} if self.rows \
+            else {name: [] for name in self.column_names}
+
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        return [dict(zip(self.column_names, row)) for row in self.rows]
+
+    def to_numpy(self) -> Dict[str, Any]:
+        #numeric columns become arrays, anything with text or NULLs stays a list
+        import numpy as np
+
+        arrays = {}
+        for name, values in self.columns().items():
+            if values and all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+                arrays[name] = np.asarray(values, dtype=np.int64 if all(isinstance(v, int) for v in values) else np.float64)
+            else:
+                arrays[name] = values
+        return arrays
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"column_names": self.column_names, "rows": [list(row) for row in self.rows]}
+
+
+def result_fingerprint(rows) -> str:
+    #row order and column names ignored, two queries agree if they return the same rows
+    if isinstance(rows, ColumnarResult):
+        rows = rows.rows
+    values = sorted(repr(tuple(row.values()) if isinstance(row, dict) else tuple(row)) for row in rows)
+    return hashlib.sha256("\n".join(values).encode("utf-8")).hexdigest()[:16]
+
+
+def write_csv(batches: Iterable[ColumnarResult], path: str) -> int:
+    #one batch in memory at a time no matter how big the result is
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        header_written = False
+        for batch in batches:
+            if not header_written:
+                writer.writerow(batch.column_names)
+                header_written = True
+            writer.writerows(batch.rows)
+            count += len(batch)
+    return count
+
+
+def write_jsonl(batches: Iterable[ColumnarResult], path: str) -> int:
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for batch in batches:
+            for row in batch.rows:
+                f.write(json.dumps(dict(zip(batch.column_names, row)), default=str))
+                f.write("\n")
+            count += len(batch)
+    return count
@@ -0,0 +1,70 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from typing import Dict, Any, Optional
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MACSQLSC"
+FORMAT_VERSION = 1
+
+#magic, format version, length of the json header that follows
+_PREAMBLE = struct.Struct("<8sII")
+
+
+def file_identity(database_path: str) -> Optional[Dict[str, int]]:
+    #device + inode survive renames but not a different file dropped in at the same path
+    try:
+        st = os.stat(database_path)
+    except OSError:
+        return None
+    return {"dev": st.st_dev, "ino": st.st_ino}
+
+
+def write_artifact(path: str, identity: Dict[str, int], schema_version: int, sections: Dict[str, Any]):
+    #sections sit after the header, a reader that rejects the header never touches them
+    blobs = {name: json.dumps(value, separators=(",", ":")).encode("utf-8") for name, value in sections.items()}
+    offsets, position = {}, 0
+    for name, blob in blobs.items():
+        offsets[name] = [position, len(blob)]
+        position += len(blob)
+    header = json.dumps({
+        "identity": identity,
+        "schema_version": schema_version,
+        "written": time.time(),
+        "sections": offsets,
+    }, separators=(",", ":")).encode("utf-8")
+
+    #write then rename, several engines or processes may export the same database at once
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)))
+        f.write(header)
+        for blob in blobs.values():
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def read_artifact(path: str, identity: Dict[str, int]) -> Optional[Dict[str, Any]]:
+    #only the header is decoded before the identity check, a stale artifact costs one small read
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, version, header_len = _PREAMBLE.unpack_from(mapped, 0)
+            if magic != MAGIC or version != FORMAT_VERSION:
+                return None
+            body = _PREAMBLE.size + header_len
+            header = json.loads(mapped[_PREAMBLE.size:body])
+            if header["identity"] != identity:
+                return None
+            sections = {name: json.loads(mapped[body + start:body + start + length])
+                        for name, (start, length) in header["sections"].items()}
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, struct.error) as e:
+        logger.warning(f"Ignoring unreadable schema artifact {path}: {e}")
+        return None
+    return {"schema_version": header["schema_version"], "sections": sections}
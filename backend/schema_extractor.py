@@ -1,86 +1,310 @@
+import hashlib
+import logging
 import sqlite3
-from typing import List, Dict, Any
+import threading
+from typing import List, Dict, Any, Optional
+
+from .connection_pool import SQLiteConnectionPool
+from .schema_artifact import file_identity, read_artifact, write_artifact
+
+
+logger = logging.getLogger(__name__)
+
+
+class SchemaCatalog:
+    def __init__(self):
+        self.schema_version: Optional[int] = None
+        self.tables: Dict[str, Dict[str, Any]] = {}
+        self.table_sql: Dict[str, str] = {}
+        self.table_text: Dict[str, str] = {}
+        self._schema_text: Optional[str] = None
+        self._column_list: Optional[str] = None
+        self._fingerprint: Optional[str] = None
+        #indexes built on top of this exact schema, dropped along with it when the schema changes
+        self.derived: Dict[str, Any] = {}
+
+    def copy(self) -> "SchemaCatalog":
+        catalog = SchemaCatalog()
+        catalog.schema_version = self.schema_version
+        catalog.tables = dict(self.tables)
+        catalog.table_sql = dict(self.table_sql)
+        catalog.table_text = dict(self.table_text)
+        return catalog
+
+    def to_state(self) -> Dict[str, Any]:
+        #everything the agents read, rendered text included, plus derived indexes that know how to save themselves
+        #columns and fks as plain rows instead of dicts, decodes about twice as fast
+        tables = []
+        for name, table_schema in self.tables.items():
+            columns = [[col["name"], col["type"], col["not_null"], col["primary_key"]] for col in table_schema["columns"]]
+            fks = [[fk["column"], fk["references_table"], fk["references_column"]] for fk in table_schema["foreign_keys"]]
+            tables.append([name, self.table_sql[name], columns, fks, self.table_text[name]])
+        state = {
+            "tables": tables,
+            "text": {"schema_text": self.schema_text(), "column_list": self.column_list(),
+                     "fingerprint": self.fingerprint()},
+        }
+        index = self.derived.get("schema_index")
+        if index is not None:
+            state["schema_index"] = index.to_state()
+        return state
+
+    @classmethod
+    def from_state(cls, schema_version: int, state: Dict[str, Any]) -> "SchemaCatalog":
+        catalog = cls()
+        catalog.schema_version = schema_version
+        for name, sql, columns, fks, text in state["tables"]:
+            catalog.tables[name] = {
+                "table_name": name,
+                "columns": [{"name": c[0], "type": c[1], "not_null": c[2], "primary_key": c[3]} for c in columns],
+                "foreign_keys": [{"column": f[0], "references_table": f[1], "references_column": f[2]} for f in fks],
+            }
+            catalog.table_sql[name] = sql
+            catalog.table_text[name] = text
+        catalog._schema_text = state["text"]["schema_text"]
+        catalog._column_list = state["text"]["column_list"]
+        catalog._fingerprint = state["text"]["fingerprint"]
+        if "schema_index" in state:
+            from .schema_index import SchemaIndex
+
+            catalog.derived["schema_index"] = SchemaIndex.from_state(state["schema_index"])
+        return catalog
+
+    def table_names(self) -> List[str]:
+        return list(self.tables.keys())
+
+    def set_table(self, table_name: str, sql: str, table_schema: Dict[str, Any]):
+        self.tables[table_name] = table_schema
+        self.table_sql[table_name] = sql
+        self.table_text[table_name] = self._render_table(table_schema)
+        self._schema_text = None
+        self._column_list = None
+        self._fingerprint = None
+
+    def drop_table(self, table_name: str):
+        self.tables.pop(table_name, None)
+        self.table_sql.pop(table_name, None)
+        self.table_text.pop(table_name, None)
+        self._schema_text = None
+        self._column_list = None
+        self._fingerprint = None
+
+    def reorder(self, table_names: List[str]):
+        #keep sqlite_master order so the prompt text doesnt shuffle between rebuilds
+        self.tables = {name: self.tables[name] for name in table_names if name in self.tables}
+        self._schema_text = None
+
+    def schema_text(self) -> str:
+        if self._schema_text is None:
+            self._schema_text = "\n".join(self.table_text[name] for name in self.tables)
+        return self._schema_text
+
+    def column_list(self) -> str:
+        if self._column_list is None:
+            column_list = []
+            for table_name, table_schema in self.tables.items():
+                for col in table_schema["columns"]:
+                    column_list.append(f"{table_name}.{col['name']}")
+            self._column_list = "\n".join(sorted(column_list))
+        return self._column_list
+
+    def column_list_for(self, table_names: List[str]) -> str:
+        column_list = []
+        for table_name in table_names:
+            for col in self.tables.get(table_name, {}).get("columns", []):
+                column_list.append(f"{table_name}.{col['name']}")
+        return "\n".join(sorted(column_list))
+
+    def fingerprint(self) -> str:
+        #unlike schema_version this ignores index churn and only moves when
+        #tables, columns or fks the agents see actually change
+        if self._fingerprint is None:
+            text = "\n".join(self.table_text[name] for name in sorted(self.tables))
+            self._fingerprint = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return self._fingerprint
+
+    def _render_table(self, table_schema: Dict[str, Any]) -> str:
+        table_part = f"Table: {table_schema['table_name']}\n"
+        table_part += "Columns:\n"
+
+        for col in table_schema["columns"]:
+            col_desc = f"  - {col['name']} ({col['type']}"
+            if col['primary_key']:
+                col_desc += ", PRIMARY KEY"
+            if col['not_null']:
+                col_desc += ", NOT NULL"
+            col_desc += ")\n"
+            table_part += col_desc
+
+        if table_schema["foreign_keys"]:
+            table_part += "Foreign Keys:\n"
+            for fk in table_schema["foreign_keys"]:
+                table_part += f"  - {fk['column']} -> {fk['references_table']}.{fk['references_column']}\n"
+
+        return table_part
 
 
 class SchemaExtractor:
-    def __init__(self, database_path: str):
+    def __init__(self,
+                 database_path: str,
+                 pool: Optional[SQLiteConnectionPool] = None,
+                 artifact_path: Optional[str] = None):  #e.g. f"{database_path}.schema", loaded on first use and rewritten on schema changes
         self.database_path = database_path
-    
+        self.pool = pool or SQLiteConnectionPool(database_path)
+        self.artifact_path = artifact_path
+        self.catalog = SchemaCatalog()
+        self._catalog_lock = threading.Lock()
+
+    def get_catalog(self) -> SchemaCatalog:
+        with self.pool.connection() as conn:
+            version = conn.execute("PRAGMA schema_version").fetchone()[0]
+            if version == self.catalog.schema_version:
+                return self.catalog
+
+            with self._catalog_lock:
+                #another thread may have refreshed while we waited
+                if version != self.catalog.schema_version:
+                    if self.artifact_path and self.catalog.schema_version is None:
+                        current = self._import_artifact(conn, version)
+                    else:
+                        self._refresh_catalog(conn, version)
+                        current = False
+                    if self.artifact_path and not current:
+                        self.export_artifact(catalog=self.catalog)
+
+        return self.catalog
+
+    def export_artifact(self, path: Optional[str] = None, catalog: Optional[SchemaCatalog] = None) -> Optional[str]:
+        #tables, columns, fks, the rendered prompt text and derived indexes, keyed to this file and schema_version
+        path = path or self.artifact_path or f"{self.database_path}.schema"
+        catalog = catalog or self.get_catalog()
+        identity = file_identity(self.database_path)
+        if identity is None:
+            return None
+        try:
+            write_artifact(path, identity, catalog.schema_version, catalog.to_state())
+        except OSError as e:
+            logger.warning(f"Could not save schema artifact to {path}: {e}")
+            return None
+        return path
+
+    def import_artifact(self, path: Optional[str] = None) -> bool:
+        #True when the artifact matched, otherwise the catalog was brought up to date from the database
+        with self.pool.connection() as conn:
+            version = conn.execute("PRAGMA schema_version").fetchone()[0]
+            with self._catalog_lock:
+                return self._import_artifact(conn, version, path)
+
+    def _import_artifact(self, conn: sqlite3.Connection, version: int, path: Optional[str] = None) -> bool:
+        path = path or self.artifact_path or f"{self.database_path}.schema"
+        identity = file_identity(self.database_path)
+        artifact = read_artifact(path, identity) if identity is not None else None
+        catalog = None
+        if artifact is not None:
+            try:
+                catalog = SchemaCatalog.from_state(artifact["schema_version"], artifact["sections"])
+            except (KeyError, ValueError, TypeError, IndexError) as e:
+                logger.warning(f"Ignoring malformed schema artifact {path}: {e}")
+        if catalog is None:
+            self._refresh_catalog(conn, version)
+            return False
+
+        #a single sqlite_master read backs up schema_version, copies of a database can share the counter
+        master = self._read_master(conn)
+        if artifact["schema_version"] == version and master == list(catalog.table_sql.items()):
+            self.catalog = catalog
+            logger.info(f"Loaded schema artifact {path} ({len(catalog.tables)} tables)")
+            return True
+
+        #stale, seed from it so only the tables that changed since get re-read
+        self.catalog = catalog
+        self._refresh_catalog(conn, version, master)
+        logger.info(f"Schema artifact {path} was stale, refreshed from the database")
+        return False
+
+    def _read_master(self, conn: sqlite3.Connection) -> List[tuple]:
+        cursor = conn.execute(
+            "SELECT name, sql FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
+        )
+        return [(row[0], row[1] or "") for row in cursor.fetchall()]
+
+    def _refresh_catalog(self, conn: sqlite3.Connection, version: int, master: Optional[List[tuple]] = None):
+        #build on a copy and swap it in so readers never see a half-built catalog
+        catalog = self.catalog.copy()
+        if master is None:
+            master = self._read_master(conn)
+        current = {name: sql for name, sql in master}
+
+        for table_name in list(catalog.tables.keys()):
+            if table_name not in current:
+                catalog.drop_table(table_name)
+
+        #only re-read tables whose CREATE statement is new or changed
+        changed = [name for name, sql in master if catalog.table_sql.get(name) != sql]
+        if changed:
+            for table_name, table_schema in self._load_tables(conn, changed).items():
+                catalog.set_table(table_name, current[table_name], table_schema)
+
+        catalog.reorder([name for name, _ in master])
+        catalog.schema_version = version
+        self.catalog = catalog
+
+    def _load_tables(self, conn: sqlite3.Connection, table_names: List[str]) -> Dict[str, Dict[str, Any]]:
+        tables = {
+            name: {"table_name": name, "columns": [], "foreign_keys": []}
+            for name in table_names
+        }
+        placeholders = ",".join("?" for _ in table_names)
+
+        cursor = conn.execute(
+            f"""SELECT m.name, p.name, p.type, p."notnull", p.pk
+                FROM sqlite_master m JOIN pragma_table_info(m.name) p
+                WHERE m.type='table' AND m.name IN ({placeholders})
+                ORDER BY m.name, p.cid""",
+            table_names
+        )
+        for row in cursor.fetchall():
+            tables[row[0]]["columns"].append({
+                "name": row[1],
+                "type": row[2],
+                "not_null": bool(row[3]),
+                "primary_key": bool(row[4])
+            })
+
+        cursor = conn.execute(
+            f"""SELECT m.name, f."from", f."table", f."to"
+                FROM sqlite_master m JOIN pragma_foreign_key_list(m.name) f
+                WHERE m.type='table' AND m.name IN ({placeholders})
+                ORDER BY m.name, f.id, f.seq""",
+            table_names
+        )
+        for row in cursor.fetchall():
+            tables[row[0]]["foreign_keys"].append({
+                "column": row[1],
+                "references_table": row[2],
+                "references_column": row[3]
+            })
+
+        return tables
+
     def get_tables(self) -> List[str]:
-        with sqlite3.connect(self.database_path) as conn:
-            cursor = conn.execute(
-                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"
-            )
-            return [row[0] for row in cursor.fetchall()]
-    
+        return self.get_catalog().table_names()
+
     def get_table_schema(self, table_name: str) -> Dict[str, Any]:
-        with sqlite3.connect(self.database_path) as conn:
-            cursor = conn.execute(f"PRAGMA table_info({table_name})")
-            columns = []
-            for row in cursor.fetchall():
-                columns.append({
-                    "name": row[1],
-                    "type": row[2],
-                    "not_null": bool(row[3]),
-                    "primary_key": bool(row[5])
-                })
-            
-            cursor = conn.execute(f"PRAGMA foreign_key_list({table_name})")
-            foreign_keys = []
-            for row in cursor.fetchall():
-                foreign_keys.append({
-                    "column": row[3],
-                    "references_table": row[2],
-                    "references_column": row[4]
-                })
-            
-            return {
-                "table_name": table_name,
-                "columns": columns,
-                "foreign_keys": foreign_keys
-            }
-    
+        catalog = self.get_catalog()
+        if table_name not in catalog.tables:
+            return {"table_name": table_name, "columns": [], "foreign_keys": []}
+        return catalog.tables[table_name]
+
     def get_schema_text(self) -> str:
-        tables = self.get_tables()
-        schema_parts = []
-        
-        for table_name in tables:
-            table_schema = self.get_table_schema(table_name)
-            
-            table_part = f"Table: {table_name}\n"
-            table_part += "Columns:\n"
-            
-            for col in table_schema["columns"]:
-                col_desc = f"  - {col['name']} ({col['type']}"
-                if col['primary_key']:
-                    col_desc += ", PRIMARY KEY"
-                if col['not_null']:
-                    col_desc += ", NOT NULL"
-                col_desc += ")\n"
-                table_part += col_desc
-            
-            if table_schema["foreign_keys"]:
-                table_part += "Foreign Keys:\n"
-                for fk in table_schema["foreign_keys"]:
-                    table_part += f"  - {fk['column']} -> {fk['references_table']}.{fk['references_column']}\n"
-            
-            schema_parts.append(table_part)
-        
-        return "\n".join(schema_parts)
-    
+        return self.get_catalog().schema_text()
+
     def get_column_list(self) -> str:
-        tables = self.get_tables()
-        column_list = []
-        
-        for table_name in tables:
-            table_schema = self.get_table_schema(table_name)
-            for col in table_schema["columns"]:
-                column_list.append(f"{table_name}.{col['name']}")
-        
-        return "\n".join(sorted(column_list))
-    
+        return self.get_catalog().column_list()
+
     def get_sample_data(self, table_name: str, limit: int = 3) -> List[Dict[str, Any]]:
-        with sqlite3.connect(self.database_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.execute(f"SELECT * FROM {table_name} LIMIT {limit}")
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute(f"SELECT * FROM {table_name} LIMIT {limit}")
             return [dict(row) for row in cursor.fetchall()]
@@ -0,0 +1,133 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import List, Dict, Set, Tuple, Any
+
+from .schema_extractor import SchemaCatalog
+
+
+_CAMEL = re.compile(r"([a-z0-9])([A-Z])")
+_WORDS = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "by", "did", "do", "does", "for", "from",
+    "has", "have", "how", "in", "is", "it", "its", "list", "me", "many", "most", "of",
+    "on", "or", "show", "the", "their", "them", "there", "to", "top", "was", "were",
+    "what", "when", "where", "which", "who", "whose", "with", "give", "find", "all",
+}
+
+#how much a hit counts depending on where the token came from
+TABLE_WEIGHT = 3.0
+COLUMN_WEIGHT = 1.0
+NEIGHBOR_WEIGHT = 0.5
+
+
+def _stem(word: str) -> str:
+    #just enough to match "customers" to customer_id and "categories" to category
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def tokenize_identifier(name: str) -> List[str]:
+    #snake_case and camelCase both end up as separate lowercase words
+    spaced = _CAMEL.sub(r"\1 \2", name)
+    return [_stem(w) for w in _WORDS.findall(spaced.lower())]
+
+
+def tokenize_question(question: str) -> List[str]:
+    return [_stem(w) for w in _WORDS.findall(question.lower()) if w not in STOPWORDS]
+
+
+class SchemaIndex:
+    def __init__(self, catalog: SchemaCatalog, k1: float = 1.2, b: float = 0.75):
+        self.fingerprint = catalog.fingerprint()
+        self.k1 = k1
+        self.b = b
+
+        self.tables: List[str] = catalog.table_names()
+        self.neighbors: Dict[str, Set[str]] = defaultdict(set)
+        for table_name, table_schema in catalog.tables.items():
+            for fk in table_schema["foreign_keys"]:
+                other = fk["references_table"]
+                if other != table_name and other in catalog.tables:
+                    self.neighbors[table_name].add(other)
+                    self.neighbors[other].add(table_name)
+
+        #term -> [(table position, weighted tf)], kept as plain lists so it stays small
+        self.postings: Dict[str, List[Tuple[int, float]]] = defaultdict(list)
+        self.doc_len: List[float] = []
+
+        for pos, table_name in enumerate(self.tables):
+            weights: Counter = Counter()
+            for token in tokenize_identifier(table_name):
+                weights[token] += TABLE_WEIGHT
+            for col in catalog.tables[table_name]["columns"]:
+                for token in tokenize_identifier(col["name"]):
+                    weights[token] += COLUMN_WEIGHT
+            for other in self.neighbors.get(table_name, ()):
+                for token in tokenize_identifier(other):
+                    weights[token] += NEIGHBOR_WEIGHT
+
+            for token, tf in weights.items():
+                self.postings[token].append((pos, tf))
+            self.doc_len.append(sum(weights.values()))
+
+        self.postings = dict(self.postings)
+        self.neighbors = dict(self.neighbors)
+        self.avg_len = sum(self.doc_len) / len(self.doc_len) if self.doc_len else 0.0
+
+    def to_state(self) -> Dict[str, Any]:
+        return {
+            "fingerprint": self.fingerprint, "k1": self.k1, "b": self.b, "tables": self.tables,
+            "neighbors": {table: sorted(others) for table, others in self.neighbors.items()},
+            "postings": self.postings, "doc_len": self.doc_len, "avg_len": self.avg_len,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict[str, Any]) -> "SchemaIndex":
+        #restored from a schema artifact, skips tokenizing every table again
+        index = cls.__new__(cls)
+        index.__dict__.update(state)
+        index.neighbors = {table: set(others) for table, others in state["neighbors"].items()}
+        return index
+
+    def score(self, question: str) -> Dict[str, float]:
+        n = len(self.tables)
+        scores: Dict[int, float] = defaultdict(float)
+
+        for token in set(tokenize_question(question)):
+            postings = self.postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for pos, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[pos] / self.avg_len)
+                scores[pos] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        return {self.tables[pos]: value for pos, value in scores.items()}
+
+    def select_tables(self, question: str, top_k: int = 8, max_tables: int = 16) -> List[str]:
+        scores = self.score(question)
+        ranked = sorted(scores, key=lambda t: scores[t], reverse=True)[:top_k]
+
+        if not ranked:
+            #nothing matched lexically, hand over the best connected tables instead
+            ranked = sorted(self.tables, key=lambda t: len(self.neighbors.get(t, ())), reverse=True)[:top_k]
+
+        selected = list(ranked)
+        seen = set(selected)
+
+        #pull in join partners so the selector can still see the keys it needs
+        candidates = []
+        for table_name in ranked:
+            for other in self.neighbors.get(table_name, ()):
+                if other not in seen:
+                    seen.add(other)
+                    candidates.append(other)
+        candidates.sort(key=lambda t: scores.get(t, 0.0), reverse=True)
+        selected.extend(candidates[:max(0, max_tables - len(selected))])
+
+        return selected
@@ -0,0 +1,361 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional, Iterator, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+from .answer_cache import normalize_question
+from .llm_client import OllamaClient
+from .mac_sql import MACSQL
+from .ollama_transport import OllamaTransport
+from .result_set import ColumnarResult
+from .tracing import Tracer
+
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceBusy(Exception):
+    pass
+
+
+class EngineRegistry:
+    def __init__(self,
+                 db_root: str,  #only databases under this directory are served
+                 max_engines: int = 8,  #each engine holds a pool, catalogs, indexes and caches for one database
+                 ollama_url: str = "http://localhost:11434",
+                 tracer: Optional[Tracer] = None,
+                 engine_kwargs: Optional[Dict[str, Any]] = None):
+        self.db_root = os.path.realpath(db_root)
+        self.max_engines = max_engines
+        self.ollama_url = ollama_url
+        self.tracer = tracer or Tracer()
+        self.engine_kwargs = engine_kwargs or {}
+        #one keep-alive session to ollama no matter how many databases are open
+        self.transport = OllamaTransport(ollama_url)
+
+        self._engines: "OrderedDict[str, MACSQL]" = OrderedDict()
+        self._refs: Dict[int, int] = {}
+        self._retired: Dict[int, MACSQL] = {}  #evicted while a request was still using them
+        self._opening: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def resolve(self, database: str) -> str:
+        path = os.path.realpath(os.path.join(self.db_root, database))
+        if os.path.commonpath([path, self.db_root]) != self.db_root:
+            raise PermissionError(f"{database} is outside the served directory")
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"No database {database}")
+        return path
+
+    @contextmanager
+    def engine(self, path: str) -> Iterator[MACSQL]:
+        engine = self._acquire(path)
+        try:
+            yield engine
+        finally:
+            self._release(engine)
+
+    def _acquire(self, path: str) -> MACSQL:
+        while True:
+            with self._lock:
+                engine = self._engines.get(path)
+                if engine is not None:
+                    self._engines.move_to_end(path)
+                    self._refs[id(engine)] += 1
+                    return engine
+                opening = self._opening.get(path)
+                building = opening is None
+                if building:
+                    opening = self._opening[path] = Future()
+
+            if building:
+                self._build(path, opening)
+            #another request built it, loop to take a reference unless it was evicted in between
+            opening.result()
+
+    def _build(self, path: str, opening: Future):
+        #outside the lock, a slow open of one database should not stall the others
+        try:
+            engine = MACSQL(path, ollama_url=self.ollama_url, tracer=self.tracer,
+                            llm_transport=self.transport, **self.engine_kwargs)
+        except Exception as e:
+            with self._lock:
+                del self._opening[path]
+            opening.set_exception(e)
+            raise
+
+        evicted = []
+        with self._lock:
+            del self._opening[path]
+            self._engines[path] = engine
+            self._refs[id(engine)] = 0
+            self.loads += 1
+            while len(self._engines) > self.max_engines:
+                old_path, old = self._engines.popitem(last=False)
+                self.evictions += 1
+                logger.info(f"Evicting engine for {old_path}")
+                if self._refs[id(old)] == 0:
+                    del self._refs[id(old)]
+                    evicted.append(old)
+                else:
+                    self._retired[id(old)] = old
+        for old in evicted:
+            old.close()
+        opening.set_result(engine)
+
+    def _release(self, engine: MACSQL):
+        with self._lock:
+            self._refs[id(engine)] -= 1
+            if self._refs[id(engine)] or id(engine) not in self._retired:
+                return
+            del self._refs[id(engine)]
+            del self._retired[id(engine)]
+        engine.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "engines": list(self._engines),
+                "max_engines": self.max_engines,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "in_use": sum(1 for refs in self._refs.values() if refs),
+            }
+
+    def close(self):
+        with self._lock:
+            engines = list(self._engines.values()) + list(self._retired.values())
+            self._engines.clear()
+            self._retired.clear()
+            self._refs.clear()
+        for engine in engines:
+            engine.close()
+        self.transport.close()
+
+
+class QueryService:
+    def __init__(self,
+                 registry: EngineRegistry,
+                 workers: int = 4,  #pipelines running at once across all databases
+                 max_pending: int = 64,  #queued plus running, past this new questions get a 503
+                 request_timeout: float = 300.0):
+        self.registry = registry
+        self.metrics = registry.tracer.metrics
+        self.max_pending = max_pending
+        self.request_timeout = request_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="macsql-service")
+        self._inflight: Dict[Tuple[str, str], Future] = {}
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.workers = workers
+        self.llm_client = OllamaClient(base_url=registry.ollama_url, transport=registry.transport,
+                                       model=registry.engine_kwargs.get("model_name", "codellama:13b"))
+
+    def submit(self, database: str, question: str, profile: bool = False) -> Future:
+        path = self.registry.resolve(database)
+        #same question on the same database while one is running: wait for that run instead of starting another
+        key = (path, normalize_question(question))
+        with self._lock:
+            running = self._inflight.get(key)
+            if running is not None and not profile:
+                self.metrics.inc("macsql_service_coalesced_total")
+                return running
+            if self._pending >= self.max_pending:
+                self.metrics.inc("macsql_service_rejected_total")
+                raise ServiceBusy(f"{self._pending} questions already queued")
+            self._pending += 1
+            future = self._executor.submit(self._run, path, question, profile)
+            if not profile:
+                self._inflight[key] = future
+        future.add_done_callback(lambda done: self._finished(key, done))
+        return future
+
+    def query(self, database: str, question: str, profile: bool = False) -> Dict[str, Any]:
+        return self.submit(database, question, profile).result(timeout=self.request_timeout)
+
+    def _run(self, path: str, question: str, profile: bool) -> Dict[str, Any]:
+        with self.registry.engine(path) as engine:
+            return engine.query(question, profile=profile)
+
+    def _finished(self, key: Tuple[str, str], future: Future):
+        with self._lock:
+            self._pending -= 1
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def health(self, database: Optional[str] = None) -> Dict[str, Any]:
+        if database:
+            path = self.registry.resolve(database)
+            with self.registry.engine(path) as engine:
+                status = engine.test_connection()
+            healthy = status.get("llm_status") == "connected" and status.get("database_status") == "connected"
+        else:
+            try:
+                status = {"llm_status": "connected" if self.llm_client.is_available() else "model_not_found"}
+            except Exception as e:
+                status = {"llm_status": f"error: {e}"}
+            healthy = status["llm_status"] == "connected"
+        status["status"] = "ok" if healthy else "degraded"
+        status["service"] = self.stats()
+        return status
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = self._pending
+            inflight = len(self._inflight)
+        return {"pending": pending, "inflight": inflight, "workers": self.workers,
+                "max_pending": self.max_pending, "registry": self.registry.stats()}
+
+    def export_metrics(self, fmt: str = "prometheus"):
+        stats = self.stats()
+        self.metrics.set("macsql_service_pending", stats["pending"])
+        self.metrics.set("macsql_service_engines", len(stats["registry"]["engines"]))
+        self.metrics.set("macsql_registry_loads", stats["registry"]["loads"])
+        self.metrics.set("macsql_registry_evictions", stats["registry"]["evictions"])
+        if fmt == "json":
+            return self.metrics.to_json()
+        return self.metrics.to_prometheus()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.registry.close()
+
+
+def _to_json(value):
+    if isinstance(value, ColumnarResult):
+        return value.to_dict()
+    return str(value)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def make_server(service: QueryService, host: str = "127.0.0.1", port: int = 8080) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            logger.debug(fmt % args)
+
+        def _send(self, status: int, data: bytes, content_type: str, headers: Optional[Dict[str, str]] = None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+            self._send(status, json.dumps(body, default=_to_json).encode("utf-8"), "application/json", headers)
+
+        def _count(self, endpoint: str, status: int):
+            service.metrics.inc("macsql_service_requests_total", endpoint=endpoint, status=status)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            if url.path == "/health":
+                try:
+                    body = service.health(params.get("database"))
+                except (FileNotFoundError, PermissionError) as e:
+                    status = 403 if isinstance(e, PermissionError) else 404
+                    self._count("health", status)
+                    self._send_json(status, {"error": str(e)})
+                    return
+                status = 200 if body["status"] == "ok" else 503
+                self._count("health", status)
+                self._send_json(status, body)
+            elif url.path == "/metrics":
+                self._count("metrics", 200)
+                if params.get("format") == "json":
+                    self._send_json(200, service.export_metrics("json"))
+                else:
+                    self._send(200, service.export_metrics().encode("utf-8"), "text/plain; version=0.0.4")
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if urlsplit(self.path).path != "/query":
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            except ValueError:
+                payload = None
+            if not isinstance(payload, dict) or not payload.get("database") or not payload.get("question"):
+                self._count("query", 400)
+                self._send_json(400, {"error": "expected JSON with database and question"})
+                return
+
+            started = time.monotonic()
+            try:
+                future = service.submit(payload["database"], payload["question"], bool(payload.get("profile")))
+                result = future.result(timeout=service.request_timeout)
+            except (FileNotFoundError, PermissionError) as e:
+                status, result = 403 if isinstance(e, PermissionError) else 404, {"error": str(e)}
+            except ServiceBusy as e:
+                self._count("query", 503)
+                self._send_json(503, {"error": str(e)}, {"Retry-After": "5"})
+                return
+            except FutureTimeout:
+                status, result = 504, {"error": f"no answer within {service.request_timeout}s"}
+            except Exception as e:
+                logger.exception("Query request failed")
+                status, result = 500, {"error": str(e)}
+            else:
+                status = 200
+            service.metrics.observe("macsql_service_request_seconds", time.monotonic() - started)
+            self._count("query", status)
+            self._send_json(status, result)
+
+    return _Server((host, port), Handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP text-to-SQL service over a directory of SQLite databases")
+    parser.add_argument("--db-root", required=True, help="directory holding the databases, requests name files relative to it")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", default="codellama:13b")
+    parser.add_argument("--ollama", default="http://localhost:11434")
+    parser.add_argument("--max-engines", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=300.0)
+    parser.add_argument("--schema-artifacts", action="store_true",
+                        help="save each database's introspected schema next to it and load it when the engine reopens")
+    parser.add_argument("--column-stats", action="store_true",
+                        help="profile columns in the background and add formats and ranges to the prompts")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    registry = EngineRegistry(args.db_root, max_engines=args.max_engines, ollama_url=args.ollama,
+                              engine_kwargs={"model_name": args.model, "schema_artifact": args.schema_artifacts,
+                                             "column_stats": args.column_stats})
+    service = QueryService(registry, workers=args.workers, max_pending=args.max_pending, request_timeout=args.timeout)
+    httpd = make_server(service, args.host, args.port)
+    logger.info(f"Serving {registry.db_root} on http://{args.host}:{args.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,79 @@
-from typing import List, Dict, Any, Optional
+import threading
+from typing import List, Dict, Any, Optional, Callable, TYPE_CHECKING
 from .llm_client import OllamaClient
+from .sql_stream import StreamingSQLExtractor
+from .sql_extract import (extract_sql, DECOMPOSER_PREFIXES, DECOMPOSER_STOP_LINES,
+                          REFINER_PREFIXES, REFINER_STOP_LINES)
 
+if TYPE_CHECKING:
+    from .async_llm_client import AsyncOllamaClient
 
-class SelectorAgent:
-    def __init__(self, llm_client: OllamaClient):
+
+class BaseAgent:
+    _static_prompts: Dict[type, Dict[str, str]] = {}
+    
+    def __init__(self,
+                 llm_client: OllamaClient,
+                 async_llm_client: Optional["AsyncOllamaClient"] = None,  #MACSQL fills this in on the first aquery
+                 stream: bool = False,
+                 on_token: Optional[Callable[[str], None]] = None):
         self.llm = llm_client
+        self.async_llm = async_llm_client
+        self.stream = stream
+        self.on_token = on_token
+        
+        #static parts of the prompt are built once per agent class and shared by every
+        #instance, the invariant prefix goes first so ollama can keep it evaluated between calls
+        prompts = BaseAgent._static_prompts.get(type(self))
+        if prompts is None:
+            prompts = BaseAgent._static_prompts[type(self)] = self.build_static_prompts()
+        self.__dict__.update(prompts)
+    
+    def build_static_prompts(self) -> Dict[str, str]:
+        return {"system_prompt": self.get_system_prompt(), "prompt_prefix": self.build_prompt_prefix()}
+    
+    def process(self, input_data: Dict[str, Any], cancel: Optional[threading.Event] = None) -> Dict[str, Any]:
+        request = self.build_request(input_data)
+        #a cancellable call always streams, a blocking generate cant be hung up on
+        if self.stream or cancel is not None:
+            on_token = self.on_token if self.stream else None
+            response = self.llm.generate_stream(on_token=on_token, extractor=self.make_extractor(), cancel=cancel, **request)
+        else:
+            response = self.llm.generate(**request)
+        result = self.parse_response(response, input_data)
+        result["llm_stats"] = self.llm.last_stats()
+        return result
+    
+    async def aprocess(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        if self.async_llm is None:
+            raise ValueError("No async LLM client configured")
+        request = self.build_request(input_data)
+        if self.stream:
+            response = await self.async_llm.generate_stream(on_token=self.on_token, extractor=self.make_extractor(), **request)
+        else:
+            response = await self.async_llm.generate(**request)
+        result = self.parse_response(response, input_data)
+        result["llm_stats"] = self.async_llm.last_stats()
+        return result
     
+    def get_system_prompt(self) -> str:
+        raise NotImplementedError
+    
+    def build_prompt_prefix(self) -> str:
+        return ""
+    
+    def make_extractor(self) -> Optional[StreamingSQLExtractor]:
+        #agents that answer with sql override this so the stream can stop at the end of the statement
+        return None
+    
+    def build_request(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        raise NotImplementedError
+    
+    def parse_response(self, response: str, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        raise NotImplementedError
+
+
+class SelectorAgent(BaseAgent):
     def get_system_prompt(self) -> str:
         return """You are a database schema analyzer. Your job is to identify which tables and columns are relevant for answering a given question.
 
@@ -17,48 +85,53 @@ CRITICAL RULES:
 5. NEVER hallucinate columns that don't exist in the schema
 6. Return as clean text listing: table.column format, one per line"""
 
-    def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+    def build_prompt_prefix(self) -> str:
+#in this section, some few-shot examples as to the layout of tables help this agent a lot
+#some are left in a text file in this project and should be pasted here when testing
+        return """ANALYSIS RULES:
+- Look at the question keywords to identify relevant data
+- For comparative questions (most/highest): Include the comparison column
+- Always include JOIN keys when joining tables
+- Use only column names that exist in the provided schema
+
+FORMAT: Return each needed column as table.column on a separate line.
+
+"""
+
+    def build_request(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
         question = input_data["question"]
         schema = input_data["schema"]
+        
+        #sampled formats and ranges, helps tell a date column from an id or pick the right status column
+        column_stats = input_data.get("column_stats")
+        stats_block = f"\nCOLUMN STATS (SAMPLED):\n{column_stats}\n" if column_stats else ""
 
-
-#in this section, some few-shot examples as to the layout of tables help this agent a lot
-#some are left in a text file in this project and should be pasted here when testing
         prompt = f"""DATABASE SCHEMA (EXACT COLUMN NAMES):
 {schema}
-
+{stats_block}
 
 QUESTION: "{question}"
 
 TASK: Identify ONLY the table.column combinations needed to answer this question.
 Use EXACT names from the schema above. Do not invent column names.
 
-ANALYSIS RULES:
-- Look at the question keywords to identify relevant data
-- For comparative questions (most/highest): Include the comparison column
-- Always include JOIN keys when joining tables
-- Use only column names that exist in the provided schema
-
-FORMAT: Return each needed column as table.column on a separate line.
-
 RESPOND WITH COLUMN LIST ONLY:"""
 
-        response = self.llm.generate(
-            prompt=prompt,
-            system=self.get_system_prompt(),
-            temperature=0.0
-        )
-        
+        return {
+            "prefix": self.prompt_prefix,
+            "prompt": prompt,
+            "system": self.system_prompt,
+            "temperature": 0.0
+        }
+    
+    def parse_response(self, response: str, input_data: Dict[str, Any]) -> Dict[str, Any]:
         return {
             "selected_schema": response.strip(),
-            "reasoning": f"Selected schema for: {question}"
+            "reasoning": f"Selected schema for: {input_data['question']}"
         }
 
 
-class DecomposerAgent:
-    def __init__(self, llm_client: OllamaClient):
-        self.llm = llm_client
-    
+class DecomposerAgent(BaseAgent):
     def get_system_prompt(self) -> str:
         return """You are an expert SQLite query generator. Convert natural language questions into valid SQLite queries.
 
@@ -74,13 +147,17 @@ CRITICAL RULES - FOLLOW EXACTLY:
 9. RESPOND WITH SQL QUERY ONLY - NO OTHER TEXT
 10. ALWAYS add LIMIT 1 for superlative questions (most, highest, best, worst, etc.)"""
 
-    def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
-        question = input_data["question"]
-        selected_schema = input_data["selected_schema"]
-        
-        available_columns = [line.strip() for line in selected_schema.split('\n') if line.strip() and '.' in line.strip()]
-        
-        domain_knowledge = """
+    def build_static_prompts(self) -> Dict[str, str]:
+        #retrieved examples go in the per-question part instead, base_prefix stays shared
+        base_prefix = self.build_base_prefix()
+        return {"system_prompt": self.get_system_prompt(), "base_prefix": base_prefix,
+                "prompt_prefix": self._with_default_examples(base_prefix)}
+    
+    def build_prompt_prefix(self) -> str:
+        return self._with_default_examples(self.build_base_prefix())
+
+    def build_base_prefix(self) -> str:
+        return """
 GENERAL SQL PATTERNS:
 - "highest/most X" = ORDER BY X DESC LIMIT 1 (must include ORDER BY and LIMIT)
 - "lowest/least X" = ORDER BY X ASC LIMIT 1
@@ -106,11 +183,9 @@ COMMON QUESTION PATTERNS:
 
 
       """
-        
-        prompt = f"""AVAILABLE COLUMNS (USE ONLY THESE):
-{chr(10).join(available_columns)}
 
-{domain_knowledge}
+    def _with_default_examples(self, domain_knowledge: str) -> str:
+        return f"""{domain_knowledge}
 
 LEARN FROM THESE EXAMPLES:
      EXAMPLE 1:
@@ -172,6 +247,30 @@ LEARN FROM THESE EXAMPLES:
 
 
 
+"""
+
+    def build_request(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+        question = input_data["question"]
+        selected_schema = input_data["selected_schema"]
+        
+        available_columns = [line.strip() for line in selected_schema.split('\n') if line.strip() and '.' in line.strip()]
+        
+        #real spellings from the value index so the model doesnt guess 'WI' vs 'Wisconsin'
+        value_hints = input_data.get("value_hints")
+        value_block = f"\nKNOWN VALUES (USE THESE EXACT SPELLINGS IN WHERE CLAUSES):\n{value_hints}\n" if value_hints else ""
+        
+        #date formats and ranges from the column profiler, the examples assume 'YYYY-MM-DD' which isnt always true
+        column_stats = input_data.get("column_stats")
+        stats_block = f"\nCOLUMN FORMATS AND RANGES (MATCH THESE IN FILTERS):\n{column_stats}\n" if column_stats else ""
+        
+        #examples retrieved for this question replace the fixed e-commerce ones
+        examples = input_data.get("examples")
+        prefix = self.base_prefix if examples else self.prompt_prefix
+        examples_block = f"LEARN FROM THESE EXAMPLES:\n{examples}\n\n" if examples else ""
+        
+        prompt = f"""{examples_block}AVAILABLE COLUMNS (USE ONLY THESE):
+{chr(10).join(available_columns)}
+{value_block}{stats_block}
 NOW SOLVE: "{question}"
 
 CRITICAL REQUIREMENTS:
@@ -183,12 +282,17 @@ CRITICAL REQUIREMENTS:
 
 SQL QUERY:"""
 
-        response = self.llm.generate(
-            prompt=prompt,
-            system=self.get_system_prompt(),
-            temperature=0.0
-        )
-        
+        return {
+            "prefix": prefix,
+            "prompt": prompt,
+            "system": self.system_prompt,
+            "temperature": input_data.get("temperature", 0.0)  #speculative candidates sample hotter
+        }
+    
+    def make_extractor(self) -> Optional[StreamingSQLExtractor]:
+        return StreamingSQLExtractor()
+    
+    def parse_response(self, response: str, input_data: Dict[str, Any]) -> Dict[str, Any]:
         sql_query = self._extract_sql(response)
         
         return {
@@ -197,59 +301,10 @@ SQL QUERY:"""
         }
     
     def _extract_sql(self, resp: str) -> str:
-        import re
-        # clean markdown
-        sql_blocks = re.findall(r'```sql\s*(.*?)\s*```', resp, re.DOTALL | re.IGNORECASE)
-        if sql_blocks:
-            sql = sql_blocks[0].strip()
-        else:
-            code_blocks = re.findall(r'```\s*(.*?)\s*```', resp, re.DOTALL)
-            if code_blocks:
-                sql = code_blocks[0].strip()
-            else:
-                cleaned = resp.strip()
-                prefixes_to_remove = [
-                    "Here's the SQL query:",
-                    "The SQL query is:",
-                    "Query:",
-                    "SQL:",
-                    "SQL Query:",
-                    "The query:",
-                    "Here is the query:",
-                    "Based on the schema,",
-                ]
-                
-                for prefix in prefixes_to_remove:
-                    if cleaned.lower().startswith(prefix.lower()):
-                        cleaned = cleaned[len(prefix):].strip()
-                
-                lines = cleaned.split('\n')
-                sql_lines = []
-                
-                for line in lines:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    if line.lower().startswith(('this query', 'the query', 'explanation:', 'note:')):
-                        break   #sometimes it likes to add these so well just toss those
-                    #anyline without sql words is bad
-                    if not any(keyword in line.upper() for keyword in ['SELECT', 'FROM', 'WHERE', 'JOIN', 'ORDER', 'GROUP', 'HAVING', 'UNION', 'INSERT', 'UPDATE', 'DELETE']):
-                        if not line.endswith(';') and not line.endswith(',') and 'ON' not in line.upper():
-                            continue
-                    sql_lines.append(line)
-                
-                #fit them all back together
-                sql = ' '.join(sql_lines)
-                if ';' in sql:
-                    sql = sql.split(';')[0] + ';'
-        
-        return sql.strip()
+        return extract_sql(resp, DECOMPOSER_PREFIXES, DECOMPOSER_STOP_LINES)
 
 
-class RefinerAgent:
-    def __init__(self, llm_client: OllamaClient):
-        self.llm = llm_client
-    
+class RefinerAgent(BaseAgent):
     def get_system_prompt(self) -> str:
         return """You are a SQLite debugging expert. Fix syntax errors and optimize queries for SQLite.
 
@@ -263,7 +318,17 @@ CRITICAL RULES - FOLLOW EXACTLY:
 7. For ambiguous columns, add proper table aliases
 8. RESPOND WITH CORRECTED SQL QUERY ONLY - NO OTHER TEXT"""
 
-    def process(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
+    def build_prompt_prefix(self) -> str:
+        return """CRITICAL FIXES NEEDED:
+- Use ONLY columns that exist in the schema below
+- Fix JOIN conditions using proper table.column = table.column syntax
+- Fix table aliases consistently (T1, T2, T3)
+- Ensure WHERE clauses reference correct tables
+- For comparative questions, ensure ORDER BY and LIMIT are included
+
+"""
+
+    def build_request(self, input_data: Dict[str, Any]) -> Dict[str, Any]:
         original_query = input_data["sql_query"]
         error_message = input_data.get("error_message", "")
         schema = input_data["schema"]
@@ -285,26 +350,24 @@ TASK: Fix the SQL query to eliminate the error.
 
 {common_fixes}
 
-CRITICAL FIXES NEEDED:
-- Use ONLY columns that exist in the schema above
-- Fix JOIN conditions using proper table.column = table.column syntax
-- Fix table aliases consistently (T1, T2, T3)
-- Ensure WHERE clauses reference correct tables
-- For comparative questions, ensure ORDER BY and LIMIT are included
-
 FIXED SQL QUERY:"""
 
-        response = self.llm.generate(
-            prompt=prompt,
-            system=self.get_system_prompt(),
-            temperature=0.3 #kicking it up for some chance debugging
-        )
-        
+        return {
+            "prefix": self.prompt_prefix,
+            "prompt": prompt,
+            "system": self.system_prompt,
+            "temperature": 0.3 #kicking it up for some chance debugging
+        }
+    
+    def make_extractor(self) -> Optional[StreamingSQLExtractor]:
+        return StreamingSQLExtractor()
+    
+    def parse_response(self, response: str, input_data: Dict[str, Any]) -> Dict[str, Any]:
         sql_query = self._extract_sql(response)
         
         return {
             "refined_query": sql_query,
-            "fixes_applied": f"Fixed error: {error_message}"
+            "fixes_applied": f"Fixed error: {input_data.get('error_message', '')}"
         }
     
     def _analyze_error(self, error_message: str, query: str, question: str) -> str:
@@ -318,57 +381,10 @@ FIXED SQL QUERY:"""
         if "ambiguous column" in error_lower:
             fixes.append("- ERROR: Ambiguous column → Add proper table aliases (T1.column, T2.column)")
         
+        if "too expensive" in error_lower:
+            fixes.append("- ERROR: Query was cancelled for running too long → Give every JOIN an ON condition and filter with WHERE before aggregating")
+        
         return "SPECIFIC FIXES NEEDED:\n" + "\n".join(fixes) if fixes else "COMMON FIXES:"
     
     def _extract_sql(self, response: str) -> str:
-        import re
-        
-        sql_blocks = re.findall(r'```sql\s*(.*?)\s*```', response, re.DOTALL | re.IGNORECASE)
-        if sql_blocks:
-            return sql_blocks[0].strip()
-        
-        code_blocks = re.findall(r'```\s*(.*?)\s*```', response, re.DOTALL)
-        if code_blocks:
-            return code_blocks[0].strip()
-        
-        cleaned = response.strip()
-        
-        prefixes_to_remove = [
-            "Here's the corrected SQL query:",
-            "The corrected SQL query is:",
-            "Here's the fixed SQL query:",
-            "The fixed SQL query is:",
-            "Here's the SQL query:",
-            "The SQL query is:",
-            "Query:",
-            "SQL:",
-            "SQL Query:",
-            "Fixed query:",
-            "Corrected query:",
-        ]
-        
-        for prefix in prefixes_to_remove:
-            if cleaned.lower().startswith(prefix.lower()):
-                cleaned = cleaned[len(prefix):].strip()
-        
-        
-        lines = cleaned.split('\n')
-        sql_lines = []
-        
-        for line in lines:
-            line = line.strip()
-            if not line:
-                continue
-            if line.lower().startswith(('this query', 'the query', 'explanation:', 'note:', 'this fixes')):
-                break
-            if not any(keyword in line.upper() for keyword in ['SELECT', 'FROM', 'WHERE', 'JOIN', 'ORDER', 'GROUP', 'HAVING', 'UNION', 'INSERT', 'UPDATE', 'DELETE']):
-                if not line.endswith(';') and not line.endswith(',') and 'ON' not in line.upper():
-                    continue
-            sql_lines.append(line)
-        
-        result = ' '.join(sql_lines)
-        
-        if ';' in result:
-            result = result.split(';')[0] + ';'
-        
-        return result.strip()
+        return extract_sql(response, REFINER_PREFIXES, REFINER_STOP_LINES)
@@ -0,0 +1,83 @@
+import re
+from typing import Tuple
+
+
+#shared by the decomposer and refiner, compiled once at import instead of on every response
+_SQL_FENCE = re.compile(r'```sql\s*(.*?)\s*```', re.DOTALL | re.IGNORECASE)
+_CODE_FENCE = re.compile(r'```\s*(.*?)\s*```', re.DOTALL)
+#plain substring match on the upper cased line, same as the old keyword list
+_SQL_WORD = re.compile(r'SELECT|FROM|WHERE|JOIN|ORDER|GROUP|HAVING|UNION|INSERT|UPDATE|DELETE')
+
+#lead-ins the models like to put in front of the statement, stripped in this order
+DECOMPOSER_PREFIXES = (
+    "Here's the SQL query:",
+    "The SQL query is:",
+    "Query:",
+    "SQL:",
+    "SQL Query:",
+    "The query:",
+    "Here is the query:",
+    "Based on the schema,",
+)
+REFINER_PREFIXES = (
+    "Here's the corrected SQL query:",
+    "The corrected SQL query is:",
+    "Here's the fixed SQL query:",
+    "The fixed SQL query is:",
+    "Here's the SQL query:",
+    "The SQL query is:",
+    "Query:",
+    "SQL:",
+    "SQL Query:",
+    "Fixed query:",
+    "Corrected query:",
+)
+
+#explanations after the sql, everything from here on gets dropped
+DECOMPOSER_STOP_LINES = ('this query', 'the query', 'explanation:', 'note:')
+REFINER_STOP_LINES = DECOMPOSER_STOP_LINES + ('this fixes',)
+
+
+def _lowered(prefixes: Tuple[str, ...]) -> Tuple[Tuple[str, int], ...]:
+    return tuple((prefix.lower(), len(prefix)) for prefix in prefixes)
+
+
+_LOWERED = {DECOMPOSER_PREFIXES: _lowered(DECOMPOSER_PREFIXES), REFINER_PREFIXES: _lowered(REFINER_PREFIXES)}
+
+
+def extract_sql(response: str,
+                prefixes: Tuple[str, ...] = DECOMPOSER_PREFIXES,
+                stop_lines: Tuple[str, ...] = DECOMPOSER_STOP_LINES) -> str:
+    sql_blocks = _SQL_FENCE.findall(response)
+    if sql_blocks:
+        return sql_blocks[0].strip()
+
+    code_blocks = _CODE_FENCE.findall(response)
+    if code_blocks:
+        return code_blocks[0].strip()
+
+    cleaned = response.strip()
+    lowered = _LOWERED.get(prefixes) or _lowered(prefixes)
+    for prefix, length in lowered:
+        if cleaned.lower().startswith(prefix):
+            cleaned = cleaned[length:].strip()
+
+    sql_lines = []
+    for line in cleaned.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        if line.lower().startswith(stop_lines):
+            break   #sometimes it likes to add these so well just toss those
+        #anyline without sql words is bad
+        upper = line.upper()
+        if not _SQL_WORD.search(upper):
+            if not line.endswith(';') and not line.endswith(',') and 'ON' not in upper:
+                continue
+        sql_lines.append(line)
+
+    #fit them all back together
+    sql = ' '.join(sql_lines)
+    if ';' in sql:
+        sql = sql.split(';')[0] + ';'
+    return sql.strip()
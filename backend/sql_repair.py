@@ -0,0 +1,257 @@
+import difflib
+import re
+import threading
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
+
+from .query_validator import QueryValidator
+from .schema_extractor import SchemaCatalog
+from .schema_index import tokenize_identifier, tokenize_question
+
+
+_STRINGS = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+_TABLE_REF = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_NOT_ALIASES = {"where", "join", "on", "inner", "left", "right", "outer", "cross", "group", "order", "limit", "natural", "using", "union", "having"}
+_JOIN_ON = re.compile(r"\bON\s+(\w+)\.(\w+)\s*=\s*(\w+)\.(\w+)", re.IGNORECASE)
+_FENCE = re.compile(r"```(?:sql)?\s*(.*?)\s*(?:```|$)", re.DOTALL | re.IGNORECASE)
+
+_NO_SUCH_COLUMN = re.compile(r"no such column: (?:(\w+)\.)?(\w+)", re.IGNORECASE)
+_AMBIGUOUS = re.compile(r"ambiguous column name: (?:(\w+)\.)?(\w+)", re.IGNORECASE)
+_NO_SUCH_TABLE = re.compile(r"no such table: (?:\w+\.)?(\w+)", re.IGNORECASE)
+
+MIN_SIMILARITY = 0.6
+MIN_MARGIN = 0.05  #closer than this between the top two and we let the llm decide
+
+
+def _outside_strings(sql: str, fn) -> str:
+    #string literals are odd entries after the split, only rewrite the sql around them
+    parts = _STRINGS.split(sql)
+    return "".join(fn(part) if i % 2 == 0 else part for i, part in enumerate(parts))
+
+
+def _sub(pattern: str, repl: str, sql: str) -> str:
+    regex = re.compile(pattern, re.IGNORECASE)
+    return _outside_strings(sql, lambda part: regex.sub(repl, part))
+
+
+class SQLRepairer:
+    def __init__(self, validator: QueryValidator, max_rounds: int = 3):
+        self.validator = validator
+        self.max_rounds = max_rounds
+
+        self._lock = threading.Lock()
+        self.attempts = 0
+        self.repaired = 0
+        self.by_rule: Counter = Counter()
+
+    def repair(self, sql: str, error: str, catalog: SchemaCatalog, question: str = "") -> Optional[Dict[str, Any]]:
+        #cheap schema driven fixes, every candidate is re-checked with EXPLAIN before we trust it
+        fixes = []
+        for _ in range(self.max_rounds):
+            fixed, fix = self._apply_rule(sql, error, catalog, question)
+            if fixed is None or fixed == sql:
+                break
+            fixes.append(fix)
+            sql = fixed
+            check = self.validator.validate_query(sql)
+            if check["is_valid"]:
+                with self._lock:
+                    self.attempts += 1
+                    self.repaired += 1
+                    self.by_rule.update(f["rule"] for f in fixes)
+                return {"sql": sql, "fixes": fixes, "check": check}
+            error = check["error"]
+
+        with self._lock:
+            self.attempts += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "attempts": self.attempts,
+                "repaired": self.repaired,
+                "refinements_avoided": self.repaired,
+                "by_rule": dict(self.by_rule),
+            }
+
+    def _apply_rule(self, sql: str, error: str, catalog: SchemaCatalog, question: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        cleaned = self._strip_noise(sql)
+        if cleaned != sql:
+            return cleaned, {"rule": "strip_noise"}
+
+        refs = self._table_refs(sql, catalog)
+
+        match = _NO_SUCH_COLUMN.search(error)
+        if match:
+            return self._fix_column(sql, match.group(1), match.group(2), refs, catalog, question)
+
+        match = _AMBIGUOUS.search(error)
+        if match:
+            return self._fix_ambiguous(sql, match.group(2), refs, catalog, question)
+
+        match = _NO_SUCH_TABLE.search(error)
+        if match:
+            bad = match.group(1)
+            table_name = self._closest(bad, catalog.table_names(), question)
+            if table_name is None:
+                return None, None
+            fixed = _sub(rf"\b(FROM|JOIN)(\s+){re.escape(bad)}\b", rf"\1\2{table_name}", sql)
+            fixed = _sub(rf"(?<![\w.]){re.escape(bad)}\.", f"{table_name}.", fixed)
+            return fixed, {"rule": "table_name", "from": bad, "to": table_name}
+
+        return None, None
+
+    def _strip_noise(self, sql: str) -> str:
+        #leftover markdown fences and prose after the statement
+        fenced = _FENCE.search(sql)
+        if fenced:
+            sql = fenced.group(1)
+        cut = None
+        quote = None
+        for i, c in enumerate(sql):
+            if quote:
+                if c == quote:
+                    quote = None
+            elif c in ("'", '"'):
+                quote = c
+            elif c == ';':
+                cut = i + 1
+                break
+        if cut is not None and sql[cut:].strip():
+            sql = sql[:cut]
+        return sql.strip()
+
+    def _table_refs(self, sql: str, catalog: SchemaCatalog) -> List[Tuple[str, str]]:
+        #(table, name it is referenced by) in FROM/JOIN order
+        names = {t.lower(): t for t in catalog.tables}
+        refs = []
+        for table_ref, alias in _TABLE_REF.findall(_STRINGS.sub("''", sql)):
+            table_name = names.get(table_ref.lower())
+            if table_name is None:
+                continue
+            if alias and alias.lower() not in _NOT_ALIASES:
+                refs.append((table_name, alias))
+            else:
+                refs.append((table_name, table_name))
+        return refs
+
+    def _columns(self, catalog: SchemaCatalog, table_name: str) -> List[str]:
+        return [col["name"] for col in catalog.tables[table_name]["columns"]]
+
+    def _has_column(self, catalog: SchemaCatalog, table_name: str, column: str) -> Optional[str]:
+        for name in self._columns(catalog, table_name):
+            if name.lower() == column.lower():
+                return name
+        return None
+
+    def _closest(self, name: str, candidates: List[str], question: str) -> Optional[str]:
+        #edit distance on the identifier, nudged by shared words and by what the question mentions
+        if not candidates:
+            return None
+        name_tokens = set(tokenize_identifier(name))
+        question_tokens = set(tokenize_question(question))
+        scored = []
+        for candidate in candidates:
+            tokens = set(tokenize_identifier(candidate))
+            score = difflib.SequenceMatcher(None, name.lower(), candidate.lower()).ratio()
+            if name_tokens and name_tokens <= tokens:
+                score += 0.15
+            score += 0.1 * len((tokens - name_tokens) & question_tokens)
+            scored.append((score, candidate))
+        scored.sort(reverse=True)
+        if scored[0][0] < MIN_SIMILARITY:
+            return None
+        if len(scored) > 1 and scored[0][0] - scored[1][0] < MIN_MARGIN:
+            return None
+        return scored[0][1]
+
+    def _foreign_key(self, catalog: SchemaCatalog, left: str, right: str) -> Optional[Tuple[str, str]]:
+        #(left column, right column) of a key linking the two tables, either direction
+        for fk in catalog.tables[left]["foreign_keys"]:
+            if fk["references_table"] == right:
+                return fk["column"], fk["references_column"]
+        for fk in catalog.tables[right]["foreign_keys"]:
+            if fk["references_table"] == left:
+                return fk["references_column"], fk["column"]
+        return None
+
+    def _fix_column(self, sql: str, qualifier: Optional[str], column: str, refs: List[Tuple[str, str]],
+                    catalog: SchemaCatalog, question: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        by_ref = {ref.lower(): table_name for table_name, ref in refs}
+
+        if qualifier:
+            #a broken join condition gets rebuilt from the foreign key between the two tables
+            for match in _JOIN_ON.finditer(sql):
+                left_ref, left_col, right_ref, right_col = match.groups()
+                sides = {(left_ref.lower(), left_col.lower()), (right_ref.lower(), right_col.lower())}
+                if (qualifier.lower(), column.lower()) not in sides:
+                    continue
+                left, right = by_ref.get(left_ref.lower()), by_ref.get(right_ref.lower())
+                if left is None or right is None or left == right:
+                    continue
+                key = self._foreign_key(catalog, left, right)
+                if key is None:
+                    continue
+                condition = f"ON {left_ref}.{key[0]} = {right_ref}.{key[1]}"
+                fixed = sql[:match.start()] + condition + sql[match.end():]
+                return fixed, {"rule": "join_key", "from": match.group(0), "to": condition}
+
+            table_name = by_ref.get(qualifier.lower())
+            owners = [(t, ref) for t, ref in refs if self._has_column(catalog, t, column)]
+            if len(owners) == 1:
+                #right column, wrong alias
+                owner_table, owner_ref = owners[0]
+                real = self._has_column(catalog, owner_table, column)
+                fixed = _sub(rf"(?<![\w.]){re.escape(qualifier)}\.{re.escape(column)}\b", f"{owner_ref}.{real}", sql)
+                return fixed, {"rule": "qualifier", "from": f"{qualifier}.{column}", "to": f"{owner_ref}.{real}"}
+            if table_name is None:
+                return None, None
+
+            best = self._closest(column, self._columns(catalog, table_name), question)
+            if best is None:
+                return None, None
+            fixed = _sub(rf"(?<![\w.]){re.escape(qualifier)}\.{re.escape(column)}\b", f"{qualifier}.{best}", sql)
+            return fixed, {"rule": "column_name", "from": f"{qualifier}.{column}", "to": f"{qualifier}.{best}"}
+
+        candidates = {}
+        for table_name, ref in refs:
+            for name in self._columns(catalog, table_name):
+                candidates.setdefault(name, []).append(ref)
+        best = self._closest(column, list(candidates), question)
+        if best is None:
+            return None, None
+        #qualify it if more than one table in the query has that column
+        replacement = best if len(candidates[best]) == 1 else f"{candidates[best][0]}.{best}"
+        fixed = _sub(rf"(?<![\w.]){re.escape(column)}\b(?!\s*\()", replacement, sql)
+        return fixed, {"rule": "column_name", "from": column, "to": replacement}
+
+    def _fix_ambiguous(self, sql: str, column: str, refs: List[Tuple[str, str]],
+                       catalog: SchemaCatalog, question: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+        owners = [(t, ref) for t, ref in refs if self._has_column(catalog, t, column)]
+        if len(owners) < 2 or len({t for t, _ in owners}) < len(owners):
+            return None, None  #self joins really are ambiguous
+
+        chosen = None
+        owner_tables = [t for t, _ in owners]
+        for i, left in enumerate(owner_tables):
+            for right in owner_tables[i + 1:]:
+                key = self._foreign_key(catalog, left, right)
+                if key and key[0].lower() == column.lower() and key[1].lower() == column.lower():
+                    #its the join key so both sides hold the same value, take the first table
+                    chosen = owners[0]
+                    break
+            if chosen:
+                break
+
+        if chosen is None:
+            question_tokens = set(tokenize_question(question))
+            scored = sorted(((len(set(tokenize_identifier(t)) & question_tokens), t, ref) for t, ref in owners), reverse=True)
+            if scored[0][0] == 0 or scored[0][0] == scored[1][0]:
+                return None, None
+            chosen = (scored[0][1], scored[0][2])
+
+        table_name, ref = chosen
+        real = self._has_column(catalog, table_name, column)
+        fixed = _sub(rf"(?<![\w.]){re.escape(column)}\b(?!\s*\()", f"{ref}.{real}", sql)
+        return fixed, {"rule": "ambiguous_column", "column": column, "to": f"{ref}.{real}"}
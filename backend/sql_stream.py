@@ -0,0 +1,109 @@
+import re
+from typing import Optional
+
+from .sql_extract import REFINER_STOP_LINES
+
+
+#where the sql starts inside a line of chatter like "Here's the SQL query: SELECT ..."
+_SQL_START = re.compile(r"\b(SELECT|WITH)\b|(?:^|:)\s*(select|with)\b", re.MULTILINE)
+
+STOP_LINES = REFINER_STOP_LINES  #superset of the decomposer's
+_STOP_CHECK_LEN = max(len(line) for line in STOP_LINES) + 4  #a little slack for indentation
+
+
+class StreamingSQLExtractor:
+    def __init__(self):
+        self.buffer = ""
+        self.complete = False
+
+        self._pos = 0
+        self._line_start = 0
+        self._in_fence = False
+        self._sql_started = False
+        self._sql_start = 0
+        self._quote: Optional[str] = None
+        self._cut: Optional[int] = None
+        self._close_fence = False
+
+    def feed(self, token: str) -> bool:
+        if self.complete:
+            return True
+        self.buffer += token
+        self._scan()
+        return self.complete
+
+    def _finish(self, cut: int, close_fence: bool = False):
+        self.complete = True
+        self._cut = cut
+        self._close_fence = close_fence
+
+    def _scan(self):
+        buf = self.buffer
+        i = self._pos
+
+        while i < len(buf):
+            c = buf[i]
+
+            if c == '`' and self._quote is None:
+                if len(buf) - i < 3:
+                    break  #might be half a fence, wait for the next token
+                if buf.startswith('```', i):
+                    if self._in_fence:
+                        self._finish(i + 3)
+                        return
+                    #opening fence, skip the language tag and wait for the newline
+                    newline = buf.find('\n', i)
+                    if newline == -1:
+                        break
+                    self._in_fence = True
+                    self._sql_started = True
+                    self._quote = None
+                    i = newline + 1
+                    self._sql_start = i
+                    self._line_start = i
+                    continue
+
+            if not self._sql_started:
+                if c == '\n':
+                    self._line_start = i + 1
+                    i += 1
+                    continue
+                #only look once we have the whole word so "SEL" doesnt miss "SELECT"
+                match = _SQL_START.search(buf, self._line_start, i + 1)
+                if match is None or match.end() > i or not c.isspace():
+                    i += 1
+                    continue
+                self._sql_started = True
+                i = self._sql_start = match.start()
+                continue
+
+            if self._quote is not None:
+                if c == self._quote:
+                    self._quote = None
+            elif c in ("'", '"'):
+                self._quote = c
+            elif c == ';':
+                self._finish(i + 1, close_fence=self._in_fence)
+                return
+            elif c == '\n':
+                self._line_start = i + 1
+            elif not self._in_fence and self._line_start > self._sql_start and i - self._line_start < _STOP_CHECK_LEN:
+                #catch "This query..." as soon as it starts instead of waiting out the sentence
+                line = buf[self._line_start:i + 1].lstrip().lower()
+                if line.startswith(STOP_LINES):
+                    self._finish(self._line_start)
+                    return
+
+            i += 1
+
+        self._pos = i
+
+    def text(self) -> str:
+        #what the model said up to the end of the statement, shaped so the agents'
+        #own _extract_sql sees the same thing it would have in non-streaming mode
+        if self._cut is None:
+            return self.buffer
+        text = self.buffer[:self._cut]
+        if self._close_fence:
+            text += "\n```"
+        return text
@@ -0,0 +1,225 @@
+import io
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+
+
+logger = logging.getLogger(__name__)
+
+#seconds, spans run from sub millisecond sqlite calls to multi second llm calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+#ollama durations are nanoseconds, these get exported in seconds
+LLM_DURATIONS = ("total_duration", "load_duration", "prompt_eval_duration", "eval_duration")
+LLM_COUNTS = ("prompt_eval_count", "eval_count")
+
+_current_trace: ContextVar = ContextVar("macsql_trace", default=None)
+_current_span: ContextVar = ContextVar("macsql_span", default=None)
+
+
+def _label_key(labels: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _prom_labels(key: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    body = ",".join('{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"')) for k, v in pairs)
+    return "{" + body + "}"
+
+
+class Metrics:
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters: Dict[str, Dict[tuple, float]] = {}
+        self._histograms: Dict[str, Dict[tuple, Dict[str, Any]]] = {}
+        self._gauges: Dict[str, Dict[tuple, float]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._gauges.setdefault(name, {})[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+            hist["counts"][bisect_left(self.buckets, value)] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    def to_json(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {
+                name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                for name, series in self._counters.items()
+            }
+            gauges = {
+                name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                for name, series in self._gauges.items()
+            }
+            histograms = {}
+            for name, series in self._histograms.items():
+                histograms[name] = [{
+                    "labels": dict(key),
+                    "count": hist["count"],
+                    "sum": hist["sum"],
+                    "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], hist["counts"])),
+                } for key, hist in series.items()]
+            return {"counters": counters, "gauges": gauges, "histograms": histograms}
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_prom_labels(key)} {value}")
+            for name, series in sorted(self._gauges.items()):
+                lines.append(f"# TYPE {name} gauge")
+                for key, value in series.items():
+                    lines.append(f"{name}{_prom_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, hist in series.items():
+                    cumulative = 0
+                    for bound, count in zip(self.buckets, hist["counts"]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_prom_labels(key, ('le', str(bound)))} {cumulative}")
+                    lines.append(f"{name}_bucket{_prom_labels(key, ('le', '+Inf'))} {hist['count']}")
+                    lines.append(f"{name}_sum{_prom_labels(key)} {hist['sum']}")
+                    lines.append(f"{name}_count{_prom_labels(key)} {hist['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    def __init__(self, metrics: Optional[Metrics] = None):
+        self.metrics = metrics or Metrics()
+
+    @contextmanager
+    def trace(self, name: str, **attrs) -> Iterator[Dict[str, Any]]:
+        #one trace per question, spans opened inside it (same thread or task) attach to it
+        trace = self.begin(name, **attrs)
+        try:
+            with self.attach(trace):
+                yield trace
+        except Exception:
+            trace.setdefault("status", "error")
+            raise
+        finally:
+            self.end(trace)
+
+    def begin(self, name: str, **attrs) -> Dict[str, Any]:
+        #begin/attach/end for work that hops between threads, like query_batch stages
+        return {"trace_id": os.urandom(8).hex(), "name": name, "attrs": attrs, "spans": [],
+                "_started": time.perf_counter()}
+
+    @contextmanager
+    def attach(self, trace: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        token = _current_trace.set(trace)
+        try:
+            yield trace
+        finally:
+            _current_trace.reset(token)
+
+    def end(self, trace: Dict[str, Any], status: Optional[str] = None):
+        trace["duration"] = time.perf_counter() - trace.pop("_started")
+        trace["status"] = status or trace.get("status", "ok")
+        self.metrics.observe("macsql_query_seconds", trace["duration"])
+        self.metrics.inc("macsql_queries_total", status=trace["status"])
+        logger.info(json.dumps({"event": "trace", "trace_id": trace["trace_id"], "name": trace["name"],
+                                "status": trace["status"], "duration_ms": round(1000 * trace["duration"], 2),
+                                "spans": len(trace["spans"])}))
+
+    @contextmanager
+    def span(self, name: str, **attrs) -> Iterator[Dict[str, Any]]:
+        parent = _current_span.get()
+        span = {"name": name, "span_id": os.urandom(4).hex(), "parent_id": parent["span_id"] if parent else None,
+                "attrs": dict(attrs)}
+        token = _current_span.set(span)
+        started = time.perf_counter()
+        span["start"] = time.time()
+        try:
+            yield span
+        except Exception as e:
+            span["error"] = str(e)
+            raise
+        finally:
+            span["duration"] = time.perf_counter() - started
+            _current_span.reset(token)
+            self._finish(span)
+
+    def record_llm(self, span: Dict[str, Any], agent: str, stats: Optional[Dict[str, Any]]):
+        #the timing fields ollama sends with its final response, so slow spans can be split into load/prompt/decode
+        if not stats:
+            return
+        span["attrs"]["llm"] = {field: stats.get(field) for field in LLM_DURATIONS + LLM_COUNTS + ("cached",)}
+        self.metrics.inc("macsql_llm_calls_total", agent=agent, cached=str(bool(stats.get("cached"))).lower())
+        for field in LLM_COUNTS:
+            if stats.get(field):
+                self.metrics.inc(f"macsql_llm_{field}_total", stats[field], agent=agent)
+        for field in LLM_DURATIONS:
+            if stats.get(field):
+                self.metrics.observe(f"macsql_llm_{field}_seconds", stats[field] / 1e9, agent=agent)
+
+    def _finish(self, span: Dict[str, Any]):
+        trace = _current_trace.get()
+        if trace is not None:
+            trace["spans"].append(span)
+        self.metrics.observe("macsql_stage_seconds", span["duration"], stage=span["name"])
+        if "error" in span:
+            self.metrics.inc("macsql_stage_errors_total", stage=span["name"])
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps({"event": "span", "trace_id": trace["trace_id"] if trace else None,
+                                     "name": span["name"], "duration_ms": round(1000 * span["duration"], 2),
+                                     "attrs": span["attrs"]}, default=str))
+
+
+@contextmanager
+def profile_block(top: int = 25) -> Iterator[Dict[str, Any]]:
+    #cProfile plus tracemalloc around one query, expensive so only when asked for
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    report: Dict[str, Any] = {}
+    profiler = cProfile.Profile()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    profiler.enable()
+    try:
+        yield report
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(top)
+        report["cprofile"] = out.getvalue()
+        report["tracemalloc"] = {
+            "current_bytes": current,
+            "peak_bytes": peak,
+            "top": [str(stat) for stat in snapshot.statistics("lineno")[:top // 2]],
+        }
@@ -0,0 +1,321 @@
+import bisect
+import difflib
+import gzip
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from typing import List, Dict, Any, Optional, Tuple
+
+from .connection_pool import SQLiteConnectionPool
+from .schema_extractor import SchemaCatalog
+
+
+logger = logging.getLogger(__name__)
+
+
+FORMAT_VERSION = 1
+TEXT_TYPES = ("CHAR", "TEXT", "CLOB", "VARCHAR")
+
+#column = 'literal' with an optional table or alias qualifier
+_COMPARISON = re.compile(
+    r"(?:\b(\w+)\.)?\b(\w+)\s*(=|!=|<>|\bLIKE\b)\s*'((?:[^']|'')*)'",
+    re.IGNORECASE
+)
+_TABLE_REF = re.compile(r"\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_NOT_ALIASES = {"where", "join", "on", "inner", "left", "right", "outer", "cross", "group", "order", "limit", "natural", "using", "union"}
+
+
+def _is_text_column(col: Dict[str, Any]) -> bool:
+    col_type = (col["type"] or "").upper()
+    return col_type == "" or any(t in col_type for t in TEXT_TYPES)
+
+
+def _trigrams(value: str) -> set:
+    padded = f"  {value} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _fold(value: str) -> str:
+    #the only differences a literal may be rewritten across: case and runs of whitespace
+    return " ".join(value.lower().split())
+
+
+def _empty_lookups() -> Dict[str, Any]:
+    return {
+        "columns": {},  #table.column -> values
+        "sorted": {},  #table.column -> [(lowered, value)]
+        "exact": defaultdict(list),  #folded value -> [(table.column, value)]
+        "all_values": [],  #[(table.column, value, lowered)]
+        "grams": defaultdict(list),  #trigram -> positions in all_values
+    }
+
+
+class ValueIndex:
+    def __init__(self,
+                 database_path: str,
+                 pool: Optional[SQLiteConnectionPool] = None,
+                 index_path: Optional[str] = None,  #defaults to a file next to the database
+                 max_distinct: int = 200,  #columns with more distinct values than this are not categorical
+                 sample_rows: int = 50000,  #only this many rows are scanned per column on big tables
+                 max_value_length: int = 80,
+                 refresh_interval: float = 30.0):  #seconds between checks for changed data, schema changes rebuild right away
+        self.database_path = database_path
+        self.pool = pool or SQLiteConnectionPool(database_path)
+        self.index_path = index_path or f"{database_path}.values.json.gz"
+        self.max_distinct = max_distinct
+        self.sample_rows = sample_rows
+        self.max_value_length = max_value_length
+        self.refresh_interval = refresh_interval
+
+        #table -> {"signature": [...], "columns": {column: [values]}}
+        self.tables: Dict[str, Dict[str, Any]] = {}
+        self.fingerprint: Optional[str] = None
+        self.data_version: Optional[int] = None
+        self._checked_at: Optional[float] = None
+        self._watch: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()  #one build at a time
+        self._lookup_lock = threading.Lock()
+        self._lookups = _empty_lookups()
+
+    def _table_signature(self, conn: sqlite3.Connection, table_name: str, table_sql: str) -> List[Any]:
+        #max(rowid) is a single btree seek, good enough to notice appends without a count(*)
+        try:
+            max_rowid = conn.execute(f'SELECT MAX(rowid) FROM "{table_name}"').fetchone()[0]
+        except sqlite3.OperationalError:
+            max_rowid = None  #WITHOUT ROWID table, only schema changes will trigger a rebuild
+        return [table_sql, max_rowid]
+
+    def _scan_table(self, conn: sqlite3.Connection, table_name: str, columns: List[str]) -> Dict[str, List[str]]:
+        found = {}
+        for col in columns:
+            rows = conn.execute(
+                f'SELECT DISTINCT "{col}" FROM (SELECT "{col}" FROM "{table_name}" LIMIT ?) '
+                f'WHERE "{col}" IS NOT NULL AND typeof("{col}") = \'text\' LIMIT ?',
+                (self.sample_rows, self.max_distinct + 1)
+            ).fetchall()
+            if not rows or len(rows) > self.max_distinct:
+                continue
+            values = [row[0] for row in rows if 0 < len(row[0]) <= self.max_value_length]
+            if values:
+                found[col] = sorted(values)
+        return found
+
+    def refresh(self, catalog: SchemaCatalog) -> Optional[Dict[str, Any]]:
+        #None when nothing was checked, a schema change always builds, data changes are looked for every refresh_interval
+        now = time.monotonic()
+        recent = self._checked_at is not None and now - self._checked_at < self.refresh_interval
+        if recent and self.fingerprint == catalog.fingerprint():
+            return None
+        self._checked_at = now
+        return self.build(catalog)
+
+    def _data_version(self) -> Optional[int]:
+        #data_version is per connection and only moves for commits from other connections, so one stays open for it
+        try:
+            if self._watch is None:
+                self._watch = self.pool.open_dedicated()
+            return self._watch.execute("PRAGMA data_version").fetchone()[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Value index cannot watch for data changes: {e}")
+            return None
+
+    def build(self, catalog: SchemaCatalog) -> Dict[str, Any]:
+        with self._lock:
+            if not self.tables:
+                self._load()
+
+            #max(rowid) only notices appends, a moved data_version means updates or deletes could be anywhere.
+            #read before scanning so a commit that lands mid scan is picked up next time
+            version = self._data_version()
+            rescan_all = None not in (version, self.data_version) and version != self.data_version
+
+            rebuilt = removed = 0
+            with self.pool.connection() as conn:
+                for table_name in list(self.tables):
+                    if table_name not in catalog.tables:
+                        del self.tables[table_name]
+                        removed += 1
+
+                for table_name, table_schema in catalog.tables.items():
+                    signature = self._table_signature(conn, table_name, catalog.table_sql.get(table_name, ""))
+                    cached = self.tables.get(table_name)
+                    if cached is not None and cached["signature"] == signature and not rescan_all:
+                        continue
+
+                    text_columns = [col["name"] for col in table_schema["columns"] if _is_text_column(col)]
+                    self.tables[table_name] = {
+                        "signature": signature,
+                        "columns": self._scan_table(conn, table_name, text_columns)
+                    }
+                    rebuilt += 1
+
+            fingerprint = catalog.fingerprint()
+            if rebuilt or removed or self.fingerprint is None:
+                self._index_lookups()
+            self.fingerprint = fingerprint
+            self.data_version = version
+            if rebuilt:
+                self._save()
+
+            return {"tables": len(self.tables), "rebuilt": rebuilt, "values": len(self._current()["all_values"])}
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with gzip.open(self.index_path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == FORMAT_VERSION:
+                self.tables = data["tables"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Ignoring unreadable value index {self.index_path}: {e}")
+
+    def _save(self):
+        #write then rename so a crash never leaves half an index behind
+        tmp_path = f"{self.index_path}.tmp"
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump({"version": FORMAT_VERSION, "tables": self.tables}, f, separators=(",", ":"))
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.warning(f"Could not save value index to {self.index_path}: {e}")
+
+    def _index_lookups(self):
+        #built off to the side and swapped in whole, query threads keep reading the previous one meanwhile
+        lookups = _empty_lookups()
+        for table_name, entry in self.tables.items():
+            for col, values in entry["columns"].items():
+                key = f"{table_name}.{col}"
+                lookups["columns"][key] = values
+                lookups["sorted"][key] = sorted((v.lower(), v) for v in values)
+                for value in values:
+                    lookups["exact"][_fold(value)].append((key, value))
+                    pos = len(lookups["all_values"])
+                    lookups["all_values"].append((key, value, value.lower()))
+                    for gram in _trigrams(value.lower()):
+                        lookups["grams"][gram].append(pos)
+        with self._lookup_lock:
+            self._lookups = lookups
+
+    def _current(self) -> Dict[str, Any]:
+        with self._lookup_lock:
+            return self._lookups
+
+    def has_column(self, column: str) -> bool:
+        return column in self._current()["columns"]
+
+    def exact(self, value: str, column: Optional[str] = None) -> List[Tuple[str, str]]:
+        return self._exact_in(self._current(), value, column)
+
+    def _exact_in(self, lookups: Dict[str, Any], value: str, column: Optional[str]) -> List[Tuple[str, str]]:
+        matches = lookups["exact"].get(_fold(value), [])
+        if column is not None:
+            matches = [m for m in matches if m[0] == column]
+        return matches
+
+    def prefix(self, prefix: str, column: str, limit: int = 10) -> List[str]:
+        entries = self._current()["sorted"].get(column, [])
+        needle = prefix.lower()
+        start = bisect.bisect_left(entries, (needle, ""))
+        found = []
+        for lowered, value in entries[start:]:
+            if not lowered.startswith(needle) or len(found) >= limit:
+                break
+            found.append(value)
+        return found
+
+    def fuzzy(self, value: str, column: Optional[str] = None, limit: int = 5, cutoff: float = 0.75) -> List[Tuple[str, str, float]]:
+        return self._fuzzy_in(self._current(), value, column, limit, cutoff)
+
+    def _fuzzy_in(self, lookups: Dict[str, Any], value: str, column: Optional[str], limit: int, cutoff: float) -> List[Tuple[str, str, float]]:
+        needle = value.lower()
+        if column is not None:
+            candidates = [(column, v, v.lower()) for v in lookups["columns"].get(column, [])]
+        else:
+            #trigram overlap narrows things down before the expensive ratio
+            counts: Dict[int, int] = defaultdict(int)
+            for gram in _trigrams(needle):
+                for pos in lookups["grams"].get(gram, ()):
+                    counts[pos] += 1
+            best = sorted(counts, key=counts.get, reverse=True)[:200]
+            candidates = [lookups["all_values"][pos] for pos in best]
+
+        scored = []
+        for key, original, lowered in candidates:
+            ratio = difflib.SequenceMatcher(None, needle, lowered).ratio()
+            if ratio >= cutoff:
+                scored.append((key, original, ratio))
+        scored.sort(key=lambda m: m[2], reverse=True)
+        return scored[:limit]
+
+    def hints_for_columns(self, columns: List[str], max_values: int = 12) -> str:
+        known = self._current()["columns"]
+        lines = []
+        for column in columns:
+            values = known.get(column)
+            if not values:
+                continue
+            shown = ", ".join("'" + v.replace("'", "''") + "'" for v in values[:max_values])
+            more = f" (+{len(values) - max_values} more)" if len(values) > max_values else ""
+            lines.append(f"{column}: {shown}{more}")
+        return "\n".join(lines)
+
+    def ground_literals(self, sql: str, catalog: SchemaCatalog) -> Tuple[str, List[Dict[str, Any]]]:
+        #fix literals that only differ by case or whitespace, suggest the rest. the index only saw a sample of
+        #each table, a literal close to a sampled value may well be a real value that just wasnt sampled.
+        #one snapshot for the whole query, a rebuild may swap in new lookups halfway through
+        lookups = self._current()
+        known = lookups["columns"]
+        names = {t.lower(): t for t in catalog.tables}
+        aliases: Dict[str, str] = {}
+        for table_ref, alias in _TABLE_REF.findall(sql):
+            table_name = names.get(table_ref.lower())
+            if table_name is None:
+                continue
+            aliases[table_name.lower()] = table_name
+            if alias and alias.lower() not in _NOT_ALIASES:
+                aliases[alias.lower()] = table_name
+        tables_in_query = sorted(set(aliases.values()))
+        notes = []
+
+        def resolve(qualifier: Optional[str], col: str) -> List[str]:
+            if qualifier:
+                table_name = aliases.get(qualifier.lower())
+                return [f"{table_name}.{col}"] if table_name and f"{table_name}.{col}" in known else []
+            return [f"{t}.{col}" for t in tables_in_query if f"{t}.{col}" in known]
+
+        def fix(match: "re.Match") -> str:
+            qualifier, col, operator = match.group(1), match.group(2), match.group(3)
+            literal = match.group(4).replace("''", "'")
+            if operator.upper() == "LIKE":
+                return match.group(0)  #patterns are the model's business
+            keys = resolve(qualifier, col)
+            if len(keys) != 1:
+                return match.group(0)
+            key = keys[0]
+            if literal in known[key]:
+                return match.group(0)
+
+            exact = self._exact_in(lookups, literal, key)
+            if len(exact) != 1:
+                close = self._fuzzy_in(lookups, literal, key, limit=3, cutoff=0.75)
+                if close:
+                    notes.append({"column": key, "literal": literal, "suggestions": [c[1] for c in close]})
+                return match.group(0)
+            replacement = exact[0][1]
+            notes.append({"column": key, "literal": literal, "replaced_with": replacement})
+            escaped = replacement.replace("'", "''")
+            return match.group(0)[:match.start(4) - match.start(0)] + escaped + "'"
+
+        return _COMPARISON.sub(fix, sql), notes
+
+    def close(self):
+        with self._lock:
+            if self._watch is not None:
+                self._watch.close()
+                self._watch = None
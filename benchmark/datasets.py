@@ -0,0 +1,62 @@
+import os
+import random
+import sqlite3
+from typing import List, Dict, Any
+
+from backend.fewshot_store import parse_examples
+
+
+NOUNS = ["account", "invoice", "shipment", "vendor", "ticket", "employee", "project", "device",
+         "payment", "region", "store", "warehouse", "campaign", "contract", "asset", "station"]
+
+
+def load_questions(path: str) -> List[str]:
+    #the example files hold Question/SQL pairs, only the questions are needed here
+    with open(path, encoding="utf-8") as f:
+        return [example["question"] for example in parse_examples(f.read())]
+
+
+def sample_database(path: str) -> str:
+    #the e-commerce database exampledb-training.txt was written against
+    from create_sample_db import create_sample_database
+
+    if not os.path.exists(path):
+        create_sample_database(path)
+    return path
+
+
+def generate_database(path: str, tables: int = 20, rows: int = 2000, seed: int = 0) -> Dict[str, Any]:
+    #wide schemas to see how the selector prompt and schema pruning scale, each table points at the one before it
+    rng = random.Random(seed)
+    if os.path.exists(path):
+        os.remove(path)
+
+    names = [f"{NOUNS[i % len(NOUNS)]}_{i}" for i in range(tables)]
+    conn = sqlite3.connect(path)
+    for i, table_name in enumerate(names):
+        parent = f", {names[i - 1]}_id INTEGER REFERENCES {names[i - 1]}({names[i - 1]}_id)" if i else ""
+        conn.execute(
+            f"CREATE TABLE {table_name} ({table_name}_id INTEGER PRIMARY KEY, name TEXT, category TEXT, "
+            f"amount REAL, created_at TEXT{parent})"
+        )
+        values = []
+        for row_id in range(1, rows + 1):
+            row = [row_id, f"{table_name} {row_id}", rng.choice(["alpha", "beta", "gamma", "delta"]),
+                   round(rng.uniform(1, 1000), 2), f"2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"]
+            if i:
+                row.append(rng.randint(1, rows))
+            values.append(row)
+        placeholders = ", ".join("?" * len(values[0]))
+        conn.executemany(f"INSERT INTO {table_name} VALUES ({placeholders})", values)
+    conn.commit()
+    conn.close()
+
+    questions = []
+    for table_name in names:
+        noun = table_name.replace("_", " ")
+        questions.extend([
+            f"How many {noun} records are there?",
+            f"What is the total amount for {noun} in the beta category?",
+            f"Which {noun} has the highest amount?",
+        ])
+    return {"path": path, "tables": tables, "rows": rows, "questions": questions}
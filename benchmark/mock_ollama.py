@@ -0,0 +1,187 @@
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional, Callable
+
+from backend.llm_recording import LLMRecording, payload_key
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  #the default of 5 stalls concurrency runs on connect
+
+
+_COLUMN_LINE = re.compile(r"^\s*(\w+)\.(\w+)\s*$", re.MULTILINE)
+_WORDS = re.compile(r"[a-z0-9]+")
+
+
+def synthetic_answer(payload: Dict[str, Any]) -> str:
+    #stand in for a model when nothing was recorded, good enough to keep the pipeline moving
+    system = payload.get("system") or ""
+    prompt = payload.get("prompt", "")
+    columns = _COLUMN_LINE.findall(prompt)
+    if not columns:
+        return "SELECT 1;"
+
+    if "schema analyzer" in system:
+        question = prompt[prompt.rfind("QUESTION"):] if "QUESTION" in prompt else prompt
+        words = set(_WORDS.findall(question.lower()))
+        tables = {}
+        for table_name, column in columns:
+            tables.setdefault(table_name, []).append(column)
+        best = max(tables, key=lambda t: len(words & set(_WORDS.findall(" ".join([t] + tables[t]).lower()))))
+        return "\n".join(f"{best}.{column}" for column in tables[best])
+
+    return f"SELECT COUNT(*) FROM {columns[0][0]};"
+
+
+class MockOllamaServer:
+    def __init__(self,
+                 host: str = "127.0.0.1",
+                 port: int = 0,  #0 picks a free port, see .url
+                 recording_path: Optional[str] = None,
+                 latency: float = 0.0,  #seconds before the first byte of every generate call
+                 tokens_per_second: Optional[float] = None,  #paces streamed responses, None sends them at once
+                 models: tuple = ("codellama:13b",),
+                 fallback: Optional[Callable[[Dict[str, Any]], str]] = synthetic_answer):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.models = models
+        self.fallback = fallback
+        self.recording = LLMRecording(recording_path, mode="replay") if recording_path else None
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.replayed = 0
+        self.synthesized = 0
+
+        self.httpd = _Server((host, port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockOllamaServer":
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"requests": self.requests, "replayed": self.replayed, "synthesized": self.synthesized}
+
+    def respond(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self.requests += 1
+        if self.recording is not None:
+            recorded = self.recording.lookup(payload_key(payload))
+            if recorded is not None:
+                with self._lock:
+                    self.replayed += 1
+                return dict(recorded)
+        if self.fallback is None:
+            return {"error": "no recorded response for this prompt"}
+        with self._lock:
+            self.synthesized += 1
+        text = self.fallback(payload)
+        return {"response": text, "prompt_eval_count": len(payload.get("prompt", "")) // 4, "eval_count": len(text) // 4}
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status: int, body: Dict[str, Any]):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/api/tags":
+                    self._send_json(200, {"models": [{"name": name} for name in server.models]})
+                else:
+                    self._send_json(404, {"error": "not found"})
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                if self.path != "/api/generate":
+                    self._send_json(404, {"error": "not found"})
+                    return
+
+                started = time.monotonic()
+                time.sleep(server.latency)
+                result = server.respond(payload)
+                if "error" in result:
+                    self._send_json(500, result)
+                    return
+                result.setdefault("model", payload.get("model"))
+                result["done"] = True
+                if result.get("total_duration") is None:
+                    result["total_duration"] = int((time.monotonic() - started) * 1e9)
+
+                if not payload.get("stream"):
+                    self._send_json(200, result)
+                    return
+                self._stream(result)
+
+            def _stream(self, result: Dict[str, Any]):
+                #ndjson over chunked encoding, four characters a token like a small model
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                text = result.pop("response")
+                delay = 1.0 / server.tokens_per_second if server.tokens_per_second else 0.0
+                try:
+                    for i in range(0, len(text), 4):
+                        self._chunk({"response": text[i:i + 4], "done": False})
+                        if delay:
+                            time.sleep(delay)
+                    self._chunk({"response": "", **result})
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  #client hung up once it had a full statement
+
+            def _chunk(self, body: Dict[str, Any]):
+                line = (json.dumps(body) + "\n").encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Ollama API")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--recording", help="JSONL file written by an OllamaClient in record mode")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--tokens-per-second", type=float)
+    args = parser.parse_args()
+
+    server = MockOllamaServer(port=args.port, recording_path=args.recording,
+                              latency=args.latency, tokens_per_second=args.tokens_per_second)
+    print(f"Mock Ollama listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
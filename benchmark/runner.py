@@ -0,0 +1,219 @@
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+
+from backend.mac_sql import MACSQL
+from backend.llm_recording import LLMRecording
+from benchmark.datasets import load_questions, sample_database, generate_database
+from benchmark.mock_ollama import MockOllamaServer
+
+try:
+    import resource
+except ImportError:  #windows
+    resource = None
+
+
+#MACSQL attributes timed as pipeline stages
+STAGES = {
+    "schema": ("schema_extractor", "get_catalog"),
+    "selector": ("selector", "process"),
+    "decomposer": ("decomposer", "process"),
+    "validate": ("validator", "validate_query"),
+    "repair": ("repairer", "repair"),
+    "refiner": ("refiner", "process"),
+    "execute": ("validator", "execute_query"),
+}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    pos = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[pos]
+
+
+def summarize(values: List[float]) -> Dict[str, Any]:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean_ms": 1000 * sum(values) / len(values),
+        "p50_ms": 1000 * percentile(values, 50),
+        "p90_ms": 1000 * percentile(values, 90),
+        "p99_ms": 1000 * percentile(values, 99),
+        "max_ms": 1000 * max(values),
+    }
+
+
+class StageTimer:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def instrument(self, mac: MACSQL):
+        #wraps the instance methods only, the classes are left alone
+        for stage, (attr, method) in STAGES.items():
+            target = getattr(mac, attr)
+            original = getattr(target, method)
+
+            def timed(*args, _original=original, _stage=stage, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return _original(*args, **kwargs)
+                finally:
+                    self.add(_stage, time.perf_counter() - started)
+
+            setattr(target, method, timed)
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {stage: summarize(values) for stage, values in self.samples.items()}
+
+
+def max_rss_kb() -> Optional[int]:
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_level(db_path: str, questions: List[str], concurrency: int, ollama_url: str,
+              mac_kwargs: Dict[str, Any], trace_memory: bool) -> Dict[str, Any]:
+    #fresh engine per level with the answer cache off, so every question runs the whole pipeline
+    mac = MACSQL(db_path, ollama_url=ollama_url, answer_cache_size=0, **mac_kwargs)
+    timer = StageTimer()
+    timer.instrument(mac)
+
+    def run_one(question: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        result = mac.query(question)
+        timer.add("total", time.perf_counter() - started)
+        return result
+
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(run_one, questions))
+    wall = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    executed = [r for r in results if r.get("success") and (r.get("execution_result") or {}).get("success")]
+    llm_calls = [len(r.get("llm_calls", [])) for r in results if r.get("success")]
+    level = {
+        "concurrency": concurrency,
+        "questions": len(questions),
+        "wall_seconds": wall,
+        "throughput_qps": len(questions) / wall if wall else None,
+        "executed_ok": len(executed),
+        "llm_calls_per_question": sum(llm_calls) / len(llm_calls) if llm_calls else None,
+        "refinements_avoided": mac.repairer.stats()["refinements_avoided"],
+        "stages": timer.report(),
+        "peak_traced_bytes": peak,
+        "max_rss_kb": max_rss_kb(),
+    }
+    mac.close()
+    return level
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(datasets: List[Dict[str, Any]], concurrency_levels: List[int], ollama_url: str,
+                  mac_kwargs: Optional[Dict[str, Any]] = None, trace_memory: bool = False) -> Dict[str, Any]:
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "ollama_url": ollama_url,
+        },
+        "datasets": [],
+    }
+    for dataset in datasets:
+        print(f"Benchmarking {dataset['name']} ({len(dataset['questions'])} questions)")
+        levels = []
+        for concurrency in concurrency_levels:
+            level = run_level(dataset["db"], dataset["questions"], concurrency, ollama_url, mac_kwargs or {}, trace_memory)
+            print(f"  concurrency {concurrency}: {level['throughput_qps']:.2f} q/s, "
+                  f"p50 {level['stages']['total']['p50_ms']:.0f} ms")
+            levels.append(level)
+        report["datasets"].append({"name": dataset["name"], "db": dataset["db"],
+                                   "questions": len(dataset["questions"]), "levels": levels})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline MAC-SQL benchmark")
+    parser.add_argument("--out", default="benchmark-results.json")
+    parser.add_argument("--questions", default="exampledb-training.txt")
+    parser.add_argument("--generated-tables", type=int, nargs="*", default=[20, 100],
+                        help="also benchmark generated databases with this many tables")
+    parser.add_argument("--generated-rows", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--ollama", help="use a real Ollama at this URL instead of the mock server")
+    parser.add_argument("--record", help="with --ollama, append every LLM response to this JSONL file")
+    parser.add_argument("--replay", help="serve responses recorded with --record from the mock server")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock server delay per generate call")
+    parser.add_argument("--model", default="codellama:13b")
+    parser.add_argument("--trace-memory", action="store_true", help="tracemalloc peak per level, slows things down")
+    parser.add_argument("--workdir", default=None, help="where databases are created, defaults to a temp dir")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="macsql-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    datasets = [{
+        "name": os.path.basename(args.questions),
+        "db": sample_database(os.path.join(workdir, "sample_ecommerce.db")),
+        "questions": load_questions(args.questions),
+    }]
+    for tables in args.generated_tables:
+        generated = generate_database(os.path.join(workdir, f"generated_{tables}.db"), tables=tables, rows=args.generated_rows)
+        datasets.append({"name": f"generated_{tables}_tables", "db": generated["path"], "questions": generated["questions"]})
+
+    mac_kwargs: Dict[str, Any] = {"model_name": args.model}
+    server = None
+    if args.ollama:
+        ollama_url = args.ollama
+        if args.record:
+            mac_kwargs["llm_recording"] = LLMRecording(args.record, mode="record")
+    else:
+        server = MockOllamaServer(recording_path=args.replay, latency=args.latency, models=(args.model,)).start()
+        ollama_url = server.url
+
+    try:
+        report = run_benchmark(datasets, args.concurrency, ollama_url, mac_kwargs, trace_memory=args.trace_memory)
+    finally:
+        if server is not None:
+            report_server = server.stats()
+            server.stop()
+
+    if server is not None:
+        report["meta"]["mock_server"] = {"latency": args.latency, "replay": args.replay, **report_server}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
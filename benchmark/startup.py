@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List, Dict, Any
+
+
+#every run is a fresh interpreter, otherwise the second run just finds everything in sys.modules
+def cold_start(db_path: str, ollama_url: str, model: str, question: str) -> Dict[str, Any]:
+    proc = subprocess.run([sys.executable, "-m", "benchmark.startup", "--child", "--db", db_path,
+                           "--ollama", ollama_url, "--model", model, "--question", question],
+                          capture_output=True, text=True, check=True)
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def child(args):
+    started = time.perf_counter()
+    before = set(sys.modules)
+    from backend.mac_sql import MACSQL
+    imported = time.perf_counter()
+    import_modules = len(set(sys.modules) - before)
+
+    mac = MACSQL(args.db, model_name=args.model, ollama_url=args.ollama)
+    initialized = time.perf_counter()
+    result = mac.query(args.question)
+    answered = time.perf_counter()
+    mac.close()
+
+    print(json.dumps({
+        "import_ms": 1000 * (imported - started),
+        "init_ms": 1000 * (initialized - imported),
+        "first_query_ms": 1000 * (answered - initialized),
+        "time_to_first_answer_ms": 1000 * (answered - started),
+        "import_modules": import_modules,
+        "total_modules": len(sys.modules),
+        "heavy_modules_loaded": [m for m in ("asyncio", "requests", "sqlparse", "numpy", "ssl") if m in sys.modules],
+        "success": result["success"],
+    }))
+
+
+def import_profile(module: str, top: int) -> List[Dict[str, Any]]:
+    #python -X importtime writes "import time: self | cumulative | name" lines to stderr
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          capture_output=True, text=True, check=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append({"module": name.strip(), "depth": (len(name) - len(name.lstrip())) // 2,
+                     "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    rows.sort(key=lambda row: row["cumulative_ms"], reverse=True)
+    return rows[:top]
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Any]:
+    fields = ("import_ms", "init_ms", "first_query_ms", "time_to_first_answer_ms")
+    return {field: {"median": statistics.median(r[field] for r in runs),
+                    "min": min(r[field] for r in runs),
+                    "max": max(r[field] for r in runs)} for field in fields}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MAC-SQL cold start benchmark")
+    parser.add_argument("--out", default="startup-results.json")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=20, help="slowest imports to keep from -X importtime")
+    parser.add_argument("--question", default="How many customers are there?")
+    parser.add_argument("--model", default="codellama:13b")
+    parser.add_argument("--workdir", default=None, help="where the sample database is created, defaults to a temp dir")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    parser.add_argument("--ollama", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    #imported here, the runner pulls in backend and the child has to start without it
+    from benchmark.datasets import sample_database
+    from benchmark.mock_ollama import MockOllamaServer
+    from benchmark.runner import git_commit
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="macsql-startup-")
+    os.makedirs(workdir, exist_ok=True)
+    db_path = sample_database(os.path.join(workdir, "sample_ecommerce.db"))
+
+    server = MockOllamaServer(models=(args.model,)).start()
+    try:
+        runs = []
+        for n in range(args.runs):
+            run = cold_start(db_path, server.url, args.model, args.question)
+            print(f"  run {n + 1}: import {run['import_ms']:.0f} ms, init {run['init_ms']:.0f} ms, "
+                  f"first answer {run['time_to_first_answer_ms']:.0f} ms")
+            runs.append(run)
+    finally:
+        server.stop()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+        },
+        "summary": summarize(runs),
+        "runs": runs,
+        "imports": import_profile("backend.mac_sql", args.top),
+    }
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 
 
+import logging
 import sys
 import os
 
@@ -8,12 +9,16 @@ from create_sample_db import create_sample_database
 
 
 def main():
+    #pipeline progress goes through logging now, show it like the old prints
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     print("Creating sample database...")
     db_path = create_sample_database("example.db")
     
     #init MAC-SQL
     print("Initializing MAC-SQL...")
-    mac = MACSQL(database_path=db_path, model_name="codellama:13b") #can change model here if pleased
+    #stream tokens to the terminal as they arrive, generation stops once the sql is complete
+    mac = MACSQL(database_path=db_path, model_name="codellama:13b", #can change model here if pleased
+                 stream=True, on_token=lambda token: print(token, end="", flush=True))
     
     status = mac.test_connection()
     print(f"Connection status: {status}")
@@ -61,13 +66,13 @@ def main():
                     
                     if results:
                         # Show column headers
-                        headers = list(results[0].keys())
+                        headers = result["execution_result"]["column_names"]
                         print("  " + " | ".join(headers))
                         print("  " + "-" * (len(" | ".join(headers))))
                         
                         # Show first few rows
                         for row in results[:10]:  # Limit to 10 rows
-                            values = [str(row[h]) for h in headers]
+                            values = [str(v) for v in row]
                             print("  " + " | ".join(values))
                         
                         if len(results) > 10:
@@ -0,0 +1,25 @@
+from backend.answer_cache import AnswerCache, normalize_question
+
+
+def test_case_whitespace_and_trailing_punctuation_fold():
+    assert normalize_question("Top 5 customers?") == normalize_question("top 5   customers")
+    assert normalize_question("List orders, by date.") == normalize_question("list orders by date")
+
+
+def test_comparison_operators_are_kept():
+    assert normalize_question("customers with balance > 100") != normalize_question("customers with balance < 100")
+    assert normalize_question("orders where total = 100") != normalize_question("orders where total 100")
+    assert normalize_question("orders where total >= 100") != normalize_question("orders where total > 100")
+
+
+def test_signs_and_decimals_are_kept():
+    assert normalize_question("accounts with balance -5") != normalize_question("accounts with balance 5")
+    assert normalize_question("products rated 1.5") != normalize_question("products rated 15")
+    assert normalize_question("products rated 1.5?") == normalize_question("products rated 1.5")
+
+
+def test_cache_keeps_operator_variants_apart():
+    cache = AnswerCache()
+    cache.put("customers with balance > 100", "fp", {"sql": "SELECT * FROM c WHERE balance > 100"})
+    assert cache.get("customers with balance < 100", "fp") is None
+    assert cache.get("Customers with balance > 100?", "fp")["sql"].endswith("> 100")
@@ -0,0 +1,32 @@
+import asyncio
+import threading
+
+from backend.mac_sql import MACSQL
+from benchmark.datasets import sample_database
+from benchmark.mock_ollama import MockOllamaServer
+
+
+def test_blocking_steps_stay_off_the_event_loop(tmp_path):
+    server = MockOllamaServer().start()
+    #pruning to two tables forces a schema index build, value_index a value scan
+    mac = MACSQL(sample_database(str(tmp_path / "sample.db")), ollama_url=server.url,
+                 value_index=True, schema_prune_top_k=2)
+    loop_thread = threading.get_ident()
+    on_loop = []
+    for name in ("_columns_for_question", "_get_value_index"):
+        original = getattr(mac, name)
+
+        def watched(*args, _original=original, _name=name):
+            if threading.get_ident() == loop_thread:
+                on_loop.append(_name)
+            return _original(*args)
+        setattr(mac, name, watched)
+
+    try:
+        result = asyncio.run(mac.aquery("How many customers are there?"))
+    finally:
+        mac.close()
+        server.stop()
+
+    assert result["success"]
+    assert not on_loop
@@ -0,0 +1,64 @@
+import pytest
+
+from backend.mac_sql import MACSQL
+from benchmark.datasets import sample_database
+from benchmark.mock_ollama import MockOllamaServer
+
+QUESTIONS = ["How many customers are there?", "List all products", "Show recent orders"]
+
+
+@pytest.fixture
+def engine(tmp_path):
+    server = MockOllamaServer().start()
+    mac = MACSQL(sample_database(str(tmp_path / "sample.db")), ollama_url=server.url)
+    yield mac
+    mac.close()
+    server.stop()
+
+
+def test_batch_completes_when_a_stage_raises(engine):
+    def broken(inputs):
+        raise RuntimeError("selector down")
+    engine.selector.process = broken
+
+    results = list(engine.query_batch(QUESTIONS))
+    assert sorted(r["index"] for r in results) == [0, 1, 2]
+    assert all(not r["success"] and r["error"] == "selector down" for r in results)
+
+
+def test_batch_completes_when_finishing_raises(engine):
+    def broken(question, fingerprint, entry):
+        raise RuntimeError("cache write failed")
+    engine.answer_cache.put = broken
+
+    results = list(engine.query_batch(QUESTIONS))
+    assert sorted(r["index"] for r in results) == [0, 1, 2]
+    assert any(r.get("error") == "cache write failed" for r in results)
+
+
+@pytest.mark.parametrize("max_attempts", [1, 3])
+def test_budget_cancellation_is_refined_like_query(engine, max_attempts):
+    #the batch stages and query() share one refinement step, a cancelled query takes the same path in both
+    refined = "SELECT COUNT(*) FROM customers"
+    run = engine._execute
+
+    def execute(query):
+        if query != refined:
+            return {"success": False, "error": "Query cancelled: exceeded the row budget", "budget_exceeded": True}
+        return run(query)
+    engine._execute = execute
+    engine.refiner.process = lambda inputs: {"refined_query": refined}
+    engine.max_refinement_attempts = max_attempts
+
+    single = engine.query(QUESTIONS[0])
+    engine.answer_cache.clear()
+    batched = next(iter(engine.query_batch(QUESTIONS[:1])))
+    for result in (single, batched):
+        assert result["tries"] == 1
+        assert [call["agent"] for call in result["llm_calls"]] == ["selector", "decomposer", "refiner"]
+    assert batched["final_sql"] == single["final_sql"] == refined
+    for result in (single, batched):
+        if max_attempts > 1:
+            assert result["execution_result"]["success"] and result["execution_result"]["row_count"] == 1
+        else:
+            assert result["execution_result"] is None
@@ -0,0 +1,65 @@
+import sqlite3
+import time
+
+import pytest
+
+from backend.column_stats import ColumnProfiler
+from backend.connection_pool import SQLiteConnectionPool
+from backend.schema_extractor import SchemaExtractor
+
+
+@pytest.fixture
+def setup(tmp_path):
+    path = str(tmp_path / "events.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE events (id INTEGER PRIMARY KEY, kind TEXT)")
+    conn.executemany("INSERT INTO events (kind) VALUES (?)", [("click",), ("view",), ("buy",)] * 20)
+    conn.commit()
+    conn.close()
+    pool = SQLiteConnectionPool(path)
+    catalog = SchemaExtractor(path, pool=pool).get_catalog()
+    profiler = ColumnProfiler(path, pool=pool, stats_path=str(tmp_path / "stats.json.gz"), poll_interval=0.05)
+    yield profiler, catalog, pool
+    profiler.close()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return condition()
+
+
+def test_worker_restarts_after_it_dies(setup):
+    profiler, catalog, pool = setup
+    open_dedicated = pool.open_dedicated
+
+    def broken():
+        raise sqlite3.OperationalError("disk I/O error")
+    pool.open_dedicated = broken
+    profiler.request(catalog)
+    assert wait_for(lambda: profiler._thread is None)
+    assert profiler.stats()["errors"] == 1
+
+    pool.open_dedicated = open_dedicated
+    profiler.request(catalog)
+    assert wait_for(lambda: "events.kind: 3 values" in profiler.hints_for_columns(["events.kind"]))
+
+
+def test_failed_refresh_is_retried_on_the_next_request(setup):
+    profiler, catalog, pool = setup
+    refresh = profiler._refresh
+    calls = []
+
+    def flaky(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise ValueError("bad sample")
+        return refresh(*args)
+    profiler._refresh = flaky
+
+    profiler.request(catalog)
+    assert wait_for(lambda: profiler.stats()["errors"] == 1)
+    assert profiler.stats()["running"]
+    profiler.request(catalog)
+    assert wait_for(lambda: "events.kind" in profiler.hints_for_columns(["events.kind"]))
@@ -0,0 +1,59 @@
+import threading
+
+from backend.fewshot_store import FewShotStore
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.fail = False
+        self.calls = 0
+        self.barrier = None
+
+    def embed(self, text, model=None):
+        self.calls += 1
+        if self.fail:
+            raise ConnectionError("ollama went away")
+        if self.barrier is not None and text.startswith("concurrent"):
+            #only returns once both questions are inside embed at the same time
+            self.barrier.wait(timeout=5)
+        return [1.0, float(len(text)), float(text.count("customer"))]
+
+
+def make_store(**kwargs):
+    client = FakeEmbedder()
+    store = FewShotStore(client, **kwargs)
+    store.add("How many customers are there?", "SELECT COUNT(*) FROM customers")
+    store.add("List all products", "SELECT * FROM products")
+    return client, store
+
+
+def test_questions_embed_concurrently():
+    client, store = make_store()
+    store.search("warm up the matrix")
+    client.barrier = threading.Barrier(2)
+    results = []
+    threads = [threading.Thread(target=lambda q=q: results.append(store.search(q, k=1)))
+               for q in ("concurrent customers", "concurrent products")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not client.barrier.broken
+    assert len(results) == 2 and store.embeddings_available
+
+
+def test_transient_failure_backs_off_then_retries():
+    client, store = make_store(retry_interval=0.05)
+    client.fail = True
+    assert len(store.search("customers count", k=1)) == 1  #word overlap for this call
+    assert not store.embeddings_available
+
+    calls = client.calls
+    store.search("customers count", k=1)
+    assert client.calls == calls  #still backing off, no embedding call
+
+    client.fail = False
+    threading.Event().wait(0.1)
+    assert store.embeddings_available
+    store.search("customers count", k=1)
+    assert client.calls > calls and store.embeddings_available
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import pytest
+
+from backend.async_llm_client import AsyncOllamaClient
+from backend.llm_client import OllamaClient
+from backend.llm_recording import LLMRecording, payload_key
+from benchmark.mock_ollama import MockOllamaServer
+
+
+@pytest.fixture
+def server():
+    requests = []
+
+    def answer(payload):
+        requests.append(payload)
+        return "SELECT 1;"
+    server = MockOllamaServer(fallback=answer).start()
+    server.requests_seen = requests
+    yield server
+    server.stop()
+
+
+def test_sampling_parameters_go_under_options(server):
+    client = OllamaClient(base_url=server.url)
+    client.generate("question", system="be brief", temperature=0.7)
+    client.generate_stream("question", temperature=0.4, top_p=0.9)
+    client.transport.close()
+
+    first, second = server.requests_seen
+    assert first["options"] == {"temperature": 0.7} and "temperature" not in first
+    assert second["options"] == {"temperature": 0.4, "top_p": 0.9}
+
+
+def test_async_client_sends_options_too(server):
+    client = AsyncOllamaClient(base_url=server.url)
+    asyncio.run(client.generate("question", temperature=1.0))
+    assert server.requests_seen[0]["options"] == {"temperature": 1.0}
+
+
+def test_replay_key_matches_the_client_key():
+    client = OllamaClient()
+    kwargs = {"temperature": 0.4}
+    payload = client._payload("question", "system", False, kwargs)
+    assert payload_key(payload) == LLMRecording.make_key(client.model, "system", "question", kwargs)
+    client.transport.close()
+
+
+def test_stalled_stream_times_out():
+    async def scenario():
+        async def stall(reader, writer):
+            await reader.readuntil(b"\r\n\r\n")
+            writer.write(b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n")
+            line = b'{"response": "SEL", "done": false}\n'
+            writer.write(b"%x\r\n%s\r\n" % (len(line), line))
+            await writer.drain()
+            await asyncio.sleep(30)  #never finishes the stream
+
+        server = await asyncio.start_server(stall, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        client = AsyncOllamaClient(base_url=f"http://127.0.0.1:{port}", timeout=0.3)
+        started = time.monotonic()
+        try:
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client.generate_stream("question"), timeout=5)
+        finally:
+            server.close()
+        return time.monotonic() - started
+    assert asyncio.run(scenario()) < 2
+
+
+def test_async_client_records_and_replays(server, tmp_path):
+    path = str(tmp_path / "session.jsonl")
+    client = AsyncOllamaClient(base_url=server.url, recording=LLMRecording(path, mode="record"))
+    recorded = asyncio.run(client.generate_stream("question", temperature=0.0))
+
+    replaying = AsyncOllamaClient(base_url="http://127.0.0.1:9", recording=LLMRecording(path, mode="replay"))
+    assert asyncio.run(replaying.generate_stream("question", temperature=0.0)) == recorded
+    sync = OllamaClient(base_url="http://127.0.0.1:9", recording=LLMRecording(path, mode="replay"))
+    assert sync.generate_stream("question", temperature=0.0) == recorded
+    sync.transport.close()
+    assert len(server.requests_seen) == 1
@@ -0,0 +1,124 @@
+import math
+import sqlite3
+
+import pytest
+
+from backend.connection_pool import SQLiteConnectionPool
+from backend.plan_guard import DEFAULT_ROWS, PlanCostGuard, parse_plan
+from backend.query_validator import QueryValidator
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "shop.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE customers (customer_id INTEGER PRIMARY KEY, name TEXT)")
+    conn.execute("CREATE TABLE orders (order_id INTEGER PRIMARY KEY, customer_id INTEGER, amount REAL)")
+    conn.executemany("INSERT INTO customers (name) VALUES (?)", [(f"c{i}",) for i in range(200)])
+    conn.executemany("INSERT INTO orders (customer_id, amount) VALUES (?, ?)", [(i % 200 + 1, i) for i in range(2000)])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def guard():
+    return PlanCostGuard(warn_cost=10000, max_cost=100000, large_table_rows=1000)
+
+
+def plan_of(conn, query):
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+    return [{"id": row[0], "parent": row[1], "detail": row[3]} for row in rows]
+
+
+def evaluate(guard, conn, query):
+    return guard.evaluate(plan_of(conn, query), query, conn)
+
+
+def test_parse_plan_rebuilds_the_tree():
+    roots = parse_plan([{"id": 2, "parent": 0, "detail": "CO-ROUTINE s"},
+                        {"id": 8, "parent": 2, "detail": "SCAN a"},
+                        {"id": 42, "parent": 0, "detail": "SCAN s"}])
+    assert [node["detail"] for node in roots] == ["CO-ROUTINE s", "SCAN s"]
+    assert [node["detail"] for node in roots[0]["children"]] == ["SCAN a"]
+
+
+def test_primary_key_lookup_is_accepted(db, guard):
+    result = evaluate(guard, db, "SELECT name FROM customers WHERE customer_id = 5")
+    assert result == {"verdict": "accept", "cost": 1.0, "issues": []}
+
+
+def test_join_on_the_key_is_accepted(db, guard):
+    result = evaluate(guard, db, "SELECT c.name, o.amount FROM orders o JOIN customers c ON c.customer_id = o.customer_id")
+    assert result["verdict"] == "accept"
+    assert result["cost"] == 2000 + 2000 * 1
+    assert [issue["kind"] for issue in result["issues"]] == ["full_scan"]
+
+
+def test_cross_join_is_sent_back(db, guard):
+    result = evaluate(guard, db, "SELECT * FROM customers c, orders o")
+    assert result["verdict"] == "refine"
+    assert result["cost"] == 200 + 200 * 2000
+    assert any(issue["kind"] == "join_scan" and issue["table"] == "orders" for issue in result["issues"])
+    assert guard.error(result).startswith("Query too expensive: estimated 400200 row visits (full scan of orders")
+
+
+def test_validator_rejects_what_the_guard_refines(db, guard):
+    path = db.execute("PRAGMA database_list").fetchone()[2]
+    pool = SQLiteConnectionPool(path)
+    validator = QueryValidator(path, pool=pool, cost_guard=guard)
+    assert validator.validate_query("SELECT * FROM orders WHERE order_id = 1")["is_valid"]
+    check = validator.validate_query("SELECT * FROM customers, orders")
+    assert not check["is_valid"] and check["cost"]["verdict"] == "refine"
+    assert check["error"].startswith("Query too expensive")
+    pool.close()
+
+
+def test_old_and_new_explain_formats_cost_the_same(db, guard):
+    query = "SELECT * FROM orders o JOIN customers c ON c.customer_id = o.customer_id"
+    old = [{"id": 3, "parent": 0, "detail": "SCAN TABLE orders AS o"},
+           {"id": 5, "parent": 0, "detail": "SEARCH TABLE customers AS c USING INTEGER PRIMARY KEY (rowid=?)"}]
+    new = [{"id": 3, "parent": 0, "detail": "SCAN o"},
+           {"id": 5, "parent": 0, "detail": "SEARCH c USING INTEGER PRIMARY KEY (rowid=?)"}]
+    assert guard.evaluate(old, query, db)["cost"] == guard.evaluate(new, query, db)["cost"] == 4000
+
+
+def test_range_search_assumes_a_quarter_of_the_table(db, guard):
+    result = evaluate(guard, db, "SELECT * FROM orders WHERE order_id > 10")
+    assert result["cost"] == 2000 / 4
+
+
+def test_automatic_index_warns(db, guard):
+    query = "SELECT * FROM customers c JOIN orders o ON o.customer_id = c.customer_id"
+    plan = [{"id": 3, "parent": 0, "detail": "SCAN c"},
+            {"id": 5, "parent": 0, "detail": "SEARCH o USING AUTOMATIC COVERING INDEX (customer_id=?)"}]
+    result = guard.evaluate(plan, query, db)
+    assert result["verdict"] == "warn"
+    assert result["cost"] == 200 + 2000 + 200 * 10
+    assert result["issues"][0]["kind"] == "automatic_index"
+
+
+def test_constant_row_falls_back_to_default_rows(db, guard):
+    assert [row["detail"] for row in plan_of(db, "SELECT 1")] == ["SCAN CONSTANT ROW"]
+    result = evaluate(guard, db, "SELECT 1")
+    assert result == {"verdict": "accept", "cost": DEFAULT_ROWS, "issues": []}
+
+
+def test_subquery_scans_fall_back_to_default_rows(db, guard):
+    query = "SELECT * FROM (SELECT customer_id FROM orders GROUP BY customer_id) s"
+    plan = [{"id": 2, "parent": 0, "detail": "CO-ROUTINE s"},
+            {"id": 8, "parent": 2, "detail": "SCAN orders"},
+            {"id": 10, "parent": 2, "detail": "USE TEMP B-TREE FOR GROUP BY"},
+            {"id": 42, "parent": 0, "detail": "SCAN s"}]
+    result = guard.evaluate(plan, query, db)
+    #the co-routine body runs once, the scan over it has no table to count
+    assert result["cost"] == pytest.approx(2000 + 2000 * math.log2(2001) + DEFAULT_ROWS)
+    assert [(issue["kind"], issue["table"]) for issue in result["issues"]] == [("full_scan", "orders"), ("temp_btree", None)]
+
+
+def test_correlated_subquery_runs_per_outer_row(db, guard):
+    query = "SELECT (SELECT COUNT(*) FROM orders o WHERE o.customer_id = c.customer_id) FROM customers c"
+    result = evaluate(guard, db, query)
+    assert result["cost"] == 200 + 200 * 2000
+    assert result["verdict"] == "refine"
+    assert any(issue["kind"] == "correlated_subquery" and issue["severity"] == "warn" for issue in result["issues"])
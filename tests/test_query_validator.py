@@ -0,0 +1,30 @@
+import sqlite3
+
+import pytest
+
+from backend.query_budget import QueryBudget
+from backend.query_validator import QueryValidator
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "numbers.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?)", [(i,) for i in range(3000)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_default_limit_only_applies_when_appended(db):
+    validator = QueryValidator(db)
+    assert validator.execute_query("SELECT x FROM t")["row_count"] == 100
+    result = validator.execute_query("SELECT x FROM t LIMIT 500")
+    assert result["row_count"] == 500 and not result["truncated"]
+
+
+def test_budget_still_caps_an_explicit_limit(db):
+    validator = QueryValidator(db, budget=QueryBudget(max_rows=1000))
+    result = validator.execute_query("SELECT x FROM t LIMIT 2000")
+    assert result["row_count"] == 1000 and result["truncated"]
@@ -0,0 +1,46 @@
+import sqlite3
+
+import pytest
+
+from backend.connection_pool import SQLiteConnectionPool
+from backend.query_validator import QueryValidator
+from backend.result_cache import ResultCache, canonical_sql
+
+
+@pytest.fixture
+def validator(tmp_path):
+    path = str(tmp_path / "people.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE t (Name TEXT, age INTEGER)")
+    conn.executemany("INSERT INTO t VALUES (?, ?)", [("Ann", 30), ("Bob", 40)])
+    conn.commit()
+    conn.close()
+    pool = SQLiteConnectionPool(path)
+    validator = QueryValidator(path, pool=pool, result_cache=ResultCache(path, pool=pool))
+    yield validator
+    validator.result_cache.close()
+    validator.pool.close()
+
+
+def test_unqualified_column_case_is_part_of_the_key():
+    assert canonical_sql("select Name from t") != canonical_sql("select name from t")
+
+
+def test_queries_differing_only_in_column_case_do_not_share_results(validator):
+    first = validator.execute_query("select Name from t")
+    second = validator.execute_query("select name from t")
+    assert not first["result_cache_hit"] and not second["result_cache_hit"]
+    assert validator.execute_query("SELECT  Name FROM t")["result_cache_hit"]
+
+
+def test_qualified_column_case_and_aliases_still_hit(validator):
+    validator.execute_query("select p.Name from t p where p.age > 35")
+    result = validator.execute_query("SELECT x.NAME FROM t AS x WHERE x.age > 35")
+    assert result["result_cache_hit"]
+    assert result["column_names"] == ["Name"] and result["row_count"] == 1
+
+
+def test_literals_and_output_expressions_stay_distinct():
+    assert canonical_sql("select age from t where Name = 'Ann'") != canonical_sql("select age from t where Name = 'ann'")
+    assert canonical_sql("select count(*) from t") != canonical_sql("select COUNT(*) from t")
+    assert canonical_sql("delete from t") is None
@@ -0,0 +1,33 @@
+import time
+
+from backend.mac_sql import MACSQL
+from benchmark.datasets import sample_database
+from benchmark.mock_ollama import MockOllamaServer, synthetic_answer
+
+
+def slow_hot_candidates(payload):
+    #the deterministic candidate answers at once, the hot ones ramble for seconds before any sql
+    text = synthetic_answer(payload)
+    if payload.get("options", {}).get("temperature"):
+        return "Let me think about this carefully. " * 60 + text
+    return text
+
+
+def test_losing_candidates_free_their_workers(tmp_path):
+    server = MockOllamaServer(tokens_per_second=100, fallback=slow_hot_candidates).start()
+    mac = MACSQL(sample_database(str(tmp_path / "sample.db")), ollama_url=server.url,
+                 speculative_candidates=3, stream=True)
+    try:
+        started = time.perf_counter()
+        first = mac.query("How many customers are there?")
+        second = mac.query("How many products are there?")
+        #close waits for every candidate worker, abandoned ones must already have hung up
+        mac.close()
+        elapsed = time.perf_counter() - started
+    finally:
+        server.stop()
+
+    assert first["success"] and second["success"]
+    #a hot candidate alone streams for about five seconds
+    assert elapsed < 3
+    assert first["speculation"]["abandoned"] > 0
@@ -0,0 +1,85 @@
+import sqlite3
+
+import pytest
+
+from backend.connection_pool import SQLiteConnectionPool
+from backend.query_validator import QueryValidator
+from backend.schema_extractor import SchemaExtractor
+from backend.sql_repair import SQLRepairer
+
+
+@pytest.fixture
+def shop(tmp_path):
+    path = str(tmp_path / "shop.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE customers (customer_id INTEGER PRIMARY KEY, name TEXT, state TEXT)")
+    conn.execute("CREATE TABLE orders (order_id INTEGER PRIMARY KEY, "
+                 "customer_id INTEGER REFERENCES customers(customer_id), amount REAL)")
+    conn.commit()
+    conn.close()
+    pool = SQLiteConnectionPool(path)
+    validator = QueryValidator(path, pool=pool)
+    catalog = SchemaExtractor(path, pool=pool).get_catalog()
+    yield SQLRepairer(validator), validator, catalog
+    pool.close()
+
+
+def repair(shop, sql, question=""):
+    repairer, validator, catalog = shop
+    check = validator.validate_query(sql)
+    assert not check["is_valid"]
+    return repairer.repair(sql, check["error"], catalog, question)
+
+
+def test_misspelled_column_is_fixed(shop):
+    result = repair(shop, "SELECT nme FROM customers WHERE state = 'nme'")
+    assert result["sql"] == "SELECT name FROM customers WHERE state = 'nme'"
+    assert result["check"]["is_valid"]
+    assert result["fixes"] == [{"rule": "column_name", "from": "nme", "to": "name"}]
+
+
+def test_misspelled_table_is_fixed(shop):
+    result = repair(shop, "SELECT customer.name FROM customer")
+    assert result["sql"] == "SELECT customers.name FROM customers"
+    assert result["fixes"][0]["rule"] == "table_name"
+
+
+def test_broken_join_key_is_rebuilt_from_the_foreign_key(shop):
+    result = repair(shop, "SELECT c.name, o.amount FROM orders o JOIN customers c ON o.cust = c.customer_id")
+    assert "ON o.customer_id = c.customer_id" in result["sql"]
+    assert result["fixes"][0]["rule"] == "join_key"
+
+
+def test_ambiguous_join_column_takes_the_first_table(shop):
+    result = repair(shop, "SELECT customer_id FROM orders o JOIN customers c ON o.customer_id = c.customer_id")
+    assert result["sql"].startswith("SELECT o.customer_id FROM")
+    assert result["fixes"][0]["rule"] == "ambiguous_column"
+
+
+def test_noise_is_stripped_before_other_rules(shop):
+    result = repair(shop, "```sql\nSELECT nme FROM customers;\n```\nThis lists every name.")
+    assert result["sql"] == "SELECT name FROM customers;"
+    assert [fix["rule"] for fix in result["fixes"]] == ["strip_noise", "column_name"]
+
+
+def test_unrelated_errors_are_left_alone(shop):
+    repairer, _, catalog = shop
+    sql = "SELECT name FROM customers WHERE"
+    assert repairer.repair(sql, "near \"WHERE\": syntax error", catalog) is None
+    assert repairer.stats() == {"attempts": 1, "repaired": 0, "refinements_avoided": 0, "by_rule": {}}
+
+
+def test_gives_up_when_nothing_is_close(shop):
+    repairer = shop[0]
+    assert repair(shop, "SELECT zzqx FROM customers") is None
+    assert repair(shop, "SELECT name FROM warehouse_inventory") is None
+    assert repairer.stats()["attempts"] == 2 and repairer.stats()["repaired"] == 0
+
+
+def test_stats_count_rules_of_successful_repairs(shop):
+    repairer = shop[0]
+    repair(shop, "SELECT nme FROM customers")
+    repair(shop, "SELECT zzqx FROM customers")
+    stats = repairer.stats()
+    assert stats["attempts"] == 2 and stats["repaired"] == 1
+    assert stats["by_rule"] == {"column_name": 1}
@@ -0,0 +1,98 @@
+import sqlite3
+import threading
+
+import pytest
+
+from backend.connection_pool import SQLiteConnectionPool
+from backend.schema_extractor import SchemaExtractor
+from backend.value_index import ValueIndex
+
+
+@pytest.fixture
+def db(tmp_path):
+    path = str(tmp_path / "shop.db")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE customers (id INTEGER PRIMARY KEY, state TEXT)")
+    conn.executemany("INSERT INTO customers (state) VALUES (?)", [("California",), ("Nevada",)] * 50)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def write(path, sql):
+    conn = sqlite3.connect(path)
+    conn.execute(sql)
+    conn.commit()
+    conn.close()
+
+
+def open_index(db, tmp_path, **kwargs):
+    pool = SQLiteConnectionPool(db)
+    extractor = SchemaExtractor(db, pool=pool)
+    index = ValueIndex(db, pool=pool, index_path=str(tmp_path / "values.json.gz"), **kwargs)
+    return index, extractor
+
+
+def test_data_changes_reach_the_index(db, tmp_path):
+    index, extractor = open_index(db, tmp_path, refresh_interval=0)
+    index.refresh(extractor.get_catalog())
+    assert index.exact("nevada", "customers.state")
+
+    #renamed in place, max(rowid) does not move
+    write(db, "UPDATE customers SET state = 'New Mexico' WHERE state = 'Nevada'")
+    index.refresh(extractor.get_catalog())
+    assert not index.exact("nevada", "customers.state")
+    assert index.exact("new mexico", "customers.state")
+
+    write(db, "INSERT INTO customers (state) VALUES ('Oregon')")
+    index.refresh(extractor.get_catalog())
+    assert index.exact("oregon", "customers.state")
+    index.close()
+
+
+def test_data_checks_are_rate_limited(db, tmp_path):
+    index, extractor = open_index(db, tmp_path, refresh_interval=3600)
+    assert index.refresh(extractor.get_catalog()) is not None
+    write(db, "INSERT INTO customers (state) VALUES ('Oregon')")
+    assert index.refresh(extractor.get_catalog()) is None
+    index.close()
+
+
+def test_readers_never_see_a_half_built_index(db, tmp_path):
+    index, extractor = open_index(db, tmp_path, refresh_interval=0)
+    catalog = extractor.get_catalog()
+    index.refresh(catalog)
+    stop, misses = threading.Event(), []
+
+    def read():
+        while not stop.is_set():
+            sql, _ = index.ground_literals("SELECT id FROM customers WHERE state = 'california'", catalog)
+            if "'California'" not in sql:
+                misses.append(sql)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for n in range(30):
+        write(db, f"UPDATE customers SET id = id WHERE id = {n + 1}")
+        index.refresh(catalog)
+    stop.set()
+    reader.join()
+    index.close()
+    assert not misses
+
+
+def test_only_case_and_whitespace_differences_are_rewritten(db, tmp_path):
+    index, extractor = open_index(db, tmp_path)
+    catalog = extractor.get_catalog()
+    index.refresh(catalog)
+
+    sql, notes = index.ground_literals("SELECT id FROM customers WHERE state = ' california '", catalog)
+    assert "state = 'California'" in sql
+    assert notes == [{"column": "customers.state", "literal": " california ", "replaced_with": "California"}]
+
+    #close to a sampled value, but it may be a real value outside the sample
+    query = "SELECT id FROM customers WHERE state = 'Californa'"
+    sql, notes = index.ground_literals(query, catalog)
+    assert sql == query
+    assert notes == [{"column": "customers.state", "literal": "Californa", "suggestions": ["California"]}]
+    index.close()